@@ -0,0 +1,135 @@
+import time
+import hashlib
+from typing import Optional, Sequence
+
+from .config import settings
+from .coordinator import Coordinator, coordinator
+
+
+# Token buckets kept before idle (full) ones are dropped
+MAX_BUCKETS = 4096
+
+
+class AdmissionError(Exception):
+    """A request was turned away; the client may retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1.0, retry_after)
+
+
+class RateLimitError(AdmissionError):
+    """The client has used up its request quota"""
+
+
+def client_label(api_key: Optional[str], address: Optional[str]) -> str:
+    """Identity used for quotas and fair scheduling (API keys are stored hashed)"""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"ip:{address or 'unknown'}"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float = 1.0) -> float:
+        """Take tokens; returns 0 on success, else seconds until enough accumulate"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """Per-client token buckets (one token per video requested)
+
+    With a shared coordinator the buckets live in its database, so every
+    API process draws on the same quota.
+    """
+
+    def __init__(self, per_minute: float, burst: int, shared: Optional[Coordinator] = None):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.shared = shared
+        self._buckets: dict[str, TokenBucket] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str, videos: int = 1):
+        if not self.enabled:
+            return
+        # A batch larger than the burst could never be admitted otherwise
+        amount = min(videos, self.burst)
+        if self.shared is not None:
+            wait = self.shared.take_tokens(client, amount, self.rate, self.burst)
+        else:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune()
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            wait = bucket.take(amount)
+        if wait > 0:
+            raise RateLimitError(f"Rate limit exceeded for {client}; try again in {wait:.0f}s", wait)
+
+    def _prune(self):
+        for client in [client for client, bucket in self._buckets.items() if bucket.full]:
+            del self._buckets[client]
+
+
+class FairScheduler:
+    """Weighted fair choice between clients with queued jobs
+
+    Weighted round-robin by cost: each client accrues virtual time equal to
+    the estimated work it was served divided by its weight, and the next job
+    comes from the waiting client with the least virtual time. A client that
+    was idle starts level with the least-served waiting client, so it cannot
+    claim the GPU for long on the strength of earlier idleness.
+    """
+
+    def __init__(self, weights: Optional[dict[str, float]] = None):
+        self.weights = weights or {}
+        self._virtual: dict[str, float] = {}
+        self._now = 0.0  # virtual start time of the last job chosen
+
+    def weight(self, client: Optional[str]) -> float:
+        return max(self.weights.get(client or "", 1.0), 1e-6)
+
+    def choose(self, candidates: Sequence[dict]) -> dict:
+        """Pick among each client's next job (dicts with client, work, created_at)"""
+        def start(job: dict) -> float:
+            return max(self._virtual.get(job["client"], 0.0), self._now)
+
+        chosen = min(candidates, key=lambda job: (start(job), job["created_at"]))
+        self._now = start(chosen)
+        self._virtual[chosen["client"]] = self._now + (chosen["work"] or 0.0) / self.weight(chosen["client"])
+
+        if len(self._virtual) > MAX_BUCKETS:
+            # Clients at or behind the current virtual time rejoin there anyway
+            self._virtual = {client: value for client, value in self._virtual.items() if value > self._now}
+        return chosen
+
+
+rate_limiter = RateLimiter(
+    settings.rate_limit_per_minute,
+    settings.rate_limit_burst,
+    shared=coordinator if coordinator.shared else None,
+)
+fair_scheduler = FairScheduler(settings.client_weights)
@@ -1,26 +1,104 @@
+import os
 import json
 import uuid
+import shutil
 import asyncio
+import logging
 import aiohttp
+from collections import OrderedDict
 from typing import Optional, Callable
 from pathlib import Path
+from urllib.parse import urlencode
+
+
+logger = logging.getLogger(__name__)
+
+# Terminal events received for prompts nobody is waiting on yet (e.g. a very
+# short prompt finishing before wait_for_completion registers) are kept here.
+MAX_ORPHAN_PROMPTS = 64
+MAX_ORPHAN_EVENTS = 32
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# While the socket is down, poll /history this often to detect a dead server
+DISCONNECT_POLL_INTERVAL = 10.0
+
+
+class ComfyUIConnectionError(RuntimeError):
+    """Raised when the ComfyUI server becomes unreachable mid-request"""
 
 
 class ComfyUIClient:
     """Client for interacting with ComfyUI API"""
 
-    def __init__(self, host: str = "127.0.0.1", port: int = 8188):
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8188,
+        output_dir: Optional[Path] = None,
+        output_mode: str = "link",
+    ):
         self.host = host
         self.port = port
+        self.output_dir = output_dir
+        self.output_mode = output_mode
         self.base_url = f"http://{host}:{port}"
         self.client_id = str(uuid.uuid4())
 
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws_task: Optional[asyncio.Task] = None
+        self._ws_connected = asyncio.Event()
+        self._watchers: dict[str, asyncio.Queue] = {}
+        self._orphans: OrderedDict[str, list[dict]] = OrderedDict()
+        self._running_prompt: Optional[str] = None
+        # WebSocket connections made so far; a reconnect may mean ComfyUI restarted
+        self.connections = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session, created lazily if start() was not called"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def start(self):
+        """Open the connection pool and the shared WebSocket reader"""
+        _ = self.session
+        if self._ws_task is None or self._ws_task.done():
+            self._ws_task = asyncio.create_task(self._ws_loop(), name="comfyui-ws")
+
+    async def close(self):
+        """Stop the WebSocket reader and close the connection pool"""
+        if self._ws_task is not None:
+            self._ws_task.cancel()
+            await asyncio.gather(self._ws_task, return_exceptions=True)
+            self._ws_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def get_system_stats(self) -> dict:
+        """Fetch /system_stats (device, VRAM, versions)"""
+        async with self.session.get(f"{self.base_url}/system_stats", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def get_queue(self) -> dict:
+        """Fetch /queue (running and pending prompts)"""
+        async with self.session.get(f"{self.base_url}/queue", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
     async def is_available(self) -> bool:
         """Check if ComfyUI server is available"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.base_url}/system_stats", timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                    return resp.status == 200
+            async with self.session.get(f"{self.base_url}/system_stats", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                return resp.status == 200
         except Exception:
             return False
 
@@ -31,67 +109,218 @@ class ComfyUIClient:
             "client_id": self.client_id
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/prompt",
-                json=payload
+        async with self.session.post(
+            f"{self.base_url}/prompt",
+            json=payload
+        ) as resp:
+            if resp.status != 200:
+                error = await resp.text()
+                raise RuntimeError(f"Failed to queue prompt: {error}")
+            result = await resp.json()
+            return result["prompt_id"]
+
+    async def upload_image(self, path: Path, name: Optional[str] = None, subfolder: str = "shortgen") -> str:
+        """Upload an image to ComfyUI's input directory and return its LoadImage name"""
+        data = aiohttp.FormData()
+        content = await asyncio.to_thread(path.read_bytes)
+        data.add_field("image", content, filename=name or path.name, content_type="image/png")
+        data.add_field("subfolder", subfolder)
+        data.add_field("type", "input")
+        data.add_field("overwrite", "true")
+
+        async with self.session.post(f"{self.base_url}/upload/image", data=data) as resp:
+            if resp.status != 200:
+                error = await resp.text()
+                raise RuntimeError(f"Failed to upload image: {error}")
+            result = await resp.json()
+        if result.get("subfolder"):
+            return f"{result['subfolder']}/{result['name']}"
+        return result["name"]
+
+    async def free(self, unload_models: bool = True, free_memory: bool = True):
+        """Ask ComfyUI to unload its models and release cached memory (/free)"""
+        async with self.session.post(
+            f"{self.base_url}/free",
+            json={"unload_models": unload_models, "free_memory": free_memory},
+            timeout=aiohttp.ClientTimeout(total=30),
+        ) as resp:
+            resp.raise_for_status()
+
+    async def cancel_prompt(self, prompt_id: str):
+        """Drop a prompt from ComfyUI's queue, interrupting it if it already started"""
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with self.session.post(
+            f"{self.base_url}/queue", json={"delete": [prompt_id]}, timeout=timeout
+        ) as resp:
+            resp.raise_for_status()
+        # /interrupt stops whatever is running, so only send it for our prompt
+        queue = await self.get_queue()
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            async with self.session.post(
+                f"{self.base_url}/interrupt", json={"prompt_id": prompt_id}, timeout=timeout
             ) as resp:
-                if resp.status != 200:
-                    error = await resp.text()
-                    raise RuntimeError(f"Failed to queue prompt: {error}")
-                result = await resp.json()
-                return result["prompt_id"]
+                resp.raise_for_status()
 
     async def get_history(self, prompt_id: str) -> Optional[dict]:
         """Get execution history for a prompt"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.base_url}/history/{prompt_id}") as resp:
-                if resp.status != 200:
-                    return None
-                history = await resp.json()
-                return history.get(prompt_id)
+        async with self.session.get(f"{self.base_url}/history/{prompt_id}") as resp:
+            if resp.status != 200:
+                return None
+            history = await resp.json()
+            return history.get(prompt_id)
+
+    async def _ws_loop(self):
+        """Read the shared WebSocket and route events to per-prompt watchers"""
+        ws_url = f"ws://{self.host}:{self.port}/ws?clientId={self.client_id}"
+        backoff = 1.0
+
+        while True:
+            try:
+                async with self.session.ws_connect(ws_url, heartbeat=30) as ws:
+                    self._ws_connected.set()
+                    self.connections += 1
+                    backoff = 1.0
+                    # Prompts may have finished while we were disconnected
+                    await self._resync_watchers()
+
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._dispatch(json.loads(msg.data))
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            raise RuntimeError(f"WebSocket error: {ws.exception()}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("ComfyUI WebSocket %s disconnected: %s", self.address, e)
+            finally:
+                if self._ws_connected.is_set():
+                    for watcher in self._watchers.values():
+                        watcher.put_nowait({"type": "_disconnected"})
+                self._ws_connected.clear()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _dispatch(self, data: dict):
+        msg_type = data.get("type")
+        msg_data = data.get("data") or {}
+        if not isinstance(msg_data, dict):
+            return
+
+        prompt_id = msg_data.get("prompt_id")
+        if msg_type in ("execution_start", "executing") and prompt_id:
+            self._running_prompt = prompt_id
+        if prompt_id is None and msg_type == "progress":
+            # Older ComfyUI builds omit prompt_id on progress events
+            prompt_id = self._running_prompt
+        if prompt_id is None:
+            return
+
+        watcher = self._watchers.get(prompt_id)
+        if watcher is not None:
+            watcher.put_nowait(data)
+            return
+
+        if msg_type in ("executing", "execution_error", "execution_interrupted", "execution_start"):
+            events = self._orphans.setdefault(prompt_id, [])
+            events.append(data)
+            del events[:-MAX_ORPHAN_EVENTS]
+            self._orphans.move_to_end(prompt_id)
+            while len(self._orphans) > MAX_ORPHAN_PROMPTS:
+                self._orphans.popitem(last=False)
+
+    async def _resync_watchers(self):
+        for prompt_id, watcher in list(self._watchers.items()):
+            try:
+                history = await self.get_history(prompt_id)
+            except Exception:
+                continue
+            if history:
+                watcher.put_nowait({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
 
     async def wait_for_completion(
         self,
         prompt_id: str,
         progress_callback: Optional[Callable] = None,
-        timeout: int = 3600
+        timeout: Optional[float] = None
     ) -> dict:
-        """Wait for workflow execution to complete using WebSocket"""
-        ws_url = f"ws://{self.host}:{self.port}/ws?clientId={self.client_id}"
+        """Wait for workflow execution to complete using the shared WebSocket
+
+        progress_callback(fraction, step, total, node) is called for every
+        sampler step and whenever ComfyUI starts executing a new node.
+        Without a timeout it waits until cancelled; job deadlines are
+        enforced by the job queue, which also cancels the prompt.
+        """
+        if self._ws_task is None:
+            await self.start()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(ws_url) as ws:
-                start_time = asyncio.get_event_loop().time()
+        watcher: asyncio.Queue = asyncio.Queue()
+        for event in self._orphans.pop(prompt_id, []):
+            watcher.put_nowait(event)
+        self._watchers[prompt_id] = watcher
 
-                async for msg in ws:
-                    if asyncio.get_event_loop().time() - start_time > timeout:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        current_node: Optional[str] = None
+
+        try:
+            # The prompt may have completed before the socket was connected
+            if not self._ws_connected.is_set():
+                await self._resync_watchers()
+
+            while True:
+                wait = DISCONNECT_POLL_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
                         raise TimeoutError("Workflow execution timed out")
+                    wait = min(remaining, wait)
+                try:
+                    data = await asyncio.wait_for(watcher.get(), wait)
+                except asyncio.TimeoutError:
+                    if self._ws_connected.is_set():
+                        continue
+                    data = {"type": "_disconnected"}
 
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = json.loads(msg.data)
-                        msg_type = data.get("type")
+                msg_type = data.get("type")
 
-                        if msg_type == "progress":
-                            progress_data = data.get("data", {})
-                            current = progress_data.get("value", 0)
-                            total = progress_data.get("max", 1)
-                            if progress_callback:
-                                progress_callback(current / total if total > 0 else 0)
+                if msg_type == "progress":
+                    progress_data = data.get("data", {})
+                    current = progress_data.get("value", 0)
+                    total = progress_data.get("max", 1)
+                    if progress_callback:
+                        progress_callback(
+                            current / total if total > 0 else 0,
+                            current,
+                            total,
+                            progress_data.get("node") or current_node,
+                        )
 
-                        elif msg_type == "executing":
-                            exec_data = data.get("data", {})
-                            if exec_data.get("prompt_id") == prompt_id:
-                                if exec_data.get("node") is None:
-                                    # Execution completed
-                                    break
+                elif msg_type == "executing":
+                    exec_data = data.get("data", {})
+                    if exec_data.get("node") is None:
+                        # Execution completed
+                        break
+                    current_node = exec_data["node"]
+                    if progress_callback:
+                        progress_callback(0.0, 0, 0, current_node)
 
-                        elif msg_type == "execution_error":
-                            error_data = data.get("data", {})
-                            raise RuntimeError(f"Execution error: {error_data}")
+                elif msg_type == "execution_error":
+                    error_data = data.get("data", {})
+                    raise RuntimeError(f"Execution error: {error_data}")
 
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        raise RuntimeError(f"WebSocket error: {ws.exception()}")
+                elif msg_type == "execution_interrupted":
+                    raise RuntimeError("Execution was interrupted")
+
+                elif msg_type == "_disconnected":
+                    # Distinguish a dropped socket from a dead server
+                    try:
+                        if await self.get_history(prompt_id):
+                            break
+                    except aiohttp.ClientError as e:
+                        raise ComfyUIConnectionError(f"Lost connection to ComfyUI at {self.address}: {e}")
+        finally:
+            self._watchers.pop(prompt_id, None)
 
         # Get final result from history
         history = await self.get_history(prompt_id)
@@ -100,40 +329,99 @@ class ComfyUIClient:
 
         return history
 
-    async def get_output_video(self, history: dict) -> Optional[str]:
-        """Extract output video path from execution history"""
+    def get_output_file(self, history: dict, node_id: Optional[str] = None) -> Optional[dict]:
+        """Find the first video output ({filename, subfolder, type}) in execution history"""
         outputs = history.get("outputs", {})
+        if node_id is not None:
+            outputs = {node_id: outputs.get(node_id, {})}
 
-        for node_id, node_output in outputs.items():
-            if "gifs" in node_output:
-                for gif in node_output["gifs"]:
-                    filename = gif.get("filename")
-                    subfolder = gif.get("subfolder", "")
-                    if filename:
-                        return f"{self.base_url}/view?filename={filename}&subfolder={subfolder}&type=output"
-            if "videos" in node_output:
-                for video in node_output["videos"]:
-                    filename = video.get("filename")
-                    subfolder = video.get("subfolder", "")
-                    if filename:
-                        return f"{self.base_url}/view?filename={filename}&subfolder={subfolder}&type=output"
+        for node_output in outputs.values():
+            keys = ["gifs", "videos"]
+            # SaveWEBM / SaveAnimatedWEBP / SaveAnimatedPNG report under "images"
+            if any(node_output.get("animated") or []):
+                keys.append("images")
+            for key in keys:
+                for item in node_output.get(key, []):
+                    if item.get("filename"):
+                        return {
+                            "filename": item["filename"],
+                            "subfolder": item.get("subfolder", ""),
+                            "type": item.get("type", "output"),
+                        }
 
         return None
 
+    def cached_nodes(self, history: dict) -> set[str]:
+        """Nodes ComfyUI served from its output cache instead of executing"""
+        nodes: set[str] = set()
+        for message in history.get("status", {}).get("messages", []):
+            if len(message) == 2 and message[0] == "execution_cached":
+                nodes.update(message[1].get("nodes", []))
+        return nodes
+
+    def view_url(self, output: dict) -> str:
+        query = urlencode({
+            "filename": output["filename"],
+            "subfolder": output.get("subfolder", ""),
+            "type": output.get("type", "output"),
+        })
+        return f"{self.base_url}/view?{query}"
+
+    async def get_output_video(self, history: dict, node_id: Optional[str] = None) -> Optional[str]:
+        """Extract output video URL from execution history (optionally of one node)"""
+        output = self.get_output_file(history, node_id)
+        return self.view_url(output) if output else None
+
     async def download_video(self, video_url: str, output_path: Path) -> str:
-        """Download video from ComfyUI to local path"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(video_url) as resp:
-                if resp.status != 200:
-                    raise RuntimeError(f"Failed to download video: {resp.status}")
+        """Download video from ComfyUI to local path
+
+        Data is written in large blocks from a worker thread into a temporary
+        file that is renamed into place, so readers never see partial files.
+        """
+        partial = output_path.with_name(output_path.name + ".part")
+        async with self.session.get(video_url) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"Failed to download video: {resp.status}")
 
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(output_path, 'wb') as f:
-                    async for chunk in resp.content.iter_chunked(8192):
-                        f.write(chunk)
+            await asyncio.to_thread(output_path.parent.mkdir, parents=True, exist_ok=True)
+            f = await asyncio.to_thread(open, partial, 'wb')
+            try:
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    buffer += chunk
+                    if len(buffer) >= DOWNLOAD_CHUNK_SIZE:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+            except BaseException:
+                await asyncio.to_thread(f.close)
+                partial.unlink(missing_ok=True)
+                raise
+            await asyncio.to_thread(f.close)
 
+        await asyncio.to_thread(os.replace, partial, output_path)
         return str(output_path)
 
+    def _take_local_output(self, source: Path, output_path: Path):
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.output_mode == "move":
+            shutil.move(source, output_path)
+            return
+        try:
+            os.link(source, output_path)
+        except OSError:
+            shutil.copyfile(source, output_path)
+
+    async def fetch_output(self, output: dict, output_path: Path) -> str:
+        """Bring a ComfyUI output to output_path
 
-# Global client instance
-comfyui_client = ComfyUIClient()
+        When ComfyUI's output directory is mounted locally the file is
+        hardlinked (or moved) instead of being copied over HTTP.
+        """
+        if self.output_dir is not None and output.get("type", "output") == "output":
+            source = self.output_dir / output.get("subfolder", "") / output["filename"]
+            if await asyncio.to_thread(source.is_file):
+                await asyncio.to_thread(self._take_local_output, source, output_path)
+                return str(output_path)
+        return await self.download_video(self.view_url(output), output_path)
@@ -0,0 +1,219 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from .config import settings
+from .comfyui_client import ComfyUIClient
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_backend(address: str) -> tuple[str, int]:
+    """Split "host:port" (optionally prefixed with http://) into its parts"""
+    address = address.strip().removeprefix("http://").removeprefix("https://").rstrip("/")
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address, 8188
+    return host, int(port)
+
+
+class BackendNode:
+    """A single ComfyUI server and its last observed health and load"""
+
+    def __init__(self, client: ComfyUIClient):
+        self.client = client
+        self.healthy = False
+        self.active_jobs = 0
+        self.queue_running = 0
+        self.queue_pending = 0
+        self.system_stats: dict = {}
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # Model residency: warm once a prompt has run since the last (re)connect
+        self.warm = False
+        self.warming = False
+        self.warm_connection: Optional[int] = None  # client.connections the state refers to
+        self.last_active = time.time()
+        self.warmup_error: Optional[str] = None
+
+    @property
+    def model_state(self) -> str:
+        if self.warming:
+            return "warming"
+        return "warm" if self.warm and self.available else "cold"
+
+    @property
+    def idle_seconds(self) -> float:
+        if self.active_jobs or self.queue_remaining or self.warming:
+            return 0.0
+        return time.time() - self.last_active
+
+    @property
+    def queue_remaining(self) -> int:
+        return self.queue_running + self.queue_pending
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the last probe is recent enough to trust"""
+        return self.last_check is not None and time.time() - self.last_check <= settings.health_ttl
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.fresh
+
+    @property
+    def address(self) -> str:
+        return self.client.address
+
+    @property
+    def load(self) -> int:
+        # /queue also counts prompts we dispatched, so take the larger view
+        return max(self.active_jobs, self.queue_remaining)
+
+    def to_dict(self) -> dict:
+        devices = self.system_stats.get("devices") or [{}]
+        device = devices[0]
+        return {
+            "address": self.address,
+            "healthy": self.available,
+            "active_jobs": self.active_jobs,
+            "queue_running": self.queue_running,
+            "queue_pending": self.queue_pending,
+            "device": device.get("name"),
+            "device_type": device.get("type"),
+            "vram_total": device.get("vram_total"),
+            "vram_free": device.get("vram_free"),
+            "comfyui_version": self.system_stats.get("system", {}).get("comfyui_version"),
+            "last_check": self.last_check,
+            "age_seconds": round(time.time() - self.last_check, 1) if self.last_check else None,
+            "last_error": self.last_error,
+            "model_state": self.model_state,
+            "idle_seconds": round(self.idle_seconds, 1),
+            "warmup_error": self.warmup_error,
+        }
+
+
+class ComfyUIPool:
+    """Health-checked set of ComfyUI backends with least-loaded dispatch
+
+    A background task probes every backend each check_interval seconds;
+    request handlers only read the cached snapshot.
+    """
+
+    def __init__(self, addresses: list[str], check_interval: float = 5.0):
+        self.nodes = [
+            BackendNode(ComfyUIClient(
+                *parse_backend(address),
+                output_dir=settings.comfyui_output_dir,
+                output_mode=settings.comfyui_output_mode,
+            ))
+            for address in addresses
+        ]
+        self.check_interval = check_interval
+        self._changed = asyncio.Condition()
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        for node in self.nodes:
+            await node.client.start()
+        await self.check_all()
+        self._health_task = asyncio.create_task(self._health_loop(), name="comfyui-health")
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for node in self.nodes:
+            await node.client.close()
+
+    async def check_node(self, node: BackendNode):
+        """Probe /system_stats and /queue and record the node's state"""
+        try:
+            stats, queue = await asyncio.gather(node.client.get_system_stats(), node.client.get_queue())
+            node.system_stats = stats
+            node.queue_running = len(queue.get("queue_running", []))
+            node.queue_pending = len(queue.get("queue_pending", []))
+            if not node.healthy:
+                logger.info("ComfyUI backend %s is up", node.address)
+            node.healthy = True
+            node.last_error = None
+        except Exception as e:
+            if node.healthy:
+                logger.warning("ComfyUI backend %s is down: %s", node.address, e)
+            node.healthy = False
+            node.warm = False
+            node.last_error = str(e) or type(e).__name__
+        node.last_check = time.time()
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check_node(node) for node in self.nodes))
+        await self._notify()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def is_available(self) -> bool:
+        """True if at least one backend answered its latest probe (no network I/O)"""
+        return any(node.available for node in self.nodes)
+
+    def _least_loaded(self) -> Optional[BackendNode]:
+        candidates = [
+            node for node in self.nodes
+            if node.available and node.active_jobs < settings.max_jobs_per_backend
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda node: (node.load, node.active_jobs))
+
+    async def acquire(self) -> BackendNode:
+        """Wait for and reserve a slot on the least-loaded healthy backend"""
+        async with self._changed:
+            while True:
+                node = self._least_loaded()
+                if node is not None:
+                    node.active_jobs += 1
+                    return node
+                await self._changed.wait()
+
+    async def release(self, node: BackendNode):
+        node.active_jobs = max(0, node.active_jobs - 1)
+        node.last_active = time.time()
+        await self._notify()
+
+    @asynccontextmanager
+    async def lease(self):
+        node = await self.acquire()
+        try:
+            yield node
+        finally:
+            await self.release(node)
+
+    async def mark_failed(self, node: BackendNode, error: Exception):
+        """Take a backend out of rotation until the next successful health check"""
+        logger.warning("ComfyUI backend %s failed: %s", node.address, error)
+        node.healthy = False
+        node.last_error = str(error)
+        await self._notify()
+
+    def get_node(self, address: str) -> Optional[BackendNode]:
+        return next((node for node in self.nodes if node.address == address), None)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.nodes) * settings.max_jobs_per_backend
+
+    def status(self) -> list[dict]:
+        return [node.to_dict() for node in self.nodes]
+
+
+comfyui_pool = ComfyUIPool(settings.comfyui_backends, settings.backend_check_interval)
@@ -1,17 +1,116 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Literal, Optional
 
 
 class Settings(BaseSettings):
+    # Generation engine: "comfyui" (workflow graphs on ComfyUI servers) or
+    # "diffusers" (in-process pipeline in a dedicated worker process)
+    engine: Literal["comfyui", "diffusers"] = "comfyui"
+    preload_model: bool = True  # diffusers: load the pipeline at startup
+
     # Model settings (WAN 2.1 1.3B - lightweight model, ~8GB VRAM)
     model_id: str = "Wan-AI/Wan2.1-T2V-1.3B-Diffusers"
 
     # Output settings
     output_dir: Path = Path("outputs")
 
+    # ComfyUI backends ("host:port"; set as a JSON list in the environment)
+    comfyui_backends: list[str] = ["127.0.0.1:8188"]
+    backend_check_interval: float = 5.0  # seconds between /system_stats + /queue probes
+    health_ttl: float = 15.0  # seconds a probe result stays valid
+    max_jobs_per_backend: int = 1  # prompts dispatched concurrently to one ComfyUI
+    max_job_attempts: int = 3  # dispatch attempts before a job fails on backend errors
+    # ComfyUI's output directory when it is on the same filesystem; outputs are
+    # then hardlinked ("link") or renamed ("move") instead of downloaded
+    comfyui_output_dir: Optional[Path] = None
+    comfyui_output_mode: Literal["link", "move"] = "link"
+
+    # Model residency (warm-up prompt with the template's loaders; /free after idle)
+    warmup_on_start: bool = True  # warm each ComfyUI backend when it (re)connects
+    warmup_timeout: float = 900.0  # seconds; loading two 14B UNets from disk is slow
+    model_idle_timeout: float = 0.0  # seconds idle before models are unloaded, 0 keeps them resident
+
+    # Job queue settings
+    data_dir: Path = Path("data")
+    max_queue_size: int = 32
+    num_workers: int = 0  # 0 = one per backend slot
+    max_batch_items: int = 8  # videos per /api/generate/batch request
+    default_job_duration: float = 420.0  # seconds, used for ETA until history exists
+    job_timeout: float = 1800.0  # wall-clock seconds a job may run (per batch item), 0 disables
+    coalesce_requests: bool = True  # identical submissions join the job already queued or running
+
+    # Admission control (clients are "key:<hash of X-API-Key>" or "ip:<address>")
+    rate_limit_per_minute: float = 6.0  # videos per client per minute (token bucket), 0 disables
+    rate_limit_burst: int = 8  # videos a client may request at once
+    max_queued_gpu_seconds: float = 4 * 3600.0  # estimated GPU time waiting or running, 0 disables
+    client_weights: dict[str, float] = {}  # fair-share weight per client label (default 1)
+
+    # Result cache settings (content-addressed store under output_dir/.cache)
+    result_cache_enabled: bool = True
+    result_cache_max_bytes: int = 20 * 1024**3
+    result_cache_max_age: float = 7 * 24 * 3600.0  # seconds, 0 disables expiry
+
+    # Text-encoding cache (diffusers engine: prompt embeddings in memory and
+    # under data_dir/text_cache; ComfyUI caches node outputs itself, see --cache-lru)
+    text_cache_enabled: bool = True
+    text_cache_entries: int = 64  # embeddings kept in memory
+    text_cache_max_bytes: int = 2 * 1024**3  # on disk
+
+    # Resolution planning (largest 16-divisible size that fits the memory budget)
+    memory_budget_gb: float = 24.0  # VRAM / unified memory available to ComfyUI
+    weights_memory_gb: float = 10.0  # resident model weights, not available for activations
+    max_long_side: int = 1280  # WAN 2.2 A14B is trained up to 720p
+    upscale_long_side: int = 0  # e.g. 1920 for a 1080x1920 upscale pass, 0 disables
+
+    # VAE decode ("tiled" decodes spatial tiles and frame windows so peak memory
+    # no longer grows with resolution and clip length)
+    vae_decode: Literal["full", "tiled"] = "full"
+    vae_tile_size: int = 256  # pixels, multiple of 32
+    vae_tile_overlap: int = 64
+    vae_temporal_size: int = 32  # frames per window, multiple of 4
+    vae_temporal_overlap: int = 8
+    # How much larger pixels x frames may get when decode is tiled (sampling
+    # becomes the limit instead of decode)
+    vae_tiled_headroom: float = 2.0
+
+    # Draft quality mode (fast previews that can be promoted to full quality)
+    draft_steps: int = 8
+    draft_num_frames: int = 33
+    draft_scale: float = 0.5  # fraction of the full width/height
+
+    # Sampling speed presets (quality / balanced / fast): step caching and the
+    # high/low-noise split; requests pick one with "speed"
+    speed_preset: Literal["quality", "balanced", "fast"] = "quality"
+    # Per-preset overrides of SpeedProfile fields, e.g. {"fast": {"high_noise_split": 0.35}}
+    speed_profiles: dict[str, dict[str, float]] = {}
+
+    # Long videos (/api/generate/long): overlapping segments, each conditioned
+    # on the last frames of the previous one and crossfaded over the overlap
+    long_video_template: str = "wan22_i2v"  # image-to-video template for every segment after the first
+    segment_frames: int = 81  # frames per segment (4k+1); bounds peak memory like a single clip
+    segment_overlap_frames: int = 9  # frames shared by consecutive segments (4k+1)
+    max_long_video_seconds: float = 60.0
+
+    # Output encoding (ComfyUI's WebM is transcoded with a local ffmpeg)
+    video_codec: Literal["h264", "h265", "copy"] = "h264"  # "copy" keeps ComfyUI's file
+    video_crf: int = 20
+    video_preset: str = "medium"  # x264/x265 preset: ultrafast ... veryslow
+    preview_height: int = 0  # height of the low-bitrate preview rendition, 0 disables
+    preview_crf: int = 32
+    poster_enabled: bool = True  # JPEG of the first frame next to each video
+    ffmpeg_path: str = "ffmpeg"
+
+    # Workflow templates
+    workflow_reload: bool = False  # re-read template files when they change on disk
+
     # Server settings
     host: str = "0.0.0.0"
     port: int = 8000
+    # API processes (run.py --workers); with more than one they share state
+    # under data_dir and one of them is elected to drive the engine
+    workers: int = 1
+    coordination_poll_interval: float = 0.25  # seconds between checks for shared job/command changes
 
     # Device settings
     device: str = "cuda"  # or "mps" for Mac, "cpu" for CPU
@@ -22,5 +121,6 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# Ensure output directory exists
+# Ensure output and data directories exist
 settings.output_dir.mkdir(parents=True, exist_ok=True)
+settings.data_dir.mkdir(parents=True, exist_ok=True)
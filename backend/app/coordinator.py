@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from .config import settings
+from .database import connect
+from .engine import engine
+from .metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Seconds between attempts of a follower to take over the coordinator lock
+ELECTION_INTERVAL = 2.0
+# Seconds between engine status snapshots published by the coordinator
+PUBLISH_INTERVAL = 1.0
+# A snapshot older than this means there is no live coordinator
+ENGINE_STATE_TTL = 10.0
+# Seconds between metric snapshots written by every process
+METRICS_FLUSH_INTERVAL = 5.0
+# Seconds a command may wait for its result (model loads can take minutes)
+COMMAND_TIMEOUT = 600.0
+
+
+class Coordinator:
+    """Leader election and shared state for multi-process serving
+
+    With settings.workers > 1 every API process serves HTTP, but exactly one
+    of them - whichever holds an exclusive lock on data_dir/coordinator.lock
+    - starts the engine and drains the job queue. Jobs are shared through
+    jobs.db already; this class covers the rest: the coordinator publishes
+    engine status for the others, runs commands (model load/unload, job
+    cancellation) they enqueue, and all processes share rate-limit buckets
+    and metric snapshots. The lock dies with its process, so another one
+    takes over if the coordinator exits.
+
+    With a single process it is always the coordinator and commands run
+    directly.
+    """
+
+    def __init__(self, data_dir: Path, shared: bool):
+        self.data_dir = data_dir
+        self.shared = shared
+        self.is_leader = not shared
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._handlers: dict[str, Callable[..., Awaitable[Any]]] = {
+            "load_model": engine.load,
+            "unload_model": engine.unload,
+        }
+        self._on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self._tasks: list[asyncio.Task] = []
+        self._takes = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            self._conn = connect(self.data_dir / "coordinator.db", SCHEMA)
+        return self._conn
+
+    def handle(self, command: str, handler: Callable[..., Awaitable[Any]]):
+        """Register what the coordinator runs for a command (results must be JSON)"""
+        self._handlers[command] = handler
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]]):
+        """Run on_elected() now, or in shared mode once this process wins the election"""
+        if not self.shared:
+            await on_elected()
+            return
+        self._on_elected = on_elected
+        self._tasks = [
+            asyncio.create_task(self._election_loop(), name="coordinator-election"),
+            asyncio.create_task(self._flush_metrics_loop(), name="coordinator-metrics"),
+        ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if not self.shared:
+            return
+        await asyncio.to_thread(self._flush_metrics)
+        if self._lock_file is not None:
+            # Closing the file releases the lock for the next coordinator
+            self._lock_file.close()
+            self._lock_file = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _try_lock(self) -> bool:
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.data_dir / "coordinator.lock", "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    async def _election_loop(self):
+        while not self._try_lock():
+            await asyncio.sleep(ELECTION_INTERVAL)
+        logger.info("Process %d is the coordinator", os.getpid())
+        self.is_leader = True
+        await asyncio.to_thread(self._prune)
+        await self._on_elected()
+        self._tasks += [
+            asyncio.create_task(self._publish_loop(), name="coordinator-publish"),
+            asyncio.create_task(self._command_loop(), name="coordinator-commands"),
+        ]
+
+    def _prune(self):
+        """Forget commands nobody waits for and metrics of processes that exited"""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM commands WHERE created_at < ?", (time.time() - COMMAND_TIMEOUT,))
+            for (key,) in conn.execute("SELECT key FROM state WHERE key LIKE 'metrics:%'").fetchall():
+                try:
+                    os.kill(int(key.split(":", 1)[1]), 0)
+                except ProcessLookupError:
+                    conn.execute("DELETE FROM state WHERE key = ?", (key,))
+                except (ValueError, PermissionError):
+                    pass
+
+    # Shared key/value state
+
+    def _write(self, key: str, value: Any):
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+
+    def _read(self, key: str, max_age: Optional[float] = None) -> Any:
+        with self._lock:
+            row = self._db().execute("SELECT value, updated_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return json.loads(row[0])
+
+    # Engine status
+
+    def _engine_snapshot(self) -> dict:
+        return {
+            "available": engine.is_available(),
+            "loaded": engine.is_loaded(),
+            "model_state": engine.model_state(),
+            "backends": engine.status(),
+        }
+
+    def engine_state(self) -> dict:
+        """Availability, model state and backends as the coordinator sees them"""
+        if self.is_leader:
+            return self._engine_snapshot()
+        state = self._read("engine", max_age=ENGINE_STATE_TTL)
+        if state is None:
+            return {"available": False, "loaded": False, "model_state": "cold", "backends": []}
+        return state
+
+    async def _publish_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._write, "engine", self._engine_snapshot())
+            except Exception:
+                logger.exception("Failed to publish engine status")
+            await asyncio.sleep(PUBLISH_INTERVAL)
+
+    # Commands
+
+    async def request(self, command: str, **args) -> Any:
+        """Run a command on the coordinator and return its result"""
+        if self.is_leader:
+            return await self._handlers[command](**args)
+
+        def enqueue() -> int:
+            with self._lock:
+                cursor = self._db().execute(
+                    "INSERT INTO commands (command, args, created_at) VALUES (?, ?, ?)",
+                    (command, json.dumps(args), time.time()),
+                )
+                return cursor.lastrowid
+
+        def result(command_id: int) -> Optional[tuple[str, Optional[str]]]:
+            with self._lock:
+                return self._db().execute(
+                    "SELECT status, result FROM commands WHERE id = ?", (command_id,)
+                ).fetchone()
+
+        command_id = await asyncio.to_thread(enqueue)
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.coordination_poll_interval)
+            row = await asyncio.to_thread(result, command_id)
+            if row is None:
+                break
+            status, value = row
+            if status == "done":
+                return json.loads(value)
+            if status == "error":
+                raise RuntimeError(value)
+        raise TimeoutError(f"The coordinator did not run {command}")
+
+    async def _command_loop(self):
+        def claim() -> list[tuple[int, str, str]]:
+            with self._lock:
+                conn = self._db()
+                rows = conn.execute(
+                    "SELECT id, command, args FROM commands WHERE status = 'pending' ORDER BY id"
+                ).fetchall()
+                if rows:
+                    conn.execute(
+                        f"UPDATE commands SET status = 'running' WHERE id IN ({','.join('?' * len(rows))})",
+                        [row[0] for row in rows],
+                    )
+                return rows
+
+        while True:
+            await asyncio.sleep(settings.coordination_poll_interval)
+            try:
+                rows = await asyncio.to_thread(claim)
+            except sqlite3.Error:
+                logger.exception("Failed to read coordinator commands")
+                continue
+            for command_id, command, args in rows:
+                asyncio.create_task(self._run_command(command_id, command, json.loads(args)))
+
+    async def _run_command(self, command_id: int, command: str, args: dict):
+        try:
+            handler = self._handlers[command]
+            status, value = "done", json.dumps(await handler(**args))
+        except Exception as e:
+            logger.exception("Command %s failed", command)
+            status, value = "error", str(e)
+
+        def store():
+            with self._lock:
+                self._db().execute(
+                    "UPDATE commands SET status = ?, result = ? WHERE id = ?", (status, value, command_id)
+                )
+
+        await asyncio.to_thread(store)
+
+    # Rate limits
+
+    def take_tokens(self, client: str, amount: float, rate: float, burst: float) -> float:
+        """Token bucket shared by all processes; 0 on success, else seconds to wait"""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE client = ?", (client,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0
+                if tokens >= amount:
+                    tokens -= amount
+                else:
+                    wait = (amount - tokens) / rate
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (client, tokens, updated_at) VALUES (?, ?, ?)",
+                    (client, tokens, now),
+                )
+                self._takes += 1
+                if self._takes % 1024 == 0:
+                    # Buckets idle long enough to have refilled are the same as absent ones
+                    conn.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - burst / rate,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    # Metrics
+
+    def _flush_metrics(self):
+        self._write(f"metrics:{os.getpid()}", registry.snapshot())
+
+    async def _flush_metrics_loop(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self._flush_metrics)
+            except Exception:
+                logger.exception("Failed to write metrics snapshot")
+
+    def metric_snapshots(self) -> list[dict]:
+        """Counter and histogram snapshots of the other processes"""
+        if not self.shared:
+            return []
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT value FROM state WHERE key LIKE 'metrics:%' AND key != ?", (f"metrics:{os.getpid()}",)
+            ).fetchall()
+        return [json.loads(value) for (value,) in rows]
+
+
+coordinator = Coordinator(settings.data_dir, shared=settings.workers > 1)
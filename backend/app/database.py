@@ -0,0 +1,44 @@
+import time
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+
+# Seconds a connection waits for another process to release a lock
+BUSY_TIMEOUT = 30.0
+
+
+def connect(db_path: Path, schema: str, migrations: Optional[dict[str, dict[str, str]]] = None) -> sqlite3.Connection:
+    """Open a WAL database that several processes may share and bring its schema up to date
+
+    migrations maps a table to columns added after its initial schema; they
+    are created on open for older databases.
+    """
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    # Switching a new database to WAL needs an exclusive lock and does not
+    # wait on the busy timeout, so processes starting together retry
+    deadline = time.monotonic() + BUSY_TIMEOUT
+    while True:
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            break
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    # One write transaction, so concurrent processes apply each change once
+    conn.executescript("BEGIN IMMEDIATE;\n" + schema)
+    try:
+        for table, columns in (migrations or {}).items():
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return conn
@@ -0,0 +1,249 @@
+import uuid
+import queue
+import time
+import asyncio
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Any, Optional
+
+from .config import settings
+from .models import VideoGenerationRequest, VideoBatchRequest
+from .engine import Engine, BackendLostError, incoming_path
+from .diffusers_worker import worker_main
+from .workflow_builder import workflow_builder
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between worker spawns, so a worker that dies on startup
+# (missing torch, bad model id) is not restarted in a tight loop
+RESPAWN_DELAY = 5.0
+
+
+class DiffusersEngine(Engine):
+    """Runs the WAN pipeline with diffusers in a dedicated worker process
+
+    The pipeline is loaded once and stays resident between jobs; load() and
+    unload() control residency explicitly. The worker is a separate process
+    so a crash or out-of-memory kill does not take the server down: pending
+    jobs fail with BackendLostError (and are re-queued) and a fresh worker
+    is spawned.
+    """
+
+    name = "diffusers"
+    supports_batch = False
+    unavailable_message = "Diffusers worker is not running"
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._spawned_at = 0.0
+        self._commands = None
+        self._events = None
+        self._cancelled = None
+        self._generation = 0
+        self._reader: Optional[asyncio.Task] = None
+        self._slot = asyncio.Lock()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._runs: dict[str, Any] = {}
+        self.model_loaded = False
+        self.loading = False
+        self.last_active = time.time()
+        self.device: Optional[str] = None
+        self.active_jobs = 0
+        self.last_error: Optional[str] = None
+
+    async def start(self):
+        self._spawn()
+        self._reader = asyncio.create_task(self._read_events(), name="diffusers-events")
+        self._preload()
+
+    def _preload(self):
+        if settings.preload_model:
+            asyncio.create_task(self.load(), name="diffusers-preload")
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        if self._process is not None:
+            self._commands.put(None)
+            await asyncio.to_thread(self._process.join, 10)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def _spawn(self):
+        self._commands = self._context.Queue()
+        self._events = self._context.Queue()
+        self._cancelled = self._context.Value("q", 0)
+        self._process = self._context.Process(
+            target=worker_main,
+            args=(self._commands, self._events, self._cancelled),
+            name="diffusers-worker",
+            daemon=True,
+        )
+        self._process.start()
+        self._spawned_at = time.monotonic()
+        self.model_loaded = False
+        logger.info("Started diffusers worker (pid %d)", self._process.pid)
+
+    def _next_event(self) -> Optional[tuple]:
+        try:
+            return self._events.get(timeout=1.0)
+        except queue.Empty:
+            return None
+
+    async def _read_events(self):
+        """Resolve pending requests from worker events and respawn a dead worker"""
+        while True:
+            event = await asyncio.to_thread(self._next_event)
+            if event is None:
+                if not self._process.is_alive():
+                    await self._worker_lost()
+                elif self._idle_expired():
+                    logger.info("Unloading model after %.0fs idle", time.time() - self.last_active)
+                    self.last_active = time.time()
+                    asyncio.create_task(self.unload(), name="diffusers-idle-unload")
+                continue
+
+            kind, request_id, *args = event
+            run = self._runs.get(request_id)
+            if kind == "progress" and run is not None:
+                step, total = args
+                run.progress(step / total, step, total, None)
+            elif kind == "stage" and run is not None:
+                run.timer.add(*args)
+            elif kind == "text_cache":
+                metrics.text_cache_total.inc(result="hit" if args[0] else "miss", engine=self.name)
+            elif kind in ("done", "error"):
+                future = self._pending.get(request_id)
+                if future is None or future.done():
+                    continue
+                if kind == "done":
+                    future.set_result(args[0])
+                else:
+                    future.set_exception(RuntimeError(args[0]))
+
+    async def _worker_lost(self):
+        self.last_error = f"Diffusers worker exited with code {self._process.exitcode}"
+        logger.error(self.last_error)
+        self.model_loaded = False
+        await asyncio.sleep(max(0.0, self._spawned_at + RESPAWN_DELAY - time.monotonic()))
+        # Includes requests sent to the dead worker while waiting to respawn
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(BackendLostError(self.last_error))
+        self._spawn()
+        self._preload()
+
+    def _idle_expired(self) -> bool:
+        return (
+            settings.model_idle_timeout > 0
+            and self.model_loaded
+            and not self.active_jobs
+            and not self.loading
+            and time.time() - self.last_active > settings.model_idle_timeout
+        )
+
+    async def _request(self, command: str, *args, run=None) -> Any:
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if run is not None:
+            self._runs[request_id] = run
+        try:
+            self._commands.put((request_id, command, *args))
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+            self._runs.pop(request_id, None)
+
+    def is_available(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def is_loaded(self) -> bool:
+        return self.model_loaded
+
+    def model_state(self) -> str:
+        if self.loading:
+            return "warming"
+        return "warm" if self.model_loaded else "cold"
+
+    def status(self) -> list[dict]:
+        return [{
+            "address": self.name,
+            "healthy": self.is_available(),
+            "active_jobs": self.active_jobs,
+            "model_loaded": self.model_loaded,
+            "model_state": self.model_state(),
+            "model_id": settings.model_id,
+            "device": self.device,
+            "pid": self._process.pid if self._process is not None else None,
+            "last_error": self.last_error,
+        }]
+
+    async def load(self) -> bool:
+        """Load the pipeline in the worker (no-op when already resident)"""
+        if self.model_loaded:
+            return True
+        self.loading = True
+        try:
+            self.device = await self._request("load")
+        except RuntimeError as e:
+            self.last_error = str(e)
+            logger.error("Failed to load model: %s", e)
+            return False
+        finally:
+            self.loading = False
+            self.last_active = time.time()
+        self.model_loaded = True
+        return True
+
+    async def unload(self) -> str:
+        await self._request("unload")
+        self.model_loaded = False
+        self.device = None
+        return "Model unloaded"
+
+    def build(self, request: VideoGenerationRequest) -> tuple[dict, int]:
+        return workflow_builder.build_spec(request)
+
+    def build_batch(self, batch: VideoBatchRequest) -> list[tuple[VideoGenerationRequest, dict, int]]:
+        raise NotImplementedError("The diffusers engine renders one video per job")
+
+    async def acquire(self):
+        await self._slot.acquire()
+        return self
+
+    async def release(self, slot):
+        self._slot.release()
+
+    async def execute(self, job: dict, slot, run) -> list[Path]:
+        # No remote queue: the job starts as soon as it holds the slot
+        run.timer.finish()
+        self.active_jobs += 1
+        try:
+            if not self.model_loaded:
+                run.message(0.1, "Loading model...")
+                started = time.monotonic()
+                if not await self.load():
+                    raise RuntimeError(f"Failed to load model: {self.last_error}")
+                run.timer.add("model_load", time.monotonic() - started)
+
+            run.message(0.2, "Generating video (this may take a while)...")
+            source = incoming_path(".mp4")
+            self._generation += 1
+            await self._request("generate", job["workflow"], str(source), self._generation, run=run)
+            return [source]
+        finally:
+            self.active_jobs -= 1
+            self.last_active = time.time()
+
+    async def cancel(self, job: dict, slot):
+        # The slot is still held, so the latest generation is this job's (if it got that far)
+        if self._cancelled is not None:
+            self._cancelled.value = self._generation
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+
+# Runs in the process that owns the diffusers pipeline. No app imports at
+# module level, so spawning the worker does not load the web server.
+
+
+def worker_main(commands, events, cancelled):
+    """Serve (request_id, command, *args) messages until a None sentinel
+
+    Renders whose generation number is at or below the shared cancelled
+    value stop at their next step.
+    """
+    from .generator import VideoGenerator
+
+    generator = VideoGenerator()
+    while True:
+        message = commands.get()
+        if message is None:
+            break
+        request_id, command, *args = message
+
+        def on_step(step: int, total: int):
+            events.put(("progress", request_id, step, total))
+
+        def on_stage(stage: str, seconds: float):
+            events.put(("stage", request_id, stage, seconds))
+
+        def on_cache(hit: bool):
+            events.put(("text_cache", request_id, hit))
+
+        try:
+            if command == "load":
+                generator.load_model()
+                result = generator.device
+            elif command == "unload":
+                generator.unload_model()
+                result = None
+            elif command == "generate":
+                spec, output_path, generation = args
+                if not generator.is_loaded:
+                    generator.load_model()
+                result = str(generator.render(
+                    spec, Path(output_path), on_step, on_stage, on_cache,
+                    should_stop=lambda: cancelled.value >= generation,
+                ))
+            else:
+                raise ValueError(f"Unknown command: {command}")
+            events.put(("done", request_id, result))
+        except Exception as e:
+            events.put(("error", request_id, f"{type(e).__name__}: {e}"))
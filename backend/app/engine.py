@@ -0,0 +1,338 @@
+import time
+import uuid
+import asyncio
+import logging
+import aiohttp
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from .config import settings
+from .models import VideoGenerationRequest, VideoBatchRequest, LongVideoRequest
+from .comfyui_client import ComfyUIConnectionError
+from .comfyui_pool import comfyui_pool, BackendNode
+from .workflow_builder import workflow_builder
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def incoming_path(suffix: str) -> Path:
+    """Scratch location for an engine's raw output before encoding"""
+    return settings.output_dir / ".incoming" / f"{uuid.uuid4().hex}{suffix}"
+
+
+class BackendLostError(RuntimeError):
+    """The engine died mid-job; the job can be retried elsewhere"""
+
+
+class Engine:
+    """Something that turns a job spec into video files
+
+    The job queue reserves a slot with acquire(), calls execute() and gives
+    the slot back with release(). execute() reports through the JobRun it is
+    handed (progress, messages, stage timings) and returns one local file per
+    requested output, in batch item order.
+    """
+
+    name = "engine"
+    supports_batch = False
+    supports_segments = False  # long videos (build_segment / upload_image)
+    unavailable_message = "Generation engine is not available"
+
+    @property
+    def capacity(self) -> int:
+        return 1
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def is_available(self) -> bool:
+        raise NotImplementedError
+
+    def is_loaded(self) -> bool:
+        return self.is_available()
+
+    def model_state(self) -> str:
+        """"warm" (models resident), "warming" or "cold" """
+        return "warm" if self.is_loaded() else "cold"
+
+    def status(self) -> list[dict]:
+        raise NotImplementedError
+
+    async def load(self) -> bool:
+        """Make the model resident; returns whether the engine is ready"""
+        return self.is_available()
+
+    async def unload(self) -> str:
+        return "Nothing to unload"
+
+    def build(self, request: Union[VideoGenerationRequest, LongVideoRequest]) -> tuple[dict, int]:
+        """Job spec (stored with the job, hashed for the result cache) and seed
+
+        For a long video this is the spec of its first segment.
+        """
+        raise NotImplementedError
+
+    def build_batch(self, batch: VideoBatchRequest) -> list[tuple[VideoGenerationRequest, dict, int]]:
+        raise NotImplementedError
+
+    def build_segment(self, request: LongVideoRequest, seed: int, index: int, num_frames: int, start_image: str) -> dict:
+        """Spec of a later segment of a long video, conditioned on an uploaded image"""
+        raise NotImplementedError
+
+    async def upload_image(self, slot: Any, path: Path, name: str) -> str:
+        """Make a local image available to the slot's backend; returns how specs refer to it"""
+        raise NotImplementedError
+
+    async def acquire(self) -> Any:
+        raise NotImplementedError
+
+    async def release(self, slot: Any):
+        raise NotImplementedError
+
+    def describe(self, slot: Any) -> str:
+        """Name of the slot's backend, recorded on the job"""
+        return self.name
+
+    async def execute(self, job: dict, slot: Any, run) -> list[Path]:
+        raise NotImplementedError
+
+    async def cancel(self, job: dict, slot: Any):
+        """Stop work an interrupted execute() left running on the backend"""
+        pass
+
+    async def mark_failed(self, slot: Any, error: Exception):
+        pass
+
+
+class ComfyUIEngine(Engine):
+    """Runs workflow graphs on the pool of ComfyUI servers"""
+
+    name = "comfyui"
+    supports_batch = True
+    supports_segments = True
+    unavailable_message = "ComfyUI is not running. Start it with: cd comfyui && python main.py --listen"
+
+    def __init__(self):
+        self._keepalive: Optional[asyncio.Task] = None
+        self._warmups: set[asyncio.Task] = set()
+
+    @property
+    def capacity(self) -> int:
+        return comfyui_pool.capacity
+
+    async def start(self):
+        await comfyui_pool.start()
+        self._keepalive = asyncio.create_task(self._keepalive_loop(), name="comfyui-keepalive")
+
+    async def close(self):
+        tasks = [*self._warmups, *([self._keepalive] if self._keepalive else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._keepalive = None
+        await comfyui_pool.close()
+
+    def is_available(self) -> bool:
+        return comfyui_pool.is_available()
+
+    def model_state(self) -> str:
+        states = {node.model_state for node in comfyui_pool.nodes}
+        for state in ("warm", "warming"):
+            if state in states:
+                return state
+        return "cold"
+
+    def status(self) -> list[dict]:
+        return comfyui_pool.status()
+
+    async def load(self) -> bool:
+        """Re-probe the backends and start warming any that are cold
+
+        Cheap to call speculatively (e.g. when a user starts typing a prompt):
+        warm backends are left alone and the warm-up runs in the background.
+        """
+        await comfyui_pool.check_all()
+        for node in comfyui_pool.nodes:
+            if node.available and node.model_state == "cold":
+                self._start_warmup(node)
+        return comfyui_pool.is_available()
+
+    def _start_warmup(self, node: BackendNode):
+        if node.warming:
+            return
+        node.warming = True
+        task = asyncio.create_task(self._warm(node), name=f"warmup-{node.address}")
+        self._warmups.add(task)
+        task.add_done_callback(self._warmups.discard)
+
+    async def _warm(self, node: BackendNode):
+        """Run the warm-up graph so the first real job finds every model loaded"""
+        node.warm_connection = node.client.connections
+        started = time.monotonic()
+        prompt_id = None
+        try:
+            prompt_id = await node.client.queue_prompt(workflow_builder.build_warmup())
+            await node.client.wait_for_completion(prompt_id, timeout=settings.warmup_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                await self._cancel_prompt(node, prompt_id)
+            node.warmup_error = str(e) or type(e).__name__
+            logger.warning("Warm-up on %s failed: %s", node.address, node.warmup_error)
+        else:
+            seconds = time.monotonic() - started
+            node.warm = True
+            node.warmup_error = None
+            metrics.warmup_seconds.observe(seconds, backend=node.address)
+            logger.info("Models warm on %s after %.1fs", node.address, seconds)
+        finally:
+            node.warming = False
+            node.last_active = time.time()
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(settings.backend_check_interval)
+            await self.check_residency()
+
+    async def check_residency(self):
+        """Warm backends that (re)connected and unload models on idle ones"""
+        for node in comfyui_pool.nodes:
+            connections = node.client.connections
+            if not node.available or connections == 0 or node.warming:
+                continue
+            if node.warm_connection != connections:
+                # First contact, or the socket dropped and ComfyUI may have
+                # restarted: whatever was loaded before cannot be assumed
+                node.warm = False
+                node.warm_connection = connections
+                if settings.warmup_on_start:
+                    self._start_warmup(node)
+            elif (
+                node.warm
+                and settings.model_idle_timeout > 0
+                and node.idle_seconds > settings.model_idle_timeout
+            ):
+                await self._free(node)
+
+    async def _free(self, node: BackendNode):
+        try:
+            await node.client.free()
+        except Exception as e:
+            logger.warning("Failed to unload models on %s: %s", node.address, e)
+            return
+        node.warm = False
+        logger.info("Unloaded models on %s (idle %.0fs)", node.address, node.idle_seconds)
+
+    async def unload(self) -> str:
+        """Unload models on every idle backend (/free)"""
+        for node in comfyui_pool.nodes:
+            if node.available and not node.active_jobs and not node.warming:
+                await self._free(node)
+        return "Models unloaded from idle ComfyUI backends"
+
+    def build(self, request: Union[VideoGenerationRequest, LongVideoRequest]) -> tuple[dict, int]:
+        if isinstance(request, LongVideoRequest):
+            return workflow_builder.build_long(request)
+        return workflow_builder.build_workflow(request)
+
+    def build_batch(self, batch: VideoBatchRequest) -> list[tuple[VideoGenerationRequest, dict, int]]:
+        return workflow_builder.build_batch(batch)
+
+    def build_segment(self, request: LongVideoRequest, seed: int, index: int, num_frames: int, start_image: str) -> dict:
+        return workflow_builder.build_segment(request, seed, index, num_frames, start_image)
+
+    async def upload_image(self, slot: BackendNode, path: Path, name: str) -> str:
+        try:
+            return await slot.client.upload_image(path, name)
+        except (ComfyUIConnectionError, aiohttp.ClientConnectionError) as e:
+            raise BackendLostError(str(e)) from e
+
+    async def acquire(self):
+        return await comfyui_pool.acquire()
+
+    async def release(self, slot):
+        await comfyui_pool.release(slot)
+
+    def describe(self, slot) -> str:
+        return slot.address
+
+    async def mark_failed(self, slot, error: Exception):
+        await comfyui_pool.mark_failed(slot, error)
+
+    async def cancel(self, job: dict, slot: BackendNode):
+        await self._cancel_prompt(slot, job.get("prompt_id"))
+
+    async def _cancel_prompt(self, node: BackendNode, prompt_id: Optional[str]):
+        if prompt_id is None:
+            return
+        try:
+            await node.client.cancel_prompt(prompt_id)
+        except Exception as e:
+            logger.warning("Failed to cancel prompt %s on %s: %s", prompt_id, node.address, e)
+        else:
+            logger.info("Cancelled prompt %s on %s", prompt_id, node.address)
+
+    def _record_text_cache(self, workflow: dict, cached: set[str]):
+        """Count text-encode nodes ComfyUI reused (same text and CLIP) as cache hits"""
+        for node_id, node in workflow.items():
+            if node.get("class_type", "").startswith("CLIPTextEncode"):
+                metrics.text_cache_total.inc(result="hit" if node_id in cached else "miss", engine=self.name)
+
+    async def execute(self, job: dict, slot, run) -> list[Path]:
+        try:
+            return await self._execute(job, slot, run)
+        except (ComfyUIConnectionError, aiohttp.ClientConnectionError) as e:
+            raise BackendLostError(str(e)) from e
+
+    async def _execute(self, job: dict, slot: BackendNode, run) -> list[Path]:
+        client = slot.client
+        run.message(0.1, "Queuing workflow...")
+        prompt_id = await client.queue_prompt(job["workflow"])
+        run.update(prompt_id=prompt_id)
+
+        run.message(0.2, "Generating video (this may take a while)...")
+        history = await client.wait_for_completion(prompt_id, run.progress)
+        run.timer.finish()
+        slot.warm = True
+        slot.warm_connection = client.connections
+        self._record_text_cache(job["workflow"], client.cached_nodes(history))
+
+        if job["items"]:
+            nodes = [item["node"] for item in job["items"] if item["node"] is not None]
+        else:
+            nodes = [None]
+
+        sources = []
+        for index, node in enumerate(nodes):
+            output = client.get_output_file(history, node)
+            if not output:
+                raise RuntimeError(f"No video output found in workflow result (node {node})")
+            if node is None:
+                # Until the local copy lands, /api/jobs/{id}/video proxies this URL
+                run.update(output_url=client.view_url(output))
+                run.message(0.95, "Downloading video...")
+            else:
+                run.message(0.9 + 0.1 * index / len(nodes), f"Downloading video {index + 1}/{len(nodes)}...")
+
+            source = incoming_path(Path(output["filename"]).suffix)
+            started = time.monotonic()
+            await client.fetch_output(output, source)
+            run.timer.add("download", time.monotonic() - started)
+            sources.append(source)
+        return sources
+
+
+def create_engine(name: str) -> Engine:
+    if name == "diffusers":
+        from .diffusers_engine import DiffusersEngine
+        return DiffusersEngine()
+    return ComfyUIEngine()
+
+
+engine = create_engine(settings.engine)
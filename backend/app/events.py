@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+# Per-subscriber buffer; slow consumers drop the oldest progress update
+MAX_PENDING_EVENTS = 100
+
+
+class JobEvents:
+    """Pub/sub of job progress events keyed by job id
+
+    Events are published in-process by whoever runs the job. When jobs run in
+    another process (multi-process serving), start_polling() instead reads
+    subscribed jobs from the shared store and emits an event whenever one
+    changes; publish() is then a no-op so subscribers see a single stream.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._poller: Optional[asyncio.Task] = None
+        self._last: dict[str, dict] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+        self._subscribers[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[job_id]
+            self._last.pop(job_id, None)
+
+    def has_subscribers(self, job_id: str) -> bool:
+        return job_id in self._subscribers
+
+    def subscribed_jobs(self) -> list[str]:
+        return list(self._subscribers)
+
+    def publish(self, job_id: str, event: dict):
+        if self._poller is None:
+            self._deliver(job_id, event)
+
+    def _deliver(self, job_id: str, event: dict):
+        for queue in self._subscribers.get(job_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def start_polling(self, fetch: Callable[[str], Optional[dict]], interval: float):
+        """Emit fetch(job_id) for subscribed jobs whenever it changes"""
+        self._poller = asyncio.create_task(self._poll(fetch, interval), name="job-events-poll")
+
+    async def stop_polling(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+
+    async def _poll(self, fetch: Callable[[str], Optional[dict]], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            job_ids = self.subscribed_jobs()
+            if not job_ids:
+                continue
+            try:
+                events = await asyncio.to_thread(lambda: {job_id: fetch(job_id) for job_id in job_ids})
+            except Exception:
+                logger.exception("Failed to poll job events")
+                continue
+            for job_id, event in events.items():
+                if event is None or event == self._last.get(job_id) or not self.has_subscribers(job_id):
+                    continue
+                self._last[job_id] = event
+                self._deliver(job_id, event)
+
+
+job_events = JobEvents()
@@ -1,13 +1,25 @@
+import time
 import torch
-import random
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Callable
 from diffusers import WanPipeline
+from diffusers.hooks import FirstBlockCacheConfig
 from diffusers.utils import export_to_video
 
 from .config import settings
 from .models import AspectRatio, VideoGenerationRequest
+from .resolution import plan_resolution
+from .text_cache import TextEncodingCache, text_key
+from .workflow_builder import workflow_builder
+
+
+# WanPipeline's default; cached embeddings are padded to this length
+MAX_SEQUENCE_LENGTH = 512
+
+
+class RenderCancelled(Exception):
+    """Raised from the step callback to abandon a render"""
 
 
 class VideoGenerator:
@@ -16,15 +28,17 @@ class VideoGenerator:
         self.is_loaded = False
         self.is_loading = False
         self.device = None
-
-    def get_resolution(self, aspect_ratio: AspectRatio) -> tuple[int, int]:
-        """Get resolution based on aspect ratio
-        WAN 2.1 1.3B performs best at 480P resolution
-        """
-        if aspect_ratio == AspectRatio.PORTRAIT:
-            return (480, 832)  # 9:16 ratio at 480P
-        else:
-            return (832, 480)  # 16:9 ratio at 480P
+        self.step_cache = 0.0  # FirstBlockCache threshold enabled on the transformer
+        self.text_cache = TextEncodingCache(
+            settings.data_dir / "text_cache",
+            max_entries=settings.text_cache_entries,
+            max_bytes=settings.text_cache_max_bytes,
+        ) if settings.text_cache_enabled else None
+
+    def get_resolution(self, aspect_ratio: AspectRatio, num_frames: int = 81) -> tuple[int, int]:
+        """Get resolution based on aspect ratio, frame count and memory budget"""
+        plan = plan_resolution(aspect_ratio, num_frames)
+        return plan.width, plan.height
 
     def load_model(self, progress_callback: Optional[Callable] = None):
         """Load the WAN 2.1 model"""
@@ -69,6 +83,7 @@ class VideoGenerator:
             else:
                 self.pipe = self.pipe.to(self.device)
 
+            self.step_cache = 0.0
             self.is_loaded = True
             self.is_loading = False
 
@@ -79,19 +94,50 @@ class VideoGenerator:
             self.is_loading = False
             raise RuntimeError(f"Failed to load model: {str(e)}")
 
-    def generate_video(
-        self,
-        request: VideoGenerationRequest,
-        progress_callback: Optional[Callable] = None
-    ) -> tuple[str, int]:
-        """Generate a video from the request parameters"""
+    def encode_text(self, text: str, on_cache: Optional[Callable[[bool], None]] = None) -> torch.Tensor:
+        """Prompt embeddings for one text, served from the text-encoding cache when possible"""
+        key = text_key(text, f"{settings.model_id}:{MAX_SEQUENCE_LENGTH}")
+        embeds = self.text_cache.get(key) if self.text_cache else None
+        if on_cache and self.text_cache:
+            on_cache(embeds is not None)
+        if embeds is None:
+            embeds, _ = self.pipe.encode_prompt(
+                prompt=text,
+                do_classifier_free_guidance=False,
+                max_sequence_length=MAX_SEQUENCE_LENGTH,
+                device=self.pipe._execution_device,
+            )
+            if self.text_cache:
+                self.text_cache.put(key, embeds)
+        return embeds.to(device=self.pipe._execution_device, dtype=self.pipe.transformer.dtype)
+
+    def set_step_cache(self, threshold: float):
+        """Skip the transformer on steps whose first-block residual barely changed (0 disables)
+
+        The cache hook stays on the transformer between renders and is only
+        swapped when a spec asks for a different threshold.
+        """
+        if threshold == self.step_cache:
+            return
+        if self.step_cache:
+            self.pipe.transformer.disable_cache()
+        if threshold:
+            self.pipe.transformer.enable_cache(FirstBlockCacheConfig(threshold=threshold))
+        self.step_cache = threshold
 
+    def render(
+        self,
+        spec: dict,
+        output_path: Path,
+        on_step: Optional[Callable[[int, int], None]] = None,
+        on_stage: Optional[Callable[[str, float], None]] = None,
+        on_cache: Optional[Callable[[bool], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> Path:
+        """Run the pipeline for a spec from workflow_builder.build_spec and export the frames"""
         if not self.is_loaded:
             raise RuntimeError("Model not loaded. Please load the model first.")
 
-        # Set seed
-        seed = request.seed if request.seed is not None else random.randint(0, 2**32 - 1)
-
         # Create generator on appropriate device
         if self.device == "cuda":
             gen_device = "cuda"
@@ -100,36 +146,72 @@ class VideoGenerator:
         else:
             gen_device = "cpu"
 
-        generator = torch.Generator(device=gen_device).manual_seed(seed)
-
-        # Get resolution
-        width, height = self.get_resolution(request.aspect_ratio)
-
-        if progress_callback:
-            progress_callback(f"Generating video ({width}x{height}, {request.num_frames} frames)...")
+        generator = torch.Generator(device=gen_device).manual_seed(spec["seed"])
+        self.set_step_cache(spec.get("step_cache", 0.0))
+        total = spec["num_inference_steps"]
+        last_step = None
+
+        def step_end(pipe, step, timestep, callback_kwargs):
+            nonlocal last_step
+            last_step = time.monotonic()
+            if should_stop and should_stop():
+                # Skips the remaining steps and the VAE decode
+                raise RenderCancelled(f"Cancelled after step {step + 1}/{total}")
+            if on_step:
+                on_step(step + 1, total)
+            return callback_kwargs
+
+        # Encode (or reuse) the prompt and, with CFG, the negative prompt
+        started = time.monotonic()
+        prompt_embeds = self.encode_text(spec["prompt"], on_cache)
+        negative_prompt_embeds = None
+        if spec["guidance_scale"] > 1.0:
+            negative_prompt_embeds = self.encode_text(spec["negative_prompt"], on_cache)
+        if on_stage:
+            on_stage("text_encode", time.monotonic() - started)
 
         # Generate video with WAN 2.1 recommended parameters
+        started = time.monotonic()
         output = self.pipe(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            height=height,
-            width=width,
-            num_frames=request.num_frames,
-            num_inference_steps=request.num_inference_steps,
-            guidance_scale=request.guidance_scale,
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            height=spec["height"],
+            width=spec["width"],
+            num_frames=spec["num_frames"],
+            num_inference_steps=total,
+            guidance_scale=spec["guidance_scale"],
             generator=generator,
+            callback_on_step_end=step_end,
         )
+        decoded = time.monotonic()
+        if on_stage:
+            # The pipeline denoises and decodes in one call
+            on_stage("sampling", (last_step or decoded) - started)
+            on_stage("vae_decode", decoded - (last_step or decoded))
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        export_to_video(output.frames[0], str(output_path), fps=spec["fps"])
+        if on_stage:
+            on_stage("save", time.monotonic() - decoded)
+        return output_path
+
+    def generate_video(
+        self,
+        request: VideoGenerationRequest,
+        progress_callback: Optional[Callable] = None
+    ) -> tuple[str, int]:
+        """Generate a video from the request parameters"""
+        spec, seed = workflow_builder.build_spec(request)
+
+        if progress_callback:
+            progress_callback(f"Generating video ({spec['width']}x{spec['height']}, {spec['num_frames']} frames)...")
 
         # Export video
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_filename = f"video_{timestamp}_{seed}.mp4"
         output_path = settings.output_dir / output_filename
 
-        if progress_callback:
-            progress_callback("Exporting video...")
-
-        export_to_video(output.frames[0], str(output_path), fps=request.fps)
-
+        self.render(spec, output_path)
         return str(output_path), seed
 
     def unload_model(self):
@@ -137,6 +219,7 @@ class VideoGenerator:
         if self.pipe is not None:
             del self.pipe
             self.pipe = None
+        self.step_cache = 0.0
 
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
@@ -0,0 +1,881 @@
+import os
+import uuid
+import shutil
+import asyncio
+import logging
+import time
+from pathlib import Path
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Sequence, Union
+
+from .config import settings
+from .models import JobInfo, BatchItem, VideoGenerationRequest, VideoBatchRequest, LongVideoRequest
+from .job_store import JobStore
+from .engine import engine, BackendLostError
+from .workflow_builder import workflow_builder, merge_workflows, output_nodes, rendered_frames, segment_plan
+from .admission import AdmissionError, fair_scheduler
+from .result_cache import result_cache, workflow_key, link_or_copy
+from .events import job_events
+from .coordinator import coordinator
+from .video_catalog import video_catalog
+from .video_encoder import video_encoder
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_JOB_STATES = ("completed", "error", "cancelled")
+# Seconds a worker waits after an unexpected error (e.g. a locked database) before its next job
+WORKER_RETRY_DELAY = 1.0
+
+
+def segments_dir(job_id: str) -> Path:
+    """Scratch directory for a long video's finished segments and encoded parts"""
+    return settings.output_dir / ".segments" / job_id
+
+
+def sampling_plan(workflow: dict) -> dict[str, tuple[int, int, int]]:
+    """Map sampler node ids to the (start, end, total) step range they run"""
+    plan = {}
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict):
+            continue
+        inputs = node.get("inputs", {})
+        steps = inputs.get("steps")
+        if not isinstance(steps, int) or steps <= 0:
+            continue
+        start = inputs.get("start_at_step", 0)
+        end = min(inputs.get("end_at_step", steps), steps)
+        plan[node_id] = (start, end, steps)
+    return plan
+
+
+class ProgressTracker:
+    """Turn per-node ComfyUI progress into overall sampling progress and ETA
+
+    Every sampler node contributes its share of steps, so a batch graph with
+    several sampler chains reports progress across all of them.
+    """
+
+    def __init__(self, workflow: dict):
+        self.workflow = workflow
+        self.spans = {node: end - start for node, (start, end, _) in sampling_plan(workflow).items()}
+        self.total_steps = sum(self.spans.values())
+        self.fraction = 0.0
+        self.step = 0
+        self.node: Optional[str] = None
+        self._done: dict[str, float] = {}
+        self._started: Optional[float] = None
+
+    def node_title(self, node: Optional[str]) -> str:
+        info = self.workflow.get(node or "", {})
+        return info.get("_meta", {}).get("title") or info.get("class_type") or str(node)
+
+    def update(self, fraction: float, node: Optional[str], step: int = 0, total: int = 0):
+        self.node = node
+        if not self.spans:
+            # Engines without a node graph report overall sampling progress
+            if self._started is None:
+                self._started = time.monotonic()
+            self.step, self.total_steps = step, total
+            self.fraction = fraction
+            return
+        span = self.spans.get(node or "")
+        if not span:
+            return
+        if self._started is None:
+            self._started = time.monotonic()
+        self._done[node] = max(self._done.get(node, 0.0), fraction * span)
+        done = sum(self._done.values())
+        self.step = round(done)
+        self.fraction = done / self.total_steps
+
+    def eta(self) -> Optional[float]:
+        """Seconds of sampling left, extrapolated from the observed step rate"""
+        if self._started is None or self.fraction <= 0:
+            return None
+        elapsed = time.monotonic() - self._started
+        return round(elapsed / self.fraction * (1.0 - self.fraction), 1)
+
+
+def node_stage(node: dict) -> str:
+    """Classify a workflow node into a timing stage"""
+    class_type = node.get("class_type", "")
+    inputs = node.get("inputs", {})
+    if "Loader" in class_type:
+        return "model_load"
+    if class_type.startswith("CLIPTextEncode"):
+        return "text_encode"
+    if class_type.startswith("KSampler"):
+        steps = inputs.get("steps")
+        if inputs.get("start_at_step", 0) > 0:
+            return "low_noise_sampling"
+        if isinstance(steps, int) and inputs.get("end_at_step", steps) < steps:
+            return "high_noise_sampling"
+        return "sampling"
+    if class_type.startswith("VAEDecode"):
+        return "vae_decode"
+    if class_type.startswith("ImageScale") or "Upscale" in class_type:
+        return "upscale"
+    if class_type.startswith("Save") or class_type == "VHS_VideoCombine":
+        return "save"
+    return "other"
+
+
+class StageTimer:
+    """Attribute wall-clock time between ComfyUI executing events to stages
+
+    Time before the first node starts (ComfyUI's own queue) counts as dispatch.
+    """
+
+    def __init__(self, workflow: dict):
+        self.workflow = workflow
+        self.timings: dict[str, float] = {}
+        self._node: Optional[str] = None
+        self._since: Optional[float] = time.monotonic()
+
+    def add(self, stage: str, seconds: float):
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 3)
+
+    def enter(self, node: Optional[str]):
+        if node is None or node == self._node or self._since is None:
+            return
+        self._close()
+        self._node = node
+
+    def finish(self):
+        if self._since is not None:
+            self._close()
+            self._since = None
+
+    def restart(self, workflow: dict):
+        """Start timing another graph, adding to the timings collected so far"""
+        self.finish()
+        self.workflow = workflow
+        self._node = None
+        self._since = time.monotonic()
+
+    def _close(self):
+        now = time.monotonic()
+        stage = node_stage(self.workflow.get(self._node, {})) if self._node else "dispatch"
+        self.add(stage, now - self._since)
+        self._since = now
+
+
+class JobRun:
+    """Handle an engine uses to report on the job it is executing"""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job = job
+        self.timer = StageTimer(job["workflow"])
+        self.tracker = ProgressTracker(job["workflow"])
+        self.cancelled = asyncio.Event()
+        self.finished = asyncio.Event()
+        # Share of the job the current engine run covers, and its message prefix
+        self.window = (0.0, 1.0)
+        self.prefix = ""
+
+    def start_segment(self, workflow: dict, index: int, count: int):
+        """Report the next engine run as segment index of count (long videos)
+
+        Segments share the first 90% of the job's progress; the rest is
+        left for stitching.
+        """
+        self.window = (0.9 * index / count, 0.9 * (index + 1) / count)
+        self.prefix = f"Segment {index + 1}/{count}: "
+        self.tracker = ProgressTracker(workflow)
+        self.timer.restart(workflow)
+
+    def _scale(self, progress: float) -> float:
+        low, high = self.window
+        return low + progress * (high - low)
+
+    def update(self, **fields):
+        """Persist job fields such as prompt_id or output_url"""
+        self.job.update(fields)
+        self.queue.store.post(self.queue.store.update, self.job["id"], **fields)
+
+    def message(self, progress: float, text: str):
+        self.queue._progress(self.job["id"], self._scale(progress), self.prefix + text)
+
+    def progress(self, fraction: float, step: int, total: int, node: Optional[str]):
+        """Sampling progress callback (maps onto 20-90% of the engine run)"""
+        self.timer.enter(node)
+        self.tracker.update(fraction, node, step, total)
+        percent = int(self.tracker.fraction * 100)
+        title = self.tracker.node_title(node) if node is not None else "Sampling"
+        self.queue._progress(
+            self.job["id"],
+            self._scale(0.2 + self.tracker.fraction * 0.7),
+            f"{self.prefix}{title}... {percent}%",
+            step=self.tracker.step,
+            total_steps=self.tracker.total_steps,
+            node=node,
+            percent=percent,
+            eta_seconds=self.tracker.eta(),
+        )
+
+
+class QueueFullError(AdmissionError):
+    """Raised when the queue is at max_queue_size or its GPU-time budget"""
+
+
+class JobCancelledError(Exception):
+    """The job was cancelled while the engine was running it"""
+
+
+class NotSubmitterError(Exception):
+    """Raised when a client cancels a job it never submitted"""
+
+
+class JobQueue:
+    """Persistent priority queue of generation jobs drained by worker tasks"""
+
+    def __init__(self, store: JobStore, num_workers: int = 0, max_size: int = 32):
+        self.store = store
+        self.num_workers = num_workers if num_workers > 0 else max(1, engine.capacity)
+        self.max_size = max_size
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+        self._reserved: OrderedDict[str, None] = OrderedDict()
+        self._runs: dict[str, JobRun] = {}
+
+    async def start(self):
+        requeued = await self.store.run(self.store.requeue_running)
+        if requeued:
+            logger.info("Re-queued %d interrupted job(s)", requeued)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(
+        self,
+        request: Union[VideoGenerationRequest, LongVideoRequest],
+        workflow: dict,
+        seed: int,
+        client: Optional[str] = None,
+    ) -> JobInfo:
+        """Add a job to the queue and wake a worker
+
+        If an identical workflow has already been rendered the job completes
+        immediately from the result cache without touching the queue; if one
+        is queued or running, the submission joins that job instead and gets
+        its progress and output. For a long video, workflow is its first
+        segment; the rest are built as the job runs.
+        """
+        long_video = isinstance(request, LongVideoRequest)
+        if long_video:
+            signature = workflow_builder.long_video_signature(request, workflow, seed)
+            cache_key = workflow_key(signature, video_encoder.profile)
+        else:
+            cache_key = workflow_key(workflow, video_encoder.profile)
+        cached = result_cache.lookup(cache_key) if settings.result_cache_enabled else None
+
+        if cached is None and settings.coalesce_requests:
+            shared = await self.store.run(self.store.attach, cache_key, client, request.priority)
+            if shared is not None:
+                metrics.coalesced_total.inc()
+                await self._publish_snapshot(shared["id"])
+                return await self.store.run(self._to_info, shared)
+
+        work = workflow_builder.estimate_work(request)
+        job_id = uuid.uuid4().hex
+        job = await self.store.run(
+            self._create, None if cached is not None else work,
+            job_id, request.model_dump(mode="json"), workflow, seed, request.priority, cache_key,
+            client=client, work=work, segments=[] if long_video else None,
+        )
+        if cached is not None:
+            await self.store.run(self.store.update, job_id, status="running", started_at=time.time())
+            await self._complete_from_cache(job_id, seed, cached)
+            return await self.get(job_id)
+
+        self._wakeup.set()
+        return await self.store.run(self._to_info, job)
+
+    async def submit_batch(
+        self,
+        batch: VideoBatchRequest,
+        items: list[tuple[VideoGenerationRequest, dict, int]],
+        client: Optional[str] = None,
+    ) -> JobInfo:
+        """Queue a job group whose uncached items share one merged ComfyUI graph"""
+        rows: list[dict] = []
+        pending: list[tuple[dict, dict]] = []
+        cached_files: list[tuple[dict, Path]] = []
+        work = 0.0
+        for request, workflow, seed in items:
+            item_key = workflow_key(workflow, video_encoder.profile)
+            row = {"prompt": request.prompt, "seed": seed, "cache_key": item_key, "node": None,
+                   "video_url": None, "cached": False}
+            cached = result_cache.lookup(item_key) if settings.result_cache_enabled else None
+            if cached is not None:
+                row["cached"] = True
+                cached_files.append((row, cached))
+            else:
+                pending.append((row, workflow))
+                work += workflow_builder.estimate_work(request)
+            rows.append(row)
+
+        if pending:
+            # Early check before linking cached items; repeated atomically with the insert
+            await self.store.run(self._admit, work)
+
+        for row, cached in cached_files:
+            output_path = await self._link_cached(row["seed"], cached)
+            row["video_url"] = f"/outputs/{output_path.name}"
+
+        if pending:
+            workflow, mappings = merge_workflows([wf for _, wf in pending])
+            for (row, item_workflow), mapping in zip(pending, mappings):
+                row["node"] = mapping[output_nodes(item_workflow)[0]]
+        else:
+            workflow = {}
+
+        job_id = uuid.uuid4().hex
+        await self.store.run(
+            self._create, work if pending else None,
+            job_id, batch.model_dump(mode="json"), workflow, rows[0]["seed"], batch.priority, items=rows,
+            client=client, work=work,
+        )
+        if not pending:
+            now = time.time()
+            await self.store.run(
+                self.store.update, job_id, status="completed", progress=1.0, started_at=now, finished_at=now,
+                message="All items served from cache", video_url=rows[0]["video_url"],
+            )
+            await self._record_timings(job_id, "cached")
+            await self._catalog_job(job_id)
+        else:
+            self._wakeup.set()
+        return await self.get(job_id)
+
+    def _create(self, admit_work: Optional[float], *args, **kwargs) -> dict:
+        """Insert a job, first admitting admit_work (unless None) in the same transaction"""
+        with self.store.transaction():
+            if admit_work is not None:
+                self._admit(admit_work)
+            return self.store.create(*args, **kwargs)
+
+    def _output_path(self, seed: int, suffix: str = ".mp4") -> Path:
+        """Unique output file name; batch items can share a seed and a second"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        stem = f"video_{timestamp}_{seed}"
+        path = settings.output_dir / f"{stem}{suffix}"
+        counter = 1
+        while path.name in self._reserved or path.exists():
+            path = settings.output_dir / f"{stem}_{counter}{suffix}"
+            counter += 1
+        # Names only need reserving until the download creates the file
+        self._reserved[path.name] = None
+        while len(self._reserved) > 1024:
+            self._reserved.popitem(last=False)
+        return path
+
+    async def _mark_completed(
+        self,
+        job_id: str,
+        seed: int,
+        output_path: Path,
+        message: str,
+        cached: bool = False,
+        timings: Optional[dict[str, float]] = None,
+    ):
+        await self.store.run(
+            self.store.update,
+            job_id,
+            status="completed",
+            progress=1.0,
+            message=message,
+            video_url=f"/outputs/{output_path.name}",
+            finished_at=time.time(),
+        )
+        await self._record_timings(job_id, "cached" if cached else "completed", timings)
+        await self._catalog_job(job_id, cached)
+        await self._publish_snapshot(job_id)
+        await self._publish_queue_positions()
+
+    async def _record_timings(self, job_id: str, outcome: str, timings: Optional[dict[str, float]] = None):
+        """Persist per-stage timings with the job and feed the metrics histograms"""
+        job = await self.store.run(self.store.get, job_id)
+        timings = dict(timings or {})
+        if job["started_at"] is not None:
+            timings["queue_wait"] = round(job["started_at"] - job["created_at"], 3)
+        total = job["finished_at"] - job["created_at"]
+        timings["total"] = round(total, 3)
+        await self.store.run(self.store.update, job_id, timings=timings)
+
+        for stage, seconds in timings.items():
+            if stage != "total":
+                metrics.stage_seconds.observe(seconds, stage=stage)
+        metrics.job_seconds.observe(total, outcome=outcome)
+        metrics.jobs_total.inc(outcome=outcome)
+        if outcome in ("completed", "cached"):
+            request = job["request"]
+            count = len(job["items"]) if job["items"] else 1
+            metrics.videos_total.inc(count)
+            metrics.video_seconds_total.inc(count * rendered_frames(request) / request["fps"])
+
+    async def _catalog_job(self, job_id: str, cached: bool = False):
+        """Index a finished job's outputs in the video catalog"""
+        job = await self.store.run(self.store.get, job_id)
+        request = job["request"]
+        params = {
+            key: value for key, value in request.items()
+            if key not in ("prompt", "prompts", "seed", "seeds", "variants", "negative_prompt", "priority")
+        }
+        started = job["started_at"] or job["created_at"]
+        shared = {
+            "job_id": job_id,
+            "negative_prompt": request.get("negative_prompt"),
+            "params": params,
+            "duration": round(rendered_frames(request) / request["fps"], 3),
+            "generation_seconds": round(job["finished_at"] - started, 3),
+            "queue_seconds": round(started - job["created_at"], 3),
+            "created_at": job["finished_at"],
+        }
+        if job["items"]:
+            entries = [(item["video_url"], item["prompt"], item["seed"], item["cached"]) for item in job["items"]]
+        else:
+            entries = [(job["video_url"], request["prompt"], job["seed"], cached)]
+
+        for video_url, prompt, seed, item_cached in entries:
+            path = settings.output_dir / video_url.rsplit("/", 1)[-1]
+            try:
+                await asyncio.to_thread(
+                    video_catalog.add, path, prompt=prompt, seed=seed, cached=item_cached, **shared
+                )
+            except Exception:
+                logger.exception("Failed to index %s", path.name)
+
+    async def _publish_snapshot(self, job_id: str):
+        if job_events.has_subscribers(job_id):
+            job = await self.get(job_id)
+            if job is not None:
+                job_events.publish(job_id, job.model_dump())
+
+    async def _publish_queue_positions(self):
+        """Queued jobs move up whenever another job starts or finishes"""
+        job_ids = list(job_events.subscribed_jobs())
+        if not job_ids:
+            return
+        jobs = await self.store.run(lambda: [self._get(job_id) for job_id in job_ids])
+        for job in jobs:
+            if job is not None and job.status == "queued":
+                job_events.publish(job.job_id, job.model_dump())
+
+    async def _link_cached(self, seed: int, cached: Path) -> Path:
+        """Expose a cached result as a new output (renditions are not cached)"""
+        output_path = self._output_path(seed, cached.suffix)
+        await asyncio.to_thread(link_or_copy, cached, output_path)
+        await video_encoder.renditions(output_path)
+        return output_path
+
+    async def _complete_from_cache(self, job_id: str, seed: int, cached: Path):
+        output_path = await self._link_cached(seed, cached)
+        await self._mark_completed(job_id, seed, output_path, f"Video served from cache. Seed: {seed}", cached=True)
+
+    async def cancel(self, job_id: str, client: Optional[str] = None) -> Optional[JobInfo]:
+        """Withdraw a submission from a job, cancelling the job once none is left
+
+        Identical submissions share one job, so it keeps running for the
+        others until the last of them is withdrawn. Only a client with a
+        submission in the job can withdraw it.
+        """
+        remaining = await self.store.run(self.store.release, job_id, client)
+        if remaining is None:
+            raise NotSubmitterError(job_id)
+        if remaining > 0:
+            await self._publish_snapshot(job_id)
+            return await self.get(job_id)
+        return await self._cancel(job_id)
+
+    async def _cancel(self, job_id: str) -> Optional[JobInfo]:
+        """Cancel a queued job, or stop a running one and wait until its backend is free"""
+        if await self.store.run(self.store.cancel_queued, job_id):
+            await self._record_timings(job_id, "cancelled")
+            await self._publish_snapshot(job_id)
+            await self._publish_queue_positions()
+        elif job_id in self._runs:
+            run = self._runs[job_id]
+            run.cancelled.set()
+            await run.finished.wait()
+        elif not coordinator.is_leader:
+            # Running in the coordinator process
+            await coordinator.request("cancel_job", job_id=job_id)
+        return await self.get(job_id)
+
+    async def _cancel_command(self, job_id: str) -> Optional[str]:
+        job = await self._cancel(job_id)
+        return job.status if job else None
+
+    async def get(self, job_id: str, viewer: Optional[str] = None) -> Optional[JobInfo]:
+        return await self.store.run(self._get, job_id, viewer)
+
+    def _get(self, job_id: str, viewer: Optional[str] = None) -> Optional[JobInfo]:
+        job = self.store.get(job_id)
+        return self._to_info(job, viewer) if job else None
+
+    def event(self, job_id: str) -> Optional[dict]:
+        """Current state of a job as a progress event, for subscribers in other processes"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        event = self._to_info(job).model_dump()
+        if job["status"] == "running" and job["detail"]:
+            event.update(job["detail"])
+        return event
+
+    async def list(self, status: Optional[str] = None, limit: int = 50, viewer: Optional[str] = None) -> list[JobInfo]:
+        return await self.store.run(lambda: [self._to_info(job, viewer) for job in self.store.list(status, limit)])
+
+    async def counts(self) -> dict[str, int]:
+        """Number of queued and running jobs"""
+        return await self.store.run(lambda: {status: self.store.count(status) for status in ("queued", "running")})
+
+    async def current(self) -> Optional[JobInfo]:
+        """Most relevant job for the legacy single-status view"""
+        return await self.store.run(self._current)
+
+    def _current(self) -> Optional[JobInfo]:
+        for status in ("running", "queued"):
+            jobs = self.store.list(status, limit=1)
+            if jobs:
+                return self._to_info(jobs[0])
+        jobs = self.store.list(limit=1)
+        return self._to_info(jobs[0]) if jobs else None
+
+    def _average_duration(self) -> float:
+        return self.store.average_duration() or settings.default_job_duration
+
+    def _seconds_per_work(self) -> float:
+        """GPU seconds per unit of estimated work, from history or the default job duration"""
+        observed = self.store.seconds_per_work()
+        if observed:
+            return observed
+        return settings.default_job_duration / workflow_builder.estimate_work(VideoGenerationRequest(prompt="-"))
+
+    def _admit(self, work: float):
+        """Reject a new job when the queue is full or over its GPU-time budget
+
+        Called inside the store transaction that inserts the job, so
+        concurrent submissions in any process cannot both pass the check.
+        """
+        if self.store.count("queued") >= self.max_size:
+            raise QueueFullError(
+                f"Queue is full ({self.max_size} jobs waiting)",
+                retry_after=self._average_duration() / self.num_workers,
+            )
+        if settings.max_queued_gpu_seconds <= 0:
+            return
+        per_work = self._seconds_per_work()
+        pending = self.store.pending_work() * per_work
+        # A single job larger than the budget still runs when nothing else is waiting
+        if pending > 0 and pending + work * per_work > settings.max_queued_gpu_seconds:
+            excess = pending + work * per_work - settings.max_queued_gpu_seconds
+            raise QueueFullError(
+                f"Queue holds ~{pending / 60:.0f} min of GPU work "
+                f"(limit {settings.max_queued_gpu_seconds / 60:.0f} min)",
+                retry_after=excess / self.num_workers,
+            )
+
+    def _to_info(self, job: dict, viewer: Optional[str] = None) -> JobInfo:
+        """Public view of a job; the client label is only shown to a client that submitted it"""
+        submitters = job["subscribers"] if job["subscribers"] is not None else [job["client"]]
+        info = JobInfo(
+            job_id=job["id"],
+            status=job["status"],
+            priority=job["priority"],
+            progress=job["progress"],
+            message=job["message"],
+            prompt=job["request"].get("prompt") or (job["request"].get("prompts") or [""])[0],
+            seed=job["seed"],
+            video_url=job["video_url"],
+            error=job["error"],
+            backend=job["backend"],
+            attempts=job["attempts"],
+            client=viewer if viewer and viewer in submitters else None,
+            subscribers=len(job["subscribers"]) if job["subscribers"] is not None else 1,
+            items=[BatchItem(**item) for item in job["items"]] if job["items"] else None,
+            segments=len(job["segments"]) if job["segments"] is not None else None,
+            created_at=job["created_at"],
+            started_at=job["started_at"],
+            finished_at=job["finished_at"],
+            timings=job["timings"],
+        )
+
+        average = self._average_duration()
+        if job["status"] == "running":
+            info.eta_seconds = round(average * (1.0 - job["progress"]), 1)
+        elif job["status"] == "queued":
+            position = self.store.queue_position(job)
+            running = self.store.list("running", limit=self.num_workers)
+            remaining = sum(average * (1.0 - r["progress"]) for r in running)
+            info.queue_position = position
+            info.eta_seconds = round((remaining + position * average) / self.num_workers + average, 1)
+        return info
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._work_once()
+            except Exception:
+                # Keep the worker alive: a dead task would stop the queue for good
+                logger.exception("Queue worker failed, retrying in %.0fs", WORKER_RETRY_DELAY)
+                await asyncio.sleep(WORKER_RETRY_DELAY)
+                continue
+            if job is None:
+                if coordinator.shared:
+                    # Other processes add jobs without waking this one
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), settings.coordination_poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._wakeup.wait()
+
+    async def _work_once(self) -> Optional[dict]:
+        """Claim the next job and run it on a free slot; None when the queue is empty"""
+        slot = await engine.acquire()
+        try:
+            job = await self.store.run(self.store.claim_next, fair_scheduler.choose)
+            if job is None:
+                self._wakeup.clear()
+            else:
+                await self._publish_snapshot(job["id"])
+                await self._publish_queue_positions()
+                await self._run(job, slot)
+        finally:
+            await engine.release(slot)
+        return job
+
+    def _progress(self, job_id: str, progress: float, message: str, **details):
+        self.store.post(self.store.update, job_id, progress=progress, message=message, detail=details or None)
+        job_events.publish(job_id, {
+            "job_id": job_id,
+            "status": "running",
+            "progress": progress,
+            "message": message,
+            **details,
+        })
+
+    async def _run(self, job: dict, slot):
+        job_id = job["id"]
+        seed = job["seed"]
+        cache_key = job["cache_key"]
+        run = JobRun(self, job)
+        self._runs[job_id] = run
+        try:
+            # An identical job may have finished while this one was queued
+            if cache_key and settings.result_cache_enabled and not job["items"]:
+                cached = result_cache.lookup(cache_key, record_miss=False)
+                if cached is not None:
+                    await self._complete_from_cache(job_id, seed, cached)
+                    return
+
+            await self.store.run(self.store.update, job_id, backend=engine.describe(slot))
+            if job["segments"] is not None:
+                output_path = await self._render_segments(job, slot, run)
+            else:
+                sources = await self._execute(job, slot, run)
+
+                if job["items"]:
+                    await self._finish_batch(job, sources, run)
+                    return
+
+                self._progress(job_id, 0.97, "Encoding video...")
+                output_path = await self._encode(sources[0], seed, run.timer)
+
+            if cache_key and settings.result_cache_enabled:
+                await asyncio.to_thread(result_cache.store, cache_key, output_path)
+
+            await self._mark_completed(
+                job_id, seed, output_path, f"Video generated successfully! Seed: {seed}", timings=run.timer.timings
+            )
+        except asyncio.CancelledError:
+            raise
+        except JobCancelledError:
+            await self.store.run(
+                self.store.update, job_id, status="cancelled", message="Cancelled", finished_at=time.time()
+            )
+            await self._record_timings(job_id, "cancelled", run.timer.timings)
+            await self._publish_snapshot(job_id)
+            await self._publish_queue_positions()
+        except BackendLostError as e:
+            # The backend died mid-job: take it out of rotation and retry elsewhere
+            await engine.mark_failed(slot, e)
+            attempts = job["attempts"] + 1
+            if attempts < settings.max_job_attempts:
+                await self.store.run(
+                    self.store.requeue, job_id, attempts, f"Backend {engine.describe(slot)} failed, re-queued"
+                )
+                await self._publish_snapshot(job_id)
+                self._wakeup.set()
+                return
+            await self._fail(job_id, e, run.timer.timings)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            run.timer.finish()
+            await self._fail(job_id, e, run.timer.timings)
+        finally:
+            del self._runs[job_id]
+            # A re-queued long video keeps its finished segments for the next attempt
+            if job["segments"] is not None:
+                status = (await self.store.run(self.store.get, job_id))["status"]
+                if status in TERMINAL_JOB_STATES:
+                    await asyncio.to_thread(shutil.rmtree, segments_dir(job_id), ignore_errors=True)
+            run.finished.set()
+
+    async def _execute(self, job: dict, slot, run: JobRun) -> Sequence[Path]:
+        """Run the job on the engine until it finishes, is cancelled or passes its deadline
+
+        Either of the latter two also stops whatever the engine left running
+        on the backend, so an abandoned job does not keep the GPU busy.
+        """
+        timeout = settings.job_timeout * max(1, len(job["items"] or ())) or None
+        execution = asyncio.create_task(engine.execute(job, slot, run))
+        cancelled = asyncio.create_task(run.cancelled.wait())
+        try:
+            await asyncio.wait({execution, cancelled}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancelled.cancel()
+            if not execution.done():
+                execution.cancel()
+                await asyncio.gather(execution, return_exceptions=True)
+        if not execution.cancelled():
+            return execution.result()
+
+        run.timer.finish()
+        await engine.cancel(run.job, slot)
+        if run.cancelled.is_set():
+            raise JobCancelledError()
+        raise TimeoutError(f"Job did not finish within {timeout:.0f}s")
+
+    async def _render_segments(self, job: dict, slot, run: JobRun) -> Path:
+        """Render a long video one segment at a time and stitch the segments
+
+        Segment k+1 is conditioned on the last frames of segment k, so the
+        segments sample one after another on the backend; encoding the parts
+        that come from segment k (the crossfade into it and its body) runs
+        locally while segment k+1 samples. Finished segments are recorded
+        with the job, so a re-queued job resumes after the last of them.
+        """
+        job_id = job["id"]
+        request = LongVideoRequest(**job["request"])
+        plan = segment_plan(request.total_frames)
+        overlap = settings.segment_overlap_frames
+        # The last segment may render past the requested length
+        excess = sum(plan) - overlap * (len(plan) - 1) - request.total_frames
+        work_dir = segments_dir(job_id)
+        await asyncio.to_thread(work_dir.mkdir, parents=True, exist_ok=True)
+
+        done = list(job["segments"])
+        parts: list[Path] = []
+        encodes: list[asyncio.Task] = []
+        previous: Optional[Path] = None
+        try:
+            for index, frames in enumerate(plan):
+                if index < len(done) and (work_dir / done[index]["file"]).exists():
+                    path = work_dir / done[index]["file"]
+                else:
+                    del done[index:]
+                    if index == 0:
+                        workflow = job["workflow"]
+                    else:
+                        tail = work_dir / f"tail_{index:03d}.png"
+                        await video_encoder.tail_frames(previous, plan[index - 1] - overlap, tail)
+                        image = await engine.upload_image(slot, tail, f"{job_id}_{index:03d}.png")
+                        workflow = engine.build_segment(request, job["seed"], index, frames, image)
+                    run.start_segment(workflow, index, len(plan))
+                    sources = await self._execute({**job, "workflow": workflow, "items": None}, slot, run)
+                    path = work_dir / f"segment_{index:03d}{sources[0].suffix}"
+                    await asyncio.to_thread(os.replace, sources[0], path)
+                    done.append({"frames": frames, "file": path.name})
+                    run.update(segments=done)
+
+                if previous is not None:
+                    part = work_dir / f"part_{2 * index - 1:03d}.mp4"
+                    encodes.append(asyncio.create_task(video_encoder.crossfade_part(
+                        previous, plan[index - 1] - overlap, path, overlap, request.fps, part
+                    )))
+                    parts.append(part)
+                last = index == len(plan) - 1
+                part = work_dir / f"part_{2 * index:03d}.mp4"
+                encodes.append(asyncio.create_task(video_encoder.encode_part(
+                    path, overlap if index else 0, frames - (excess if last else overlap), request.fps, part
+                )))
+                parts.append(part)
+                previous = path
+
+            self._progress(job_id, 0.92, f"Stitching {len(plan)} segments...")
+            started = time.monotonic()
+            await asyncio.gather(*encodes)
+            output_path = self._output_path(job["seed"], ".mp4")
+            await video_encoder.join(parts, output_path)
+            # Only the encoding left once the last segment is sampled; the rest overlapped
+            run.timer.add("stitch", time.monotonic() - started)
+            return output_path
+        finally:
+            for task in encodes:
+                task.cancel()
+            await asyncio.gather(*encodes, return_exceptions=True)
+
+    async def _encode(self, source: Path, seed: int, timer: StageTimer) -> Path:
+        """Encode an engine's raw output into its final output file"""
+        output_path = self._output_path(seed, video_encoder.output_suffix(source.suffix))
+        started = time.monotonic()
+        output_path = await video_encoder.encode(source, output_path)
+        timer.add("encode", time.monotonic() - started)
+        return output_path
+
+    async def _finish_batch(self, job: dict, sources: Sequence[Path], run: JobRun):
+        """Encode every item of a batch and cache each under its own key"""
+        items = job["items"]
+        pending = [item for item in items if item["node"] is not None]
+        if len(sources) != len(pending):
+            raise RuntimeError(f"Expected {len(pending)} batch outputs, got {len(sources)}")
+        for index, (item, source) in enumerate(zip(pending, sources)):
+            self._progress(job["id"], 0.95 + 0.05 * index / len(pending), f"Encoding video {index + 1}/{len(pending)}...")
+            output_path = await self._encode(source, item["seed"], run.timer)
+            item["video_url"] = f"/outputs/{output_path.name}"
+            if settings.result_cache_enabled:
+                await asyncio.to_thread(result_cache.store, item["cache_key"], output_path)
+
+        await self.store.run(self.store.update, job["id"], items=items)
+        first = settings.output_dir / items[0]["video_url"].rsplit("/", 1)[-1]
+        await self._mark_completed(
+            job["id"], job["seed"], first, f"Batch of {len(items)} videos generated successfully!",
+            timings=run.timer.timings,
+        )
+
+    async def _fail(self, job_id: str, e: Exception, timings: Optional[dict[str, float]] = None):
+        await self.store.run(
+            self.store.update,
+            job_id,
+            status="error",
+            progress=0.0,
+            message=f"Generation failed: {str(e)}",
+            error=str(e),
+            finished_at=time.time(),
+        )
+        await self._record_timings(job_id, "error", timings)
+        await self._publish_snapshot(job_id)
+        await self._publish_queue_positions()
+
+
+job_queue = JobQueue(
+    JobStore(settings.data_dir / "jobs.db"),
+    num_workers=settings.num_workers,
+    max_size=settings.max_queue_size,
+)
+coordinator.handle("cancel_job", job_queue._cancel_command)
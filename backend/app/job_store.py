@@ -0,0 +1,335 @@
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence, TypeVar
+
+from .database import connect
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    request TEXT NOT NULL,
+    workflow TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    prompt_id TEXT,
+    video_url TEXT,
+    error TEXT,
+    cache_key TEXT,
+    backend TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    items TEXT,
+    output_url TEXT,
+    timings TEXT,
+    client TEXT,
+    work REAL,
+    detail TEXT,
+    subscribers TEXT,
+    segments TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, created_at);
+"""
+
+# Columns added after the initial schema; created on open for older databases
+MIGRATIONS = {
+    "cache_key": "TEXT",
+    "backend": "TEXT",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "items": "TEXT",
+    "output_url": "TEXT",
+    "timings": "TEXT",
+    "client": "TEXT",
+    "work": "REAL",
+    "detail": "TEXT",
+    "subscribers": "TEXT",
+    "segments": "TEXT",
+}
+
+
+class JobStore:
+    """SQLite-backed persistence for generation jobs"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = connect(db_path, SCHEMA, {"jobs": MIGRATIONS})
+        # Calls from the event loop run here, one at a time in submission order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run fn (a store method, or a function of several) on the store thread
+
+        Keeps SQLite off the event loop, including waits for another
+        process's write lock. Calls run in the order they were made, so a
+        write never overtakes an earlier one.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def post(self, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """Queue fn on the store thread without waiting for it (ordered like run)"""
+        self._executor.submit(fn, *args, **kwargs).add_done_callback(_log_failure)
+
+    @contextmanager
+    def transaction(self):
+        """Run several calls as one write transaction, across processes sharing the database
+
+        For check-then-insert sequences such as admitting a job and creating it.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _row_to_job(self, row: Optional[sqlite3.Row]) -> Optional[dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["workflow"] = json.loads(job["workflow"])
+        job["items"] = json.loads(job["items"]) if job["items"] else None
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        job["detail"] = json.loads(job["detail"]) if job["detail"] else None
+        job["subscribers"] = json.loads(job["subscribers"]) if job["subscribers"] else None
+        job["segments"] = json.loads(job["segments"]) if job["segments"] else None
+        return job
+
+    def create(
+        self,
+        job_id: str,
+        request: dict,
+        workflow: dict,
+        seed: int,
+        priority: int = 0,
+        cache_key: Optional[str] = None,
+        items: Optional[list[dict]] = None,
+        client: Optional[str] = None,
+        work: Optional[float] = None,
+        segments: Optional[list[dict]] = None,
+    ) -> dict:
+        """Insert a new queued job (segments: [] for a long video, filled in as they render)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, request, workflow, seed, message, created_at, cache_key, "
+                "items, client, work, subscribers, segments) VALUES (?, 'queued', ?, ?, ?, ?, 'Queued', ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, priority, json.dumps(request), json.dumps(workflow), seed, now, cache_key,
+                    json.dumps(items) if items is not None else None, client, work, json.dumps([client or ""]),
+                    json.dumps(segments) if segments is not None else None,
+                ),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> list[dict]:
+        query = "SELECT * FROM jobs"
+        params: tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, params + (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def update(self, job_id: str, **fields):
+        if not fields:
+            return
+        for key in ("items", "timings", "detail", "segments"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim_next(self, choose: Optional[Callable[[Sequence[dict]], dict]] = None) -> Optional[dict]:
+        """Atomically move the next queued job to running
+
+        Only the highest queued priority is considered. choose() picks among
+        the oldest job of each client at that priority; without it the
+        oldest job wins.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, client, work, created_at FROM jobs WHERE status = 'queued' AND "
+                    "priority = (SELECT MAX(priority) FROM jobs WHERE status = 'queued') ORDER BY created_at"
+                ).fetchall()
+                candidates: dict[Optional[str], dict] = {}
+                for candidate in rows:
+                    candidates.setdefault(candidate["client"], dict(candidate))
+                row = None
+                if candidates:
+                    row = choose(list(candidates.values())) if choose else rows[0]
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, message = 'Starting...' WHERE id = ?",
+                        (time.time(), row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def requeue(self, job_id: str, attempts: int, message: str):
+        """Put a running job back at its original queue position"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0, started_at = NULL, prompt_id = NULL, "
+                "backend = NULL, attempts = ?, message = ? WHERE id = ?",
+                (attempts, message, job_id),
+            )
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Cancel a job that has not started; False if it already left the queue"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', message = 'Cancelled', finished_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+        return cursor.rowcount > 0
+
+    def attach(self, cache_key: str, client: Optional[str], priority: int = 0) -> Optional[dict]:
+        """Add a submission to the queued or running job with the same cache key
+
+        The job takes the higher of the two priorities. Jobs whose every
+        submission was cancelled are not joined, since they are being stopped.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, subscribers FROM jobs WHERE status IN ('queued', 'running') AND cache_key = ? "
+                    "AND json_array_length(subscribers) > 0 ORDER BY created_at LIMIT 1",
+                    (cache_key,),
+                ).fetchone()
+                if row is not None:
+                    subscribers = json.loads(row["subscribers"]) + [client or ""]
+                    self._conn.execute(
+                        "UPDATE jobs SET subscribers = ?, priority = MAX(priority, ?) WHERE id = ?",
+                        (json.dumps(subscribers), priority, row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def release(self, job_id: str, client: Optional[str]) -> Optional[int]:
+        """Drop the client's submission from a job; returns how many remain
+
+        None when the job has submissions but none of them is the client's,
+        so one client cannot withdraw another's and cancel a shared job.
+        """
+        client = client or ""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT subscribers FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                subscribers = json.loads(row["subscribers"]) if row is not None and row["subscribers"] else []
+                owned = client in subscribers
+                if owned:
+                    subscribers.remove(client)
+                    self._conn.execute(
+                        "UPDATE jobs SET subscribers = ? WHERE id = ?", (json.dumps(subscribers), job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if subscribers and not owned:
+            return None
+        return len(subscribers)
+
+    def requeue_running(self) -> int:
+        """Return jobs interrupted by a restart to the queue"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0, started_at = NULL, prompt_id = NULL, "
+                "message = 'Re-queued after restart' WHERE status = 'running'"
+            )
+        return cursor.rowcount
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()
+        return row[0]
+
+    def queue_position(self, job: dict) -> int:
+        """Number of queued jobs that will run before the given one"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                "(priority > ? OR (priority = ? AND created_at < ?))",
+                (job["priority"], job["priority"], job["created_at"]),
+            ).fetchone()
+        return row[0]
+
+    def pending_work(self) -> float:
+        """Estimated work still to do for queued and running jobs"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT SUM(work * (1 - progress)) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+        return row[0] or 0.0
+
+    def seconds_per_work(self, sample: int = 20) -> Optional[float]:
+        """Observed run time per unit of estimated work (cache hits excluded)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT SUM(finished_at - started_at) / SUM(work) FROM ("
+                "SELECT started_at, finished_at, work FROM jobs WHERE status = 'completed' "
+                "AND backend IS NOT NULL AND work > 0 ORDER BY finished_at DESC LIMIT ?)",
+                (sample,),
+            ).fetchone()
+        return row[0]
+
+    def average_duration(self, sample: int = 20) -> Optional[float]:
+        """Mean run time of the most recent completed jobs"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT AVG(finished_at - started_at) FROM ("
+                "SELECT started_at, finished_at FROM jobs WHERE status = 'completed' "
+                "AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)",
+                (sample,),
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        self._executor.shutdown()
+        with self._lock:
+            self._conn.close()
+
+
+def _log_failure(future: Future):
+    if future.exception() is not None:
+        logger.error("Job store write failed", exc_info=future.exception())
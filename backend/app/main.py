@@ -1,46 +1,80 @@
-import os
+import json
+import math
 import asyncio
+import logging
 from pathlib import Path
+from typing import Optional, Union
 from datetime import datetime
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
 from .models import (
     VideoGenerationRequest,
     VideoGenerationResponse,
+    VideoBatchRequest,
+    LongVideoRequest,
+    BatchGenerationResponse,
     GenerationStatus,
+    JobInfo,
+    JobListResponse,
+    VideoInfo,
+    VideoListResponse,
+    PromoteRequest,
+    Quality,
 )
-from .comfyui_client import comfyui_client
-from .workflow_builder import workflow_builder
+from .comfyui_pool import comfyui_pool
+from .engine import engine
+from .job_queue import job_queue, NotSubmitterError
+from .admission import AdmissionError, client_label, rate_limiter
+from .result_cache import result_cache
+from .events import job_events
+from .coordinator import coordinator
+from .streaming import RangeFileResponse
+from .video_catalog import video_catalog
+from .video_encoder import video_encoder, preview_path, poster_path
+from .metrics import registry
 
 
-# Global status tracking
-current_status = GenerationStatus(status="idle", progress=0.0, message="Ready")
-_status_lock = asyncio.Lock()
+logger = logging.getLogger(__name__)
 
 
-async def update_status(status: str, progress: float = 0.0, message: str = ""):
-    global current_status
-    async with _status_lock:
-        current_status = GenerationStatus(status=status, progress=progress, message=message)
+# Seconds between SSE comment lines that keep idle proxies from closing the stream
+SSE_KEEPALIVE_INTERVAL = 15.0
+TERMINAL_JOB_STATES = ("completed", "error", "cancelled")
+
+
+async def start_dispatching():
+    """Start the engine and job workers (in the coordinator process only)"""
+    added, removed = await asyncio.to_thread(video_catalog.reconcile, settings.output_dir)
+    if added or removed:
+        logger.info("Video catalog reconciled: %d added, %d removed", added, removed)
+    await engine.start()
+    await job_queue.start()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     settings.output_dir.mkdir(parents=True, exist_ok=True)
+    if coordinator.shared:
+        job_events.start_polling(job_queue.event, settings.coordination_poll_interval)
+    await coordinator.start(start_dispatching)
     yield
     # Shutdown
-    pass
+    if coordinator.is_leader:
+        await job_queue.stop()
+    await engine.close()
+    await job_events.stop_polling()
+    await coordinator.close()
 
 
 app = FastAPI(
     title="Short Video Generator",
-    description="Generate short videos using WAN 2.2 model via ComfyUI",
+    description="Generate short videos using WAN models via ComfyUI or diffusers",
     version="2.0.0",
     lifespan=lifespan
 )
@@ -57,131 +91,424 @@ app.add_middleware(
 
 @app.get("/api/health")
 async def health_check():
-    comfyui_available = await comfyui_client.is_available()
-    return {
-        "status": "healthy",
-        "comfyui_available": comfyui_available,
-        "model_loaded": comfyui_available  # ComfyUI loads models on demand
+    """Cached backend snapshot; answers 503 when the engine cannot take jobs"""
+    state = coordinator.engine_state()
+    available = state["available"]
+    body = {
+        "status": "healthy" if available else "unhealthy",
+        "engine": engine.name,
+        "comfyui_available": engine.name == "comfyui" and available,
+        "model_loaded": state["loaded"],
+        "model_state": state["model_state"],  # warm / warming / cold
+        "queue": await job_queue.counts(),
+        "backends": state["backends"],
     }
+    return JSONResponse(body, status_code=200 if available else 503)
+
+
+@app.get("/api/backends")
+async def list_backends():
+    """Health and load of each backend of the generation engine"""
+    return {"engine": engine.name, "backends": coordinator.engine_state()["backends"]}
 
 
 @app.get("/api/status")
 async def get_status():
-    return current_status
+    """Status of the running (or most recent) job"""
+    job = await job_queue.current()
+    if job is None:
+        return GenerationStatus(status="idle", progress=0.0, message="Ready")
+    if job.status == "queued":
+        return GenerationStatus(
+            status="generating",
+            progress=0.0,
+            message=f"Queued (position {job.queue_position + 1})",
+        )
+    if job.status == "cancelled":
+        return GenerationStatus(status="idle", progress=job.progress, message=job.message)
+    status = "generating" if job.status == "running" else job.status
+    return GenerationStatus(status=status, progress=job.progress, message=job.message)
 
 
 @app.post("/api/load-model")
 async def load_model():
-    """Check if ComfyUI is available (models load on demand)"""
-    comfyui_available = await comfyui_client.is_available()
-
-    if comfyui_available:
-        await update_status("idle", 1.0, "ComfyUI is ready. Models will load on first generation.")
-        return {"message": "ComfyUI is ready"}
+    """Make the model resident (ComfyUI backends are warmed in the background)"""
+    if await coordinator.request("load_model"):
+        return {"message": "ComfyUI is ready" if engine.name == "comfyui" else "Model loaded"}
     else:
-        await update_status("error", 0.0, "ComfyUI is not running. Please start ComfyUI first.")
-        raise HTTPException(
-            status_code=503,
-            detail="ComfyUI is not running. Start it with: cd comfyui && python main.py --listen"
-        )
+        raise HTTPException(status_code=503, detail=engine.unavailable_message)
 
 
 @app.post("/api/unload-model")
 async def unload_model():
-    """ComfyUI manages model memory automatically"""
-    await update_status("idle", 0.0, "Ready")
-    return {"message": "Status reset. ComfyUI manages models automatically."}
+    """Release the resident model"""
+    return {"message": await coordinator.request("unload_model")}
 
 
 @app.post("/api/generate", response_model=VideoGenerationResponse)
-async def generate_video(request: VideoGenerationRequest, background_tasks: BackgroundTasks):
-    # Check ComfyUI availability
-    if not await comfyui_client.is_available():
-        raise HTTPException(
-            status_code=503,
-            detail="ComfyUI is not running. Start it with: cd comfyui && python main.py --listen"
+async def generate_video(request: VideoGenerationRequest, http_request: Request):
+    # Check engine availability
+    _require_engine()
+
+    return await _submit(request, _client(http_request))
+
+
+def _require_engine():
+    if not coordinator.engine_state()["available"]:
+        raise HTTPException(status_code=503, detail=engine.unavailable_message)
+
+
+def _client(http_request: Request) -> str:
+    """Quota and fair-share identity: the X-API-Key header, else the client address"""
+    address = http_request.client.host if http_request.client else None
+    return client_label(http_request.headers.get("x-api-key"), address)
+
+
+def _rejected(e: AdmissionError) -> HTTPException:
+    return HTTPException(
+        status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+
+async def _submit(request: Union[VideoGenerationRequest, LongVideoRequest], client: str) -> VideoGenerationResponse:
+    # Build workflow (or pipeline arguments for the diffusers engine)
+    workflow, seed = engine.build(request)
+
+    try:
+        rate_limiter.check(client)
+        job = await job_queue.submit(request, workflow, seed, client)
+    except AdmissionError as e:
+        raise _rejected(e)
+
+    if job.status == "completed":
+        return VideoGenerationResponse(
+            success=True,
+            job_id=job.job_id,
+            video_url=job.video_url,
+            message="Served from cache",
+            seed_used=seed
         )
 
-    if current_status.status == "generating":
-        raise HTTPException(status_code=400, detail="Generation already in progress")
+    return VideoGenerationResponse(
+        success=True,
+        job_id=job.job_id,
+        video_url=None,
+        message="Joined an identical job in progress" if job.subscribers > 1 else "Generation queued",
+        seed_used=seed
+    )
+
 
-    # Build workflow
-    workflow, seed = workflow_builder.build_workflow(request)
+@app.post("/api/jobs/{job_id}/promote", response_model=VideoGenerationResponse)
+async def promote_job(job_id: str, http_request: Request, promote: Optional[PromoteRequest] = None):
+    """Re-render a finished draft at full quality with the same prompt and seed"""
+    promote = promote or PromoteRequest()
+    job = await job_queue.store.run(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail="Only completed jobs can be promoted")
+
+    if job["items"]:
+        if promote.item is None or promote.item >= len(job["items"]):
+            raise HTTPException(status_code=400, detail=f"Pick a batch item (0-{len(job['items']) - 1})")
+        item = job["items"][promote.item]
+        draft = VideoBatchRequest(**job["request"]).item_requests()[promote.item]
+        draft.seed = item["seed"]
+    else:
+        draft = VideoGenerationRequest(**job["request"])
+        draft.seed = job["seed"]
 
-    async def generate_task():
-        try:
-            await update_status("generating", 0.1, "Queuing workflow...")
+    if draft.quality != Quality.DRAFT:
+        raise HTTPException(status_code=400, detail="Job was already rendered at full quality")
+
+    _require_engine()
 
-            # Queue the workflow
-            prompt_id = await comfyui_client.queue_prompt(workflow)
+    request = draft.model_copy(update={"quality": Quality.FULL})
+    if promote.priority is not None:
+        request.priority = promote.priority
+    return await _submit(request, _client(http_request))
 
-            await update_status("generating", 0.2, "Generating video (this may take a while)...")
 
-            # Wait for completion with progress updates
-            def progress_cb(progress: float):
-                asyncio.create_task(
-                    update_status("generating", 0.2 + progress * 0.7, f"Generating... {int(progress * 100)}%")
-                )
+@app.post("/api/generate/long", response_model=VideoGenerationResponse)
+async def generate_long_video(request: LongVideoRequest, http_request: Request):
+    """Render a video longer than one clip as overlapping segments
 
-            history = await comfyui_client.wait_for_completion(prompt_id, progress_cb, timeout=600)
+    Each segment is conditioned on the last frames of the previous one and
+    consecutive segments are crossfaded over their overlap, all in one job.
+    """
+    if not engine.supports_segments:
+        raise HTTPException(status_code=400, detail=f"The {engine.name} engine does not support long videos")
+    if not video_encoder.can_stitch:
+        raise HTTPException(status_code=400, detail="Long videos need ffmpeg to stitch segments")
+    if request.duration > settings.max_long_video_seconds:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Duration is {request.duration:g}s; the limit is {settings.max_long_video_seconds:g}s"
+        )
 
-            await update_status("generating", 0.95, "Downloading video...")
+    _require_engine()
 
-            # Get output video URL
-            video_url = await comfyui_client.get_output_video(history)
+    return await _submit(request, _client(http_request))
 
-            if video_url:
-                # Download to local outputs folder
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                output_filename = f"video_{timestamp}_{seed}.mp4"
-                output_path = settings.output_dir / output_filename
 
-                await comfyui_client.download_video(video_url, output_path)
+@app.post("/api/generate/batch", response_model=BatchGenerationResponse)
+async def generate_batch(batch: VideoBatchRequest, http_request: Request):
+    """Render every prompt x seed combination as one job group
 
-                await update_status("completed", 1.0, f"Video generated successfully! Seed: {seed}")
-            else:
-                await update_status("error", 0.0, "No video output found in workflow result")
+    All items go to ComfyUI as a single graph that shares model loaders and
+    text encoders; items already in the result cache are returned directly.
+    """
+    if not engine.supports_batch:
+        raise HTTPException(status_code=400, detail=f"The {engine.name} engine does not support batches")
 
-        except Exception as e:
-            await update_status("error", 0.0, f"Generation failed: {str(e)}")
+    count = len(batch.prompts) * (len(batch.seeds) if batch.seeds else batch.variants)
+    if count > settings.max_batch_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch has {count} items; the limit is {settings.max_batch_items}"
+        )
 
-    background_tasks.add_task(generate_task)
+    _require_engine()
 
-    return VideoGenerationResponse(
+    items = engine.build_batch(batch)
+
+    try:
+        client = _client(http_request)
+        rate_limiter.check(client, len(items))
+        job = await job_queue.submit_batch(batch, items, client)
+    except AdmissionError as e:
+        raise _rejected(e)
+
+    return BatchGenerationResponse(
         success=True,
-        video_url=None,
-        message="Generation started",
-        seed_used=seed
+        job_id=job.job_id,
+        message="Served from cache" if job.status == "completed" else "Batch queued",
+        items=job.items,
+    )
+
+
+@app.get("/api/jobs", response_model=JobListResponse)
+async def list_jobs(http_request: Request, status: Optional[str] = None, limit: int = 50):
+    """List recent jobs, newest first"""
+    jobs = await job_queue.list(status, min(max(limit, 1), 500), viewer=_client(http_request))
+    return JobListResponse(jobs=jobs, **await job_queue.counts())
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str, http_request: Request):
+    """Get state, queue position and ETA of a job"""
+    job = await job_queue.get(job_id, viewer=_client(http_request))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.delete("/api/jobs/{job_id}", response_model=JobInfo)
+async def cancel_job(job_id: str, http_request: Request):
+    """Cancel a queued job, or interrupt a running one on its backend
+
+    A job shared by identical submissions only stops when the last of them
+    is cancelled; until then this withdraws the caller's submission.
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in TERMINAL_JOB_STATES:
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    try:
+        return await job_queue.cancel(job_id, _client(http_request))
+    except NotSubmitterError:
+        raise HTTPException(status_code=403, detail="Job was submitted by another client")
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events stream of job progress until the job finishes"""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        queue = job_events.subscribe(job_id)
+        try:
+            # Snapshot after subscribing so no transition falls in between
+            snapshot = await job_queue.get(job_id)
+            yield _sse(snapshot.model_dump())
+            if snapshot.status in TERMINAL_JOB_STATES:
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event)
+                if event.get("status") in TERMINAL_JOB_STATES:
+                    return
+        finally:
+            job_events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
-@app.get("/api/videos")
-async def list_videos():
-    """List all generated videos"""
-    videos = []
-    for file in settings.output_dir.glob("*.mp4"):
-        videos.append({
-            "name": file.name,
-            "url": f"/outputs/{file.name}",
-            "created": file.stat().st_mtime
-        })
-    videos.sort(key=lambda x: x["created"], reverse=True)
-    return {"videos": videos}
+registry.gauge(
+    "queue_jobs", "Jobs waiting or running",
+    lambda: [({"status": status}, job_queue.store.count(status)) for status in ("queued", "running")],
+)
+registry.gauge(
+    "backend_healthy", "Whether a backend answered its latest probe",
+    lambda: [
+        ({"backend": backend["address"]}, float(backend["healthy"]))
+        for backend in coordinator.engine_state()["backends"]
+    ],
+)
+registry.gauge(
+    "backend_active_jobs", "Jobs dispatched to a backend",
+    lambda: [
+        ({"backend": backend["address"]}, backend["active_jobs"])
+        for backend in coordinator.engine_state()["backends"]
+    ],
+)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus metrics: stage timing histograms, queue depth and throughput"""
+    body = await asyncio.to_thread(lambda: registry.render(coordinator.metric_snapshots()))
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Result cache size and hit/miss counters"""
+    return await asyncio.to_thread(result_cache.stats)
+
+
+@app.delete("/api/cache")
+async def clear_cache():
+    """Drop all cached results (generated videos are kept)"""
+    await asyncio.to_thread(result_cache.clear)
+    return {"message": "Cache cleared"}
+
+
+def _output_file(filename: str) -> Path:
+    """Resolve a generated video by name, refusing anything outside output_dir"""
+    if "/" in filename or "\\" in filename or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Video not found")
+    return settings.output_dir / filename
+
+
+@app.get("/api/videos", response_model=VideoListResponse)
+async def list_videos(
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    prompt: Optional[str] = None,
+    seed: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """List generated videos newest first (pass next_cursor back as cursor for the next page)"""
+    try:
+        rows, next_cursor = await asyncio.to_thread(
+            video_catalog.list,
+            limit,
+            cursor,
+            prompt,
+            seed,
+            since.timestamp() if since else None,
+            until.timestamp() if until else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    videos = [
+        VideoInfo(
+            url=f"/outputs/{row['name']}",
+            preview_url=f"/outputs/{row['preview']}" if row["preview"] else None,
+            poster_url=f"/outputs/{row['poster']}" if row["poster"] else None,
+            created=row.pop("created_at"),
+            **row,
+        )
+        for row in rows
+    ]
+    return VideoListResponse(videos=videos, next_cursor=next_cursor)
 
 
 @app.delete("/api/videos/{filename}")
 async def delete_video(filename: str):
     """Delete a generated video"""
-    video_path = settings.output_dir / filename
-    if not video_path.exists():
+    video_path = _output_file(filename)
+    if not video_path.is_file():
+        await asyncio.to_thread(video_catalog.remove, filename)
         raise HTTPException(status_code=404, detail="Video not found")
 
     video_path.unlink()
+    preview_path(video_path).unlink(missing_ok=True)
+    poster_path(video_path).unlink(missing_ok=True)
+    await asyncio.to_thread(video_catalog.remove, filename)
     return {"message": "Video deleted"}
 
 
-# Mount outputs directory
-app.mount("/outputs", StaticFiles(directory=str(settings.output_dir)), name="outputs")
+@app.api_route("/outputs/{filename}", methods=["GET", "HEAD"])
+async def serve_output(filename: str, request: Request):
+    """Serve a generated video with HTTP Range support (seeking, resumable downloads)"""
+    path = _output_file(filename)
+    try:
+        return await asyncio.to_thread(
+            RangeFileResponse, path, request.headers.get("range"), request.method
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+
+PROXY_HEADERS = ("content-type", "content-length", "content-range", "accept-ranges")
+
+
+@app.api_route("/api/jobs/{job_id}/video", methods=["GET", "HEAD"])
+async def job_video(job_id: str, request: Request):
+    """Serve a job's video, streaming it from ComfyUI until the local copy exists"""
+    job = await job_queue.store.run(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    range_header = request.headers.get("range")
+    if job["video_url"]:
+        path = _output_file(job["video_url"].rsplit("/", 1)[-1])
+        try:
+            return await asyncio.to_thread(RangeFileResponse, path, range_header, request.method)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Video not found")
+
+    node = comfyui_pool.get_node(job["backend"]) if job["backend"] else None
+    if not job["output_url"] or node is None:
+        raise HTTPException(status_code=409, detail="Video is not ready yet")
+
+    headers = {"Range": range_header} if range_header else {}
+    resp = await node.client.session.request(request.method, job["output_url"], headers=headers)
+    if resp.status not in (200, 206, 416):
+        resp.release()
+        raise HTTPException(status_code=502, detail=f"ComfyUI returned {resp.status}")
+
+    async def body():
+        try:
+            async for chunk in resp.content.iter_chunked(1024 * 1024):
+                yield chunk
+        finally:
+            resp.release()
+
+    return StreamingResponse(
+        body(),
+        status_code=resp.status,
+        headers={name: resp.headers[name] for name in PROXY_HEADERS if name in resp.headers},
+    )
 
 # Serve React static files (built frontend)
 frontend_build_path = Path(__file__).parent.parent.parent / "frontend" / "dist"
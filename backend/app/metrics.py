@@ -0,0 +1,163 @@
+import bisect
+import threading
+from collections import defaultdict
+from typing import Callable, Optional, Sequence
+
+
+# Stages range from milliseconds (text encode) to many minutes (sampling)
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] += amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, others: Sequence[list] = ()) -> list[str]:
+        """Exposition lines, adding in snapshots taken by other processes"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for snapshot in others:
+            for key, value in snapshot:
+                key = tuple(tuple(pair) for pair in key)
+                values[key] = values.get(key, 0.0) + value
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(key))} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, help: str, collect: Callable[[], list[tuple[dict, float]]]):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self, others: Sequence[list] = ()) -> list[str]:
+        # Read live, so there is nothing to add from other processes
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts..., sum, count]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), series[:]] for key, series in self._series.items()]
+
+    def render(self, others: Sequence[list] = ()) -> list[str]:
+        """Exposition lines, adding in snapshots taken by other processes"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            merged = {key: series[:] for key, series in self._series.items()}
+        for snapshot in others:
+            for key, series in snapshot:
+                key = tuple(tuple(pair) for pair in key)
+                if key not in merged:
+                    merged[key] = series
+                else:
+                    merged[key] = [a + b for a, b in zip(merged[key], series)]
+        for key, series in sorted(merged.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry (no client library needed)"""
+
+    def __init__(self, prefix: str = "shortgen"):
+        self.prefix = prefix
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", help))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], list[tuple[dict, float]]]) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", help, collect))
+
+    def histogram(self, name: str, help: str, buckets: Optional[tuple[float, ...]] = None) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", help, buckets or DEFAULT_BUCKETS))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict[str, list]:
+        """Counter and histogram state, for another process to merge into its render()"""
+        return {metric.name: metric.snapshot() for metric in self._metrics if not isinstance(metric, Gauge)}
+
+    def render(self, others: Sequence[dict[str, list]] = ()) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render([other[metric.name] for other in others if metric.name in other]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram("stage_seconds", "Wall-clock seconds spent per job stage")
+job_seconds = registry.histogram("job_seconds", "Seconds from submission to completion")
+jobs_total = registry.counter("jobs_total", "Finished jobs by outcome")
+videos_total = registry.counter("videos_total", "Videos produced (batch items count individually)")
+video_seconds_total = registry.counter("video_seconds_total", "Seconds of video produced")
+coalesced_total = registry.counter("coalesced_total", "Submissions that joined an identical job in flight")
+text_cache_total = registry.counter("text_cache_total", "Text encodings served from cache (hit) or computed (miss)")
+warmup_seconds = registry.histogram("warmup_seconds", "Seconds taken by model warm-up prompts")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import Annotated, Optional, Literal
 from enum import Enum
 
 
@@ -8,6 +8,17 @@ class AspectRatio(str, Enum):
     LANDSCAPE = "landscape"  # 16:9 (1920x1080)
 
 
+class Quality(str, Enum):
+    FULL = "full"  # configured steps, frames and resolution
+    DRAFT = "draft"  # few steps, short clip, reduced resolution for prompt iteration
+
+
+class Speed(str, Enum):
+    QUALITY = "quality"  # every step runs in full
+    BALANCED = "balanced"  # conservative step caching (~1.5x faster sampling)
+    FAST = "fast"  # aggressive step caching and an earlier high/low-noise split (~2x)
+
+
 class VideoGenerationRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=2000, description="Text prompt for video generation")
     negative_prompt: str = Field(
@@ -20,10 +31,72 @@ class VideoGenerationRequest(BaseModel):
     guidance_scale: float = Field(default=5.0, ge=1.0, le=20.0, description="Classifier-free guidance scale")
     seed: Optional[int] = Field(default=None, description="Random seed for reproducibility")
     fps: int = Field(default=16, ge=8, le=30, description="Frames per second for output video")
+    priority: int = Field(default=0, ge=0, le=10, description="Queue priority (higher runs first)")
+    quality: Quality = Field(default=Quality.FULL, description="Render mode (draft renders can be promoted)")
+    speed: Optional[Speed] = Field(default=None, description="Sampling speed preset (defaults to SPEED_PRESET)")
+
+
+class VideoBatchRequest(BaseModel):
+    """N variants rendered in one ComfyUI submission (every prompt x every seed)"""
+    prompts: list[Annotated[str, Field(min_length=1, max_length=2000)]] = Field(
+        ..., min_length=1, description="Prompts to render"
+    )
+    seeds: Optional[list[int]] = Field(default=None, description="Seeds applied to every prompt")
+    variants: int = Field(default=1, ge=1, le=16, description="Random seeds per prompt when seeds is omitted")
+    negative_prompt: str = Field(
+        default="low quality, blurry, distorted, deformed, ugly, bad anatomy",
+        description="Negative prompt to avoid unwanted elements"
+    )
+    aspect_ratio: AspectRatio = Field(default=AspectRatio.PORTRAIT, description="Video aspect ratio")
+    num_frames: int = Field(default=81, ge=17, le=129, description="Number of frames (must be 4k+1, e.g., 17, 33, 49, 65, 81)")
+    num_inference_steps: int = Field(default=30, ge=10, le=100, description="Number of denoising steps")
+    guidance_scale: float = Field(default=5.0, ge=1.0, le=20.0, description="Classifier-free guidance scale")
+    fps: int = Field(default=16, ge=8, le=30, description="Frames per second for output video")
+    priority: int = Field(default=0, ge=0, le=10, description="Queue priority (higher runs first)")
+    quality: Quality = Field(default=Quality.FULL, description="Render mode (draft renders can be promoted)")
+    speed: Optional[Speed] = Field(default=None, description="Sampling speed preset (defaults to SPEED_PRESET)")
+
+    def item_requests(self) -> list[VideoGenerationRequest]:
+        """Expand into one single-video request per (prompt, seed) pair"""
+        shared = self.model_dump(exclude={"prompts", "seeds", "variants"})
+        seeds = self.seeds or [None] * self.variants
+        return [
+            VideoGenerationRequest(prompt=prompt, seed=seed, **shared)
+            for prompt in self.prompts
+            for seed in seeds
+        ]
+
+
+class LongVideoRequest(BaseModel):
+    """A video longer than one clip, rendered as overlapping segments and stitched"""
+    prompt: str = Field(..., min_length=1, max_length=2000, description="Text prompt for video generation")
+    negative_prompt: str = Field(
+        default="low quality, blurry, distorted, deformed, ugly, bad anatomy",
+        description="Negative prompt to avoid unwanted elements"
+    )
+    aspect_ratio: AspectRatio = Field(default=AspectRatio.PORTRAIT, description="Video aspect ratio")
+    duration: float = Field(default=20.0, ge=2.0, le=300.0, description="Length in seconds (up to MAX_LONG_VIDEO_SECONDS)")
+    num_inference_steps: int = Field(default=30, ge=10, le=100, description="Number of denoising steps per segment")
+    guidance_scale: float = Field(default=5.0, ge=1.0, le=20.0, description="Classifier-free guidance scale")
+    seed: Optional[int] = Field(default=None, description="Random seed for reproducibility (segment i uses seed + i)")
+    fps: int = Field(default=16, ge=8, le=30, description="Frames per second for output video")
+    priority: int = Field(default=0, ge=0, le=10, description="Queue priority (higher runs first)")
+    speed: Optional[Speed] = Field(default=None, description="Sampling speed preset (defaults to SPEED_PRESET)")
+
+    @property
+    def total_frames(self) -> int:
+        return round(self.duration * self.fps)
+
+
+class PromoteRequest(BaseModel):
+    """Re-render a finished draft at full quality with the same seed"""
+    item: Optional[int] = Field(default=None, ge=0, description="Batch item index (batch jobs only)")
+    priority: Optional[int] = Field(default=None, ge=0, le=10, description="Queue priority (defaults to the draft's)")
 
 
 class VideoGenerationResponse(BaseModel):
     success: bool
+    job_id: Optional[str] = None
     video_url: Optional[str] = None
     message: str
     seed_used: int
@@ -33,3 +106,73 @@ class GenerationStatus(BaseModel):
     status: Literal["idle", "loading", "generating", "completed", "error"]
     progress: float = 0.0
     message: str = ""
+
+
+JobState = Literal["queued", "running", "completed", "error", "cancelled"]
+
+
+class BatchItem(BaseModel):
+    prompt: str
+    seed: int
+    video_url: Optional[str] = None
+    cached: bool = False
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: JobState
+    priority: int = 0
+    progress: float = 0.0
+    message: str = ""
+    prompt: str = ""
+    seed: int
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+    backend: Optional[str] = None
+    attempts: int = 0
+    client: Optional[str] = None  # caller's own "key:<hash>" or "ip:<address>" on jobs it submitted, for CLIENT_WEIGHTS
+    subscribers: int = 1  # identical submissions sharing this job; cancelling drops one
+    items: Optional[list[BatchItem]] = None
+    segments: Optional[int] = None  # long videos: segments rendered so far
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Optional[dict[str, float]] = None  # seconds per stage (queue_wait, sampling, vae_decode, ...)
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+
+
+class JobListResponse(BaseModel):
+    jobs: list[JobInfo]
+    queued: int
+    running: int
+
+
+class BatchGenerationResponse(BaseModel):
+    success: bool
+    job_id: str
+    message: str
+    items: list[BatchItem]
+
+
+class VideoInfo(BaseModel):
+    name: str
+    url: str
+    preview_url: Optional[str] = None
+    poster_url: Optional[str] = None
+    created: float
+    job_id: Optional[str] = None
+    prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    seed: Optional[int] = None
+    params: Optional[dict] = None
+    size: int = 0
+    duration: Optional[float] = None
+    generation_seconds: Optional[float] = None
+    queue_seconds: Optional[float] = None
+    cached: bool = False
+
+
+class VideoListResponse(BaseModel):
+    videos: list[VideoInfo]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,66 @@
+from typing import NamedTuple, Optional
+
+from .config import settings
+from .models import AspectRatio
+
+
+# Calibration point: 496x496 x 81 frames is the largest job whose VAE decode
+# fits on a 24 GB unified-memory machine with the GGUF models resident
+REFERENCE_BUDGET_GB = 24.0
+REFERENCE_PIXEL_FRAMES = 496 * 496 * 81
+
+# (width, height) proportions per aspect ratio
+ASPECT_RATIOS = {
+    AspectRatio.PORTRAIT: (9, 16),
+    AspectRatio.LANDSCAPE: (16, 9),
+}
+
+
+class ResolutionPlan(NamedTuple):
+    width: int
+    height: int
+    # Output size of the optional upscale pass after VAE decode
+    upscale: Optional[tuple[int, int]] = None
+
+
+def pixel_frame_limit(budget_gb: float, weights_memory_gb: float) -> float:
+    """Largest width x height x frames that fits in the budget
+
+    Activation memory is assumed to grow linearly with pixels x frames on
+    top of a fixed model footprint, scaled from the calibration point.
+    """
+    per_gb = REFERENCE_PIXEL_FRAMES / (REFERENCE_BUDGET_GB - weights_memory_gb)
+    return max(0.0, budget_gb - weights_memory_gb) * per_gb
+
+
+def fit_resolution(aspect_ratio: AspectRatio, max_pixels: float, max_long_side: int) -> tuple[int, int]:
+    """Largest 16-divisible (width, height) with the given aspect ratio and limits"""
+    ratio_w, ratio_h = ASPECT_RATIOS[aspect_ratio]
+    short_ratio, long_ratio = sorted((ratio_w, ratio_h))
+
+    short = long = 16
+    for short in range(max_long_side // 16 * 16, 15, -16):
+        long = max(16, round(short * long_ratio / short_ratio / 16) * 16)
+        if long <= max_long_side and short * long <= max_pixels:
+            break
+
+    return (short, long) if ratio_w < ratio_h else (long, short)
+
+
+def plan_resolution(aspect_ratio: AspectRatio, num_frames: int, budget_gb: Optional[float] = None) -> ResolutionPlan:
+    """Pick the generation size for a request and the optional upscale target"""
+    budget = settings.memory_budget_gb if budget_gb is None else budget_gb
+    limit = pixel_frame_limit(budget, settings.weights_memory_gb)
+    if settings.vae_decode == "tiled":
+        # The calibration point is decode-bound; tiled decode has a fixed peak
+        limit *= settings.vae_tiled_headroom
+    width, height = fit_resolution(aspect_ratio, limit / num_frames, settings.max_long_side)
+
+    upscale = None
+    if settings.upscale_long_side > max(width, height):
+        ratio_w, ratio_h = ASPECT_RATIOS[aspect_ratio]
+        long = settings.upscale_long_side
+        short = round(long * min(ratio_w, ratio_h) / max(ratio_w, ratio_h))
+        upscale = (short, long) if ratio_w < ratio_h else (long, short)
+
+    return ResolutionPlan(width, height, upscale)
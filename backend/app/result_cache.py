@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+
+
+def workflow_key(workflow: dict, encoding: Optional[dict] = None) -> str:
+    """Content hash of a fully-resolved workflow (canonical JSON, sorted keys)
+
+    Output encoding settings, when given, are part of the key since they
+    change the stored file.
+    """
+    value = {"workflow": workflow, "encoding": encoding} if encoding else workflow
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: Path, dest: Path):
+    """Hardlink src to dest, falling back to a copy across filesystems"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+class ResultCache:
+    """Content-addressed store of generated videos with LRU eviction
+
+    Entries live at ``<root>/<key[:2]>/<key><ext>``; file atime doubles as the
+    last-access time, so the store needs no separate index. Entries are
+    hardlinked to the outputs they serve, so mtime is left untouched.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, max_age: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str) -> Optional[Path]:
+        bucket = self.root / key[:2]
+        if not bucket.is_dir():
+            return None
+        for path in bucket.glob(f"{key}.*"):
+            return path
+        return None
+
+    def lookup(self, key: str, record_miss: bool = True) -> Optional[Path]:
+        """Return the cached file for key and mark it recently used"""
+        path = self._entry(key)
+        if path is not None and self.max_age > 0 and time.time() - path.stat().st_atime > self.max_age:
+            path.unlink(missing_ok=True)
+            path = None
+        with self._lock:
+            if path is None:
+                if record_miss:
+                    self.misses += 1
+                return None
+            self.hits += 1
+        os.utime(path, (time.time(), path.stat().st_mtime))
+        return path
+
+    def store(self, key: str, src: Path) -> Path:
+        """Add a finished output to the cache and evict to stay within bounds"""
+        dest = self.root / key[:2] / f"{key}{src.suffix}"
+        if not dest.exists():
+            link_or_copy(src, dest)
+        self.evict()
+        return dest
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.root.is_dir():
+            return entries
+        for path in self.root.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used ones over max_bytes"""
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for atime, size, path in entries:
+            expired = self.max_age > 0 and now - atime > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+
+    def clear(self):
+        for _, _, path in self._entries():
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.result_cache_enabled,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache(
+    settings.output_dir / ".cache",
+    max_bytes=settings.result_cache_max_bytes,
+    max_age=settings.result_cache_max_age,
+)
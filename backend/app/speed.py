@@ -0,0 +1,41 @@
+from typing import NamedTuple, Optional
+
+from .config import settings
+from .models import Speed
+
+
+class SpeedProfile(NamedTuple):
+    # Fraction of the steps sampled by the high-noise model (WAN 2.2 two-stage graph)
+    high_noise_split: float = 0.5
+    # Step-cache reuse threshold of the high- and low-noise samplers, 0 disables.
+    # A step whose model input changed less than this (relative, accumulated
+    # since the last full step) reuses the previous output residual instead of
+    # running the transformer
+    high_noise_cache: float = 0.0
+    low_noise_cache: float = 0.0
+    # Share of the noise schedule where caching may apply; the first steps
+    # lay out the composition and always run in full
+    cache_start: float = 0.15
+    cache_end: float = 0.95
+    # diffusers pipelines (single model): FirstBlockCache threshold, 0 disables
+    pipeline_cache: float = 0.0
+
+
+# Later low-noise steps only refine detail, so they take the higher thresholds;
+# "fast" also hands more of the steps to the low-noise stage
+SPEED_PROFILES = {
+    Speed.QUALITY: SpeedProfile(),
+    Speed.BALANCED: SpeedProfile(high_noise_cache=0.05, low_noise_cache=0.15, pipeline_cache=0.05),
+    Speed.FAST: SpeedProfile(high_noise_split=0.4, high_noise_cache=0.1, low_noise_cache=0.25, pipeline_cache=0.1),
+}
+
+
+def speed_profile(speed: Optional[Speed] = None) -> SpeedProfile:
+    """Profile of a preset (default SPEED_PRESET) with the SPEED_PROFILES overrides applied"""
+    speed = speed or Speed(settings.speed_preset)
+    return SPEED_PROFILES[speed]._replace(**settings.speed_profiles.get(speed.value, {}))
+
+
+def high_noise_end_step(steps: int, split: float) -> int:
+    """Last step of the high-noise sampler; each stage keeps at least one step"""
+    return min(steps - 1, max(1, int(steps * split)))
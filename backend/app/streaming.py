@@ -0,0 +1,125 @@
+import os
+import re
+import stat
+import mimetypes
+from pathlib import Path
+from typing import Optional
+from email.utils import formatdate
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+# Large reads keep the number of thread hops per video small
+CHUNK_SIZE = 1024 * 1024
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+mimetypes.add_type("video/mp4", ".mp4")
+mimetypes.add_type("video/webm", ".webm")
+mimetypes.add_type("image/webp", ".webp")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a single "bytes=start-end" range into an inclusive (start, end)
+
+    Returns None when the whole file should be sent and raises ValueError for
+    an unsatisfiable range. Multi-range requests are answered with the full file.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """Serve a local file with HTTP Range support
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it, otherwise streams large chunks read in a worker thread so the event
+    loop never blocks on disk I/O.
+    """
+
+    def __init__(self, path: Path, range_header: Optional[str] = None, method: str = "GET"):
+        super().__init__(status_code=200)
+        self.path = path
+        self.send_body = method != "HEAD"
+        stat_result = os.stat(path)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise FileNotFoundError(path)
+        size = stat_result.st_size
+
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.raw_headers = []
+        self.headers["content-type"] = media_type
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["etag"] = f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            self.offset, self.length = 0, 0
+            return
+
+        if byte_range is None:
+            self.offset, self.length = 0, size
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.offset, self.length = start, end - start + 1
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; close the body cleanly
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Optional
+
+import torch
+
+
+def text_key(text: str, encoder: str) -> str:
+    """Cache key of one text encoded by one text encoder"""
+    canonical = json.dumps([encoder, text], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TextEncodingCache:
+    """Two-level LRU cache of text-encoder outputs (prompt embeddings)
+
+    The newest max_entries tensors are kept in memory (on the CPU, so cached
+    embeddings do not hold accelerator memory). Every entry is also written
+    to ``<root>/<key>.pt`` and evicted least-recently-used first once the
+    directory exceeds max_bytes; as in the result cache, file atime is the
+    last-access time. Lives in the process that runs the text encoder.
+    """
+
+    def __init__(self, root: Path, max_entries: int, max_bytes: int):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.pt"
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return value
+
+        path = self._path(key)
+        try:
+            value = torch.load(path, map_location="cpu", weights_only=True)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Truncated or from an incompatible torch version: re-encode
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        os.utime(path, (time.time(), path.stat().st_mtime))
+        self._remember(key, value)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        value = value.detach().to("cpu")
+        self._remember(key, value)
+        self.root.mkdir(parents=True, exist_ok=True)
+        partial = self.root / f"{key}.pt.part"
+        torch.save(value, partial)
+        os.replace(partial, self._path(key))
+        self.evict()
+
+    def _remember(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        """Drop least-recently-used files until the directory fits max_bytes"""
+        entries = []
+        for path in self.root.glob("*.pt"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import base64
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+from .database import connect
+from .video_encoder import PREVIEW_SUFFIX, preview_path, poster_path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    name TEXT PRIMARY KEY,
+    job_id TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed INTEGER,
+    params TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    duration REAL,
+    generation_seconds REAL,
+    queue_seconds REAL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    preview TEXT,
+    poster TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_created ON videos (created_at DESC, name DESC);
+CREATE INDEX IF NOT EXISTS idx_videos_seed ON videos (seed);
+"""
+
+VIDEO_SUFFIXES = (".mp4", ".webm", ".webp")
+
+# Columns added after the initial schema; created on open for older databases
+MIGRATIONS = {
+    "preview": "TEXT",
+    "poster": "TEXT",
+}
+
+# video_{YYYYmmdd}_{HHMMSS}_{seed}[_n].ext, used to recover seeds of unindexed files
+OUTPUT_NAME_PATTERN = re.compile(r"^video_\d{8}_\d{6}_(\d+)(?:_\d+)?\.\w+$")
+
+
+def encode_cursor(created_at: float, name: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, name]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        created_at, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(created_at), str(name)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class VideoCatalog:
+    """SQLite index of generated videos and the parameters that produced them"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = connect(db_path, SCHEMA, {"videos": MIGRATIONS})
+
+    def _row_to_video(self, row: Optional[sqlite3.Row]) -> Optional[dict]:
+        if row is None:
+            return None
+        video = dict(row)
+        video["params"] = json.loads(video["params"]) if video["params"] else None
+        video["cached"] = bool(video["cached"])
+        return video
+
+    def add(
+        self,
+        path: Path,
+        job_id: Optional[str] = None,
+        prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        seed: Optional[int] = None,
+        params: Optional[dict] = None,
+        duration: Optional[float] = None,
+        generation_seconds: Optional[float] = None,
+        queue_seconds: Optional[float] = None,
+        cached: bool = False,
+        created_at: Optional[float] = None,
+    ):
+        """Index (or re-index) a finished output file and its renditions"""
+        stat = path.stat()
+        preview = preview_path(path)
+        poster = poster_path(path)
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO videos
+                   (name, job_id, prompt, negative_prompt, seed, params, size, duration,
+                    generation_seconds, queue_seconds, cached, preview, poster, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    path.name, job_id, prompt, negative_prompt, seed,
+                    json.dumps(params) if params is not None else None,
+                    stat.st_size, duration, generation_seconds, queue_seconds, int(cached),
+                    preview.name if preview.exists() else None,
+                    poster.name if poster.exists() else None,
+                    created_at if created_at is not None else stat.st_mtime,
+                ),
+            )
+
+    def remove(self, name: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM videos WHERE name = ?", (name,))
+
+    def get(self, name: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM videos WHERE name = ?", (name,)).fetchone()
+        return self._row_to_video(row)
+
+    def list(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        prompt: Optional[str] = None,
+        seed: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> tuple[list[dict], Optional[str]]:
+        """Newest-first page of videos and the cursor for the next page (None at the end)"""
+        clauses: list[str] = []
+        args: list = []
+        if cursor:
+            clauses.append("(created_at, name) < (?, ?)")
+            args.extend(decode_cursor(cursor))
+        if prompt:
+            escaped = prompt.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("prompt LIKE ? ESCAPE '\\'")
+            args.append(f"%{escaped}%")
+        if seed is not None:
+            clauses.append("seed = ?")
+            args.append(seed)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM videos {where} ORDER BY created_at DESC, name DESC LIMIT ?",
+                (*args, limit + 1),
+            ).fetchall()
+
+        videos = [self._row_to_video(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = videos[-1]
+            next_cursor = encode_cursor(last["created_at"], last["name"])
+        return videos, next_cursor
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def reconcile(self, output_dir: Path) -> tuple[int, int]:
+        """Index files added and drop rows for files removed outside the API
+
+        Returns (added, removed).
+        """
+        on_disk: dict[str, os.DirEntry] = {}
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if (
+                    entry.name.endswith(VIDEO_SUFFIXES)
+                    and not entry.name.endswith((PREVIEW_SUFFIX, ".part.mp4"))
+                    and entry.is_file()
+                ):
+                    on_disk[entry.name] = entry
+
+        with self._lock:
+            indexed = {row["name"] for row in self._conn.execute("SELECT name FROM videos")}
+
+        removed = indexed - on_disk.keys()
+        if removed:
+            with self._lock:
+                self._conn.executemany("DELETE FROM videos WHERE name = ?", [(name,) for name in removed])
+
+        added = on_disk.keys() - indexed
+        for name in added:
+            match = OUTPUT_NAME_PATTERN.match(name)
+            try:
+                self.add(Path(on_disk[name].path), seed=int(match.group(1)) if match else None)
+            except FileNotFoundError:
+                continue
+        return len(added), len(removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+video_catalog = VideoCatalog(settings.data_dir / "videos.db")
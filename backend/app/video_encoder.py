@@ -0,0 +1,222 @@
+import os
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+CODECS = {
+    "h264": ["-c:v", "libx264"],
+    # hvc1 tag so Safari/QuickTime recognise the stream
+    "h265": ["-c:v", "libx265", "-tag:v", "hvc1"],
+}
+
+PREVIEW_SUFFIX = ".preview.mp4"
+POSTER_SUFFIX = ".jpg"
+
+
+def preview_path(video: Path) -> Path:
+    return video.with_name(video.stem + PREVIEW_SUFFIX)
+
+
+def poster_path(video: Path) -> Path:
+    return video.with_name(video.stem + POSTER_SUFFIX)
+
+
+class EncodeError(RuntimeError):
+    """Raised when ffmpeg exits with an error"""
+
+
+class VideoEncoder:
+    """Transcode ComfyUI output into faststart MP4 with a local ffmpeg
+
+    Also produces an optional low-bitrate preview rendition and a poster
+    frame. Without ffmpeg (or with codec "copy") the ComfyUI file is kept
+    as-is under its real extension.
+    """
+
+    def __init__(
+        self,
+        codec: str = "h264",
+        crf: int = 20,
+        preset: str = "medium",
+        preview_height: int = 0,
+        preview_crf: int = 32,
+        poster: bool = True,
+        ffmpeg: str = "ffmpeg",
+    ):
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.preview_height = preview_height
+        self.preview_crf = preview_crf
+        self.poster = poster
+        self.ffmpeg = shutil.which(ffmpeg)
+        if codec != "copy" and self.ffmpeg is None:
+            logger.warning("ffmpeg not found; videos are kept in ComfyUI's output format")
+
+    @property
+    def enabled(self) -> bool:
+        return self.codec in CODECS and self.ffmpeg is not None
+
+    @property
+    def profile(self) -> dict:
+        """Settings that change the produced file (part of the result cache key)"""
+        if not self.enabled:
+            return {}
+        return {"codec": self.codec, "crf": self.crf, "preset": self.preset}
+
+    @property
+    def can_stitch(self) -> bool:
+        """Whether long videos can be assembled (needs ffmpeg, whatever the codec)"""
+        return self.ffmpeg is not None
+
+    def output_suffix(self, source_suffix: str) -> str:
+        return ".mp4" if self.enabled else source_suffix
+
+    async def _run(self, *args: str):
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y", *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise EncodeError(f"ffmpeg failed ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+
+    async def _encode_mp4(self, source: Path, dest: Path, crf: int, scale_height: Optional[int] = None):
+        # Write next to dest and rename, so a half-written file is never served
+        partial = dest.with_name(dest.name + ".part.mp4")
+        filters = ["format=yuv420p"]
+        if scale_height:
+            filters.insert(0, f"scale=-2:{scale_height}")
+        try:
+            await self._run(
+                "-i", str(source),
+                *CODECS[self.codec],
+                "-crf", str(crf),
+                "-preset", self.preset,
+                "-vf", ",".join(filters),
+                "-movflags", "+faststart",
+                "-an",
+                str(partial),
+            )
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        await asyncio.to_thread(os.replace, partial, dest)
+
+    def _part_args(self, fps: int) -> list[str]:
+        # Parts are joined without re-encoding, so all share codec and frame rate;
+        # with codec "copy" there is no single ComfyUI file to keep, so H.264 is used
+        return [
+            *CODECS.get(self.codec, CODECS["h264"]),
+            "-crf", str(self.crf),
+            "-preset", self.preset,
+            "-r", str(fps),
+            "-an",
+        ]
+
+    async def tail_frames(self, source: Path, start: int, dest: Path):
+        """Write the frames of source from index start on as an animated PNG
+
+        ComfyUI's LoadImage turns every frame of it into one image of a batch.
+        """
+        await self._run(
+            "-i", str(source),
+            "-vf", f"trim=start_frame={start},setpts=PTS-STARTPTS",
+            "-plays", "0",
+            "-f", "apng",
+            str(dest),
+        )
+
+    async def encode_part(self, source: Path, start: int, end: int, fps: int, dest: Path):
+        """Encode frames [start, end) of source as a part of a stitched video"""
+        await self._run(
+            "-i", str(source),
+            "-vf", f"trim=start_frame={start}:end_frame={end},setpts=PTS-STARTPTS,format=yuv420p",
+            *self._part_args(fps),
+            str(dest),
+        )
+
+    async def crossfade_part(self, first: Path, start: int, second: Path, frames: int, fps: int, dest: Path):
+        """Blend frames from start on of first into the first frames of second"""
+        await self._run(
+            "-i", str(first),
+            "-i", str(second),
+            "-filter_complex",
+            f"[0:v]trim=start_frame={start},setpts=PTS-STARTPTS,fps={fps},format=yuv420p[a];"
+            f"[1:v]trim=end_frame={frames},setpts=PTS-STARTPTS,fps={fps},format=yuv420p[b];"
+            f"[a][b]xfade=transition=fade:duration={frames / fps}:offset=0,format=yuv420p",
+            *self._part_args(fps),
+            str(dest),
+        )
+
+    async def join(self, parts: list[Path], dest: Path):
+        """Concatenate encoded parts into the final video at dest (no re-encoding)"""
+        listing = dest.with_name(dest.name + ".parts.txt")
+        partial = dest.with_name(dest.name + ".part.mp4")
+        await asyncio.to_thread(
+            listing.write_text, "".join(f"file '{part.resolve()}'\n" for part in parts)
+        )
+        try:
+            await self._run(
+                "-f", "concat", "-safe", "0", "-i", str(listing),
+                "-c", "copy", "-movflags", "+faststart",
+                str(partial),
+            )
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        finally:
+            listing.unlink(missing_ok=True)
+        await asyncio.to_thread(os.replace, partial, dest)
+        await self.renditions(dest)
+
+    async def encode(self, source: Path, dest: Path) -> Path:
+        """Turn a downloaded ComfyUI output into the final video at dest
+
+        Returns the path actually written: dest (MP4), or dest with the
+        source's extension when encoding is disabled. The source is consumed.
+        """
+        if not self.enabled:
+            final = dest.with_suffix(source.suffix)
+            await asyncio.to_thread(os.replace, source, final)
+            return final
+
+        try:
+            await self._encode_mp4(source, dest, self.crf)
+        finally:
+            await asyncio.to_thread(source.unlink, missing_ok=True)
+        await self.renditions(dest)
+        return dest
+
+    async def renditions(self, video: Path):
+        """Create the preview rendition and poster frame for a final video"""
+        if not self.enabled:
+            return
+        try:
+            if self.preview_height:
+                await self._encode_mp4(video, preview_path(video), self.preview_crf, self.preview_height)
+            if self.poster:
+                await self._run("-i", str(video), "-frames:v", "1", "-q:v", "3", str(poster_path(video)))
+        except EncodeError as e:
+            # Renditions are a convenience; the main video is already in place
+            logger.warning("Failed to create renditions for %s: %s", video.name, e)
+
+
+video_encoder = VideoEncoder(
+    codec=settings.video_codec,
+    crf=settings.video_crf,
+    preset=settings.video_preset,
+    preview_height=settings.preview_height,
+    preview_crf=settings.preview_crf,
+    poster=settings.poster_enabled,
+    ffmpeg=settings.ffmpeg_path,
+)
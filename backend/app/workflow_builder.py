@@ -1,55 +1,455 @@
+import re
 import json
 import random
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional, Union
 
-from .models import VideoGenerationRequest, AspectRatio
+from .config import settings
+from .models import VideoGenerationRequest, VideoBatchRequest, LongVideoRequest, AspectRatio, Quality
+from .resolution import plan_resolution
+from .speed import SpeedProfile, speed_profile, high_noise_end_step
+
+
+WORKFLOWS_DIR = Path(__file__).parent / "workflows"
+DEFAULT_TEMPLATE = "wan22_t2v"
+
+# Template inputs whose whole value is "{{NAME}}" are filled in at build time
+PLACEHOLDER_PATTERN = re.compile(r"^\{\{(\w+)\}\}$")
+
+
+def copy_graph(value: Any) -> Any:
+    """Deep-copy a JSON-shaped value (much cheaper than copy.deepcopy)"""
+    if isinstance(value, dict):
+        return {key: copy_graph(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_graph(item) for item in value]
+    return value
+
+
+def is_link(value: Any) -> bool:
+    """Whether an input value is a ["node_id", output_index] connection"""
+    return (
+        isinstance(value, list) and len(value) == 2
+        and isinstance(value[0], str) and isinstance(value[1], int)
+    )
+
+
+def topological_order(workflow: dict) -> list[str]:
+    """Node ids ordered so every node comes after the nodes it links to"""
+    order: list[str] = []
+    visited: set[str] = set()
+
+    def visit(node_id: str):
+        if node_id in visited:
+            return
+        visited.add(node_id)
+        for value in workflow[node_id].get("inputs", {}).values():
+            if is_link(value):
+                visit(value[0])
+        order.append(node_id)
+
+    for node_id in workflow:
+        visit(node_id)
+    return order
+
+
+def output_nodes(workflow: dict) -> list[str]:
+    """Sink nodes (not consumed by any other node), i.e. the graph outputs"""
+    consumed = {
+        value[0]
+        for node in workflow.values()
+        for value in node.get("inputs", {}).values()
+        if is_link(value)
+    }
+    return [node_id for node_id in workflow if node_id not in consumed]
+
+
+def merge_workflows(workflows: list[dict]) -> tuple[dict, list[dict[str, str]]]:
+    """Combine graphs into one, sharing structurally identical nodes
+
+    Nodes with the same class and the same (resolved) inputs are emitted once,
+    so model loaders and repeated text encodes run a single time for the whole
+    batch. The first graph keeps its node ids; later nodes get fresh ones.
+    Returns the merged graph and, per input graph, a map of old to new ids.
+    """
+    merged: dict = {}
+    by_signature: dict[str, str] = {}
+    mappings: list[dict[str, str]] = []
+    next_id = 1 + max((int(i) for wf in workflows[:1] for i in wf if i.isdigit()), default=0)
+
+    for index, workflow in enumerate(workflows):
+        mapping: dict[str, str] = {}
+        for node_id in topological_order(workflow):
+            node = workflow[node_id]
+            inputs = {
+                name: [mapping[value[0]], value[1]] if is_link(value) else value
+                for name, value in node.get("inputs", {}).items()
+            }
+            signature = json.dumps([node["class_type"], inputs], sort_keys=True)
+            if signature in by_signature:
+                mapping[node_id] = by_signature[signature]
+                continue
+
+            if index == 0:
+                new_id = node_id
+            else:
+                new_id = str(next_id)
+                next_id += 1
+            merged[new_id] = {**node, "inputs": inputs}
+            by_signature[signature] = new_id
+            mapping[node_id] = new_id
+        mappings.append(mapping)
+
+    return merged, mappings
+
+
+def draft_num_frames(num_frames: int) -> int:
+    """Frame count of a draft render (WAN needs 4k+1 frames)"""
+    return min(num_frames, (settings.draft_num_frames - 1) // 4 * 4 + 1)
+
+
+def frames_4k1(frames: int) -> int:
+    """Smallest WAN-compatible frame count (4k+1) of at least frames"""
+    return (frames + 2) // 4 * 4 + 1
+
+
+def segment_plan(total_frames: int) -> list[int]:
+    """Frame counts of the segments a long video is rendered in
+
+    Every segment after the first repeats the last segment_overlap_frames
+    frames of its predecessor. Segments have segment_frames frames except
+    the last, which is only as long as needed; what it renders past
+    total_frames is trimmed when stitching.
+    """
+    size, overlap = settings.segment_frames, settings.segment_overlap_frames
+    if overlap >= size:
+        raise ValueError("SEGMENT_OVERLAP_FRAMES must be smaller than SEGMENT_FRAMES")
+    plan = [min(size, frames_4k1(total_frames))]
+    covered = plan[0]
+    while covered < total_frames:
+        frames = min(size, frames_4k1(total_frames - covered + overlap))
+        plan.append(frames)
+        covered += frames - overlap
+    return plan
+
+
+def rendered_frames(request: dict) -> int:
+    """Frames a stored request actually renders (drafts are shortened)"""
+    if "duration" in request:
+        return LongVideoRequest(**request).total_frames
+    if request.get("quality") == Quality.DRAFT.value:
+        return draft_num_frames(request["num_frames"])
+    return request["num_frames"]
+
+
+class WorkflowTemplate:
+    """A ComfyUI API-format graph parsed once, with its placeholder locations"""
+
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        self.graph: dict = {}
+        self.placeholders: list[tuple[str, str, str]] = []
+        self.mtime = 0.0
+        self.load()
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            self.graph = json.load(f)
+        self.mtime = self.path.stat().st_mtime
+        self.placeholders = [
+            (node_id, input_name, match.group(1))
+            for node_id, node in self.graph.items()
+            for input_name, value in node.get("inputs", {}).items()
+            if isinstance(value, str) and (match := PLACEHOLDER_PATTERN.match(value))
+        ]
+
+    def reload_if_changed(self):
+        if self.path.stat().st_mtime != self.mtime:
+            self.load()
+
+    @property
+    def names(self) -> set[str]:
+        return {name for _, _, name in self.placeholders}
+
+    def render(self, values: dict[str, Any]) -> dict:
+        """Copy the graph and assign placeholder values (no text substitution)"""
+        missing = self.names - values.keys()
+        if missing:
+            raise KeyError(f"Missing values for template {self.name}: {sorted(missing)}")
+        workflow = copy_graph(self.graph)
+        for node_id, input_name, name in self.placeholders:
+            workflow[node_id]["inputs"][input_name] = values[name]
+        return workflow
 
 
 class WorkflowBuilder:
     """Build ComfyUI workflow from template"""
 
-    def __init__(self):
-        self.template_path = Path(__file__).parent / "workflows" / "wan22_t2v.json"
+    def __init__(self, workflows_dir: Path = WORKFLOWS_DIR):
+        self.templates: dict[str, WorkflowTemplate] = {}
+        for path in sorted(workflows_dir.glob("*.json")):
+            self.register(path.stem, path)
+
+    def register(self, name: str, path: Path) -> WorkflowTemplate:
+        """Parse a template file and make it available under name"""
+        template = WorkflowTemplate(name, path)
+        self.templates[name] = template
+        return template
 
-    def get_resolution(self, aspect_ratio: AspectRatio) -> tuple[int, int]:
-        """Get resolution based on aspect ratio (optimized for 24GB unified memory)
+    def get_template(self, name: str = DEFAULT_TEMPLATE) -> WorkflowTemplate:
+        try:
+            template = self.templates[name]
+        except KeyError:
+            raise KeyError(f"Unknown workflow template: {name}")
+        if settings.workflow_reload:
+            template.reload_if_changed()
+        return template
 
-        Note: Using smaller resolution to avoid MPS memory issues during VAE decode.
-        Higher resolutions cause OOM on 24GB M4 Pro during VAE decode stage.
+    def get_resolution(self, aspect_ratio: AspectRatio, num_frames: int = 81) -> tuple[int, int]:
+        """Largest resolution for the aspect ratio that fits the memory budget
+
+        Note: VAE decode is the peak; the budget is calibrated so 81 frames on
+        24GB unified memory stay at the 496x496 pixel count that decodes safely.
         """
-        # Using 496x496 (must be divisible by 16 for VAE)
-        return (496, 496)  # 1:1 ratio for memory efficiency
+        plan = plan_resolution(aspect_ratio, num_frames)
+        return plan.width, plan.height
 
-    def build_workflow(self, request: VideoGenerationRequest) -> dict:
-        """Build workflow dict from request parameters"""
-        with open(self.template_path, 'r') as f:
-            template = f.read()
+    def use_tiled_decode(self, workflow: dict):
+        """Swap VAEDecode nodes for VAEDecodeTiled (spatial tiles x frame windows)"""
+        for node in workflow.values():
+            if node["class_type"] != "VAEDecode":
+                continue
+            node["class_type"] = "VAEDecodeTiled"
+            node["inputs"] = {
+                **node["inputs"],
+                "tile_size": settings.vae_tile_size,
+                "overlap": settings.vae_tile_overlap,
+                "temporal_size": settings.vae_temporal_size,
+                "temporal_overlap": settings.vae_temporal_overlap,
+            }
 
+    def add_upscale(self, workflow: dict, width: int, height: int):
+        """Insert an ImageScale pass between the decoded frames and every save node"""
+        next_id = 1 + max(int(node_id) for node_id in workflow if node_id.isdigit())
+        for node_id in output_nodes(workflow):
+            inputs = workflow[node_id]["inputs"]
+            if not is_link(inputs.get("images")):
+                continue
+            upscale_id = str(next_id)
+            next_id += 1
+            workflow[upscale_id] = {
+                "class_type": "ImageScale",
+                "inputs": {
+                    "image": inputs["images"],
+                    "upscale_method": "lanczos",
+                    "width": width,
+                    "height": height,
+                    "crop": "disabled",
+                },
+                "_meta": {"title": "Upscale"},
+            }
+            inputs["images"] = [upscale_id, 0]
+
+    def add_step_cache(self, workflow: dict, profile: SpeedProfile):
+        """Route each sampler's model through an EasyCache node (ComfyUI core)
+
+        Samplers that start at step 0 use the high-noise threshold, later
+        stages the low-noise one; a threshold of 0 leaves the sampler alone.
+        """
+        next_id = 1 + max(int(node_id) for node_id in workflow if node_id.isdigit())
+        for node in list(workflow.values()):
+            inputs = node.get("inputs", {})
+            if not node["class_type"].startswith("KSampler") or not is_link(inputs.get("model")):
+                continue
+            low_noise = inputs.get("start_at_step", 0) > 0
+            threshold = profile.low_noise_cache if low_noise else profile.high_noise_cache
+            if threshold <= 0:
+                continue
+            cache_id = str(next_id)
+            next_id += 1
+            workflow[cache_id] = {
+                "class_type": "EasyCache",
+                "inputs": {
+                    "model": inputs["model"],
+                    "reuse_threshold": threshold,
+                    "start_percent": profile.cache_start,
+                    "end_percent": profile.cache_end,
+                    "verbose": False,
+                },
+                "_meta": {"title": "Step Cache"},
+            }
+            inputs["model"] = [cache_id, 0]
+
+    def draft_settings(self, width: int, height: int, num_frames: int, steps: int) -> tuple[int, int, int, int]:
+        """Scale a full render down to a draft: smaller latent, shorter clip, fewer steps"""
+        scale = settings.draft_scale
+        width = max(16, int(width * scale) // 16 * 16)
+        height = max(16, int(height * scale) // 16 * 16)
+        num_frames = draft_num_frames(num_frames)
+        steps = min(steps, settings.draft_steps)
+        return width, height, num_frames, steps
+
+    def estimate_work(self, request: Union[VideoGenerationRequest, LongVideoRequest]) -> float:
+        """Relative GPU cost of a request: steps x frames x pixels as rendered"""
+        if isinstance(request, LongVideoRequest):
+            width, height = self.get_resolution(request.aspect_ratio, settings.segment_frames)
+            frames = sum(segment_plan(request.total_frames))
+            return float(request.num_inference_steps * frames * width * height)
+        width, height = self.get_resolution(request.aspect_ratio, request.num_frames)
+        num_frames = request.num_frames
+        steps = request.num_inference_steps
+        if request.quality == Quality.DRAFT:
+            width, height, num_frames, steps = self.draft_settings(width, height, num_frames, steps)
+        return float(steps * num_frames * width * height)
+
+    def build_workflow(self, request: VideoGenerationRequest, template: Optional[str] = None) -> tuple[dict, int]:
+        """Build workflow dict from request parameters"""
         # Get resolution
-        width, height = self.get_resolution(request.aspect_ratio)
+        plan = plan_resolution(request.aspect_ratio, request.num_frames)
+        width, height, upscale = plan
+        num_frames = request.num_frames
+        steps = request.num_inference_steps
+        if request.quality == Quality.DRAFT:
+            width, height, num_frames, steps = self.draft_settings(width, height, num_frames, steps)
+            upscale = None
 
         # Generate seed if not provided
         seed = request.seed if request.seed is not None else random.randint(0, 2**32 - 1)
 
-        # Calculate high-noise end step (first 50% of steps use high-noise model)
-        high_noise_end_step = request.num_inference_steps // 2
-
-        # Replace placeholders
-        workflow_str = template
-        workflow_str = workflow_str.replace("{{PROMPT}}", request.prompt.replace('"', '\\"'))
-        workflow_str = workflow_str.replace("{{NEGATIVE_PROMPT}}", request.negative_prompt.replace('"', '\\"'))
-        workflow_str = workflow_str.replace('"{{WIDTH}}"', str(width))
-        workflow_str = workflow_str.replace('"{{HEIGHT}}"', str(height))
-        workflow_str = workflow_str.replace('"{{NUM_FRAMES}}"', str(request.num_frames))
-        workflow_str = workflow_str.replace('"{{SEED}}"', str(seed))
-        workflow_str = workflow_str.replace('"{{STEPS}}"', str(request.num_inference_steps))
-        workflow_str = workflow_str.replace('"{{GUIDANCE_SCALE}}"', str(request.guidance_scale))
-        workflow_str = workflow_str.replace('"{{FPS}}"', str(float(request.fps)))
-        workflow_str = workflow_str.replace('"{{HIGH_NOISE_END_STEP}}"', str(high_noise_end_step))
-
-        workflow = json.loads(workflow_str)
-        return workflow, seed
+        # The speed preset sets how many steps the high-noise model takes (half by default)
+        profile = speed_profile(request.speed)
+
+        workflow = self.get_template(template or DEFAULT_TEMPLATE).render({
+            "PROMPT": request.prompt,
+            "NEGATIVE_PROMPT": request.negative_prompt,
+            "WIDTH": width,
+            "HEIGHT": height,
+            "NUM_FRAMES": num_frames,
+            "SEED": seed,
+            "STEPS": steps,
+            "GUIDANCE_SCALE": request.guidance_scale,
+            "FPS": float(request.fps),
+            "HIGH_NOISE_END_STEP": high_noise_end_step(steps, profile.high_noise_split),
+        })
+        return self._finish(workflow, upscale, profile), seed
+
+    def _finish(self, workflow: dict, upscale: Optional[tuple[int, int]], profile: SpeedProfile) -> dict:
+        """Apply the speed preset, the configured decode mode and the upscale pass to a rendered graph"""
+        self.add_step_cache(workflow, profile)
+        if settings.vae_decode == "tiled":
+            self.use_tiled_decode(workflow)
+        if upscale:
+            self.add_upscale(workflow, *upscale)
+        return workflow
+
+    def build_segment(
+        self, request: LongVideoRequest, seed: int, index: int, num_frames: int, start_image: Optional[str] = None
+    ) -> dict:
+        """Build the graph of one segment of a long video
+
+        The first segment is a text-to-video render; later ones use the
+        long-video template, which conditions on start_image (an uploaded
+        image holding the previous segment's last frames). Every segment is
+        planned at segment_frames, so all share one resolution.
+        """
+        width, height, upscale = plan_resolution(request.aspect_ratio, settings.segment_frames)
+        steps = request.num_inference_steps
+        profile = speed_profile(request.speed)
+        values = {
+            "PROMPT": request.prompt,
+            "NEGATIVE_PROMPT": request.negative_prompt,
+            "WIDTH": width,
+            "HEIGHT": height,
+            "NUM_FRAMES": num_frames,
+            "SEED": (seed + index) % 2**32,
+            "STEPS": steps,
+            "GUIDANCE_SCALE": request.guidance_scale,
+            "FPS": float(request.fps),
+            "HIGH_NOISE_END_STEP": high_noise_end_step(steps, profile.high_noise_split),
+        }
+        if index == 0:
+            template = DEFAULT_TEMPLATE
+        else:
+            template = settings.long_video_template
+            values["START_IMAGE"] = start_image
+        return self._finish(self.get_template(template).render(values), upscale, profile)
+
+    def build_long(self, request: LongVideoRequest) -> tuple[dict, int]:
+        """Graph of the first segment of a long video, and its seed"""
+        seed = request.seed if request.seed is not None else random.randint(0, 2**32 - 1)
+        plan = segment_plan(request.total_frames)
+        return self.build_segment(request, seed, 0, plan[0]), seed
+
+    def long_video_signature(self, request: LongVideoRequest, workflow: dict, seed: int) -> dict:
+        """Everything that determines a long video's frames (hashed for its cache key)"""
+        plan = segment_plan(request.total_frames)
+        return {
+            "segments": plan,
+            "overlap": settings.segment_overlap_frames,
+            "total_frames": request.total_frames,
+            "first": workflow,
+            "next": self.build_segment(request, seed, 1, plan[1], "") if len(plan) > 1 else None,
+        }
+
+    def build_warmup(self, template: Optional[str] = None) -> dict:
+        """Smallest graph that loads every model of the template
+
+        Runs one step on each sampler with a 16x16 single-frame latent and
+        previews the result instead of saving it, so nothing lands in
+        ComfyUI's output directory.
+        """
+        workflow = self.get_template(template or DEFAULT_TEMPLATE).render({
+            "PROMPT": "",
+            "NEGATIVE_PROMPT": "",
+            "WIDTH": 16,
+            "HEIGHT": 16,
+            "NUM_FRAMES": 1,
+            "SEED": 0,
+            "STEPS": 2,
+            "GUIDANCE_SCALE": 1.0,
+            "FPS": 1.0,
+            "HIGH_NOISE_END_STEP": 1,
+        })
+        for node_id in output_nodes(workflow):
+            images = workflow[node_id].get("inputs", {}).get("images")
+            if is_link(images):
+                workflow[node_id] = {"class_type": "PreviewImage", "inputs": {"images": images}}
+        return workflow
+
+    def build_spec(self, request: VideoGenerationRequest) -> tuple[dict, int]:
+        """Build the pipeline arguments for the in-process diffusers engine"""
+        width, height = self.get_resolution(request.aspect_ratio, request.num_frames)
+        num_frames = request.num_frames
+        steps = request.num_inference_steps
+        if request.quality == Quality.DRAFT:
+            width, height, num_frames, steps = self.draft_settings(width, height, num_frames, steps)
+
+        seed = request.seed if request.seed is not None else random.randint(0, 2**32 - 1)
+        spec = {
+            "model_id": settings.model_id,
+            "prompt": request.prompt,
+            "negative_prompt": request.negative_prompt,
+            "width": width,
+            "height": height,
+            "num_frames": num_frames,
+            "num_inference_steps": steps,
+            "guidance_scale": request.guidance_scale,
+            "fps": request.fps,
+            "seed": seed,
+        }
+        cache = speed_profile(request.speed).pipeline_cache
+        if cache > 0:
+            spec["step_cache"] = cache
+        return spec, seed
+
+    def build_batch(self, batch: VideoBatchRequest) -> list[tuple[VideoGenerationRequest, dict, int]]:
+        """Build one standalone workflow per batch item (merged at dispatch)"""
+        items = []
+        for request in batch.item_requests():
+            workflow, seed = self.build_workflow(request)
+            items.append((request, workflow, seed))
+        return items
 
 
 workflow_builder = WorkflowBuilder()
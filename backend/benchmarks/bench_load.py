@@ -0,0 +1,334 @@
+"""Load benchmark: the FastAPI backend driven end to end against stub ComfyUI servers
+
+Starts --backends stub ComfyUI processes (benchmarks.stub_comfyui) and the
+backend (benchmarks.serve) with a throwaway data and output directory,
+then has --clients concurrent clients each submit --jobs generations and
+follow them over /api/jobs/{id}/events. Reports submit latency,
+end-to-end latency percentiles, throughput, the backend's own overhead
+(job run time minus simulated ComfyUI execution), event-loop lag and
+memory. Runs offline; --max-* thresholds make it fail for CI.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_load [--clients 8] [--jobs 4] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+TERMINAL_STATES = ("completed", "error", "cancelled")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(values: list[float], scale: float = 1000.0) -> dict:
+    """p50/p95/p99/max in milliseconds (seconds scaled by 1000)"""
+    result = {f"p{pct}": percentile(values, pct) for pct in (50, 95, 99)}
+    result["max"] = max(values) if values else None
+    return {key: round(value * scale, 2) if value is not None else None for key, value in result.items()}
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with code {process.returncode}")
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.submit: list[float] = []
+        self.end_to_end: list[float] = []
+        self.run_seconds: list[float] = []
+        self.stage_seconds: dict[str, list[float]] = {}
+        self.outcomes: dict[str, int] = {}
+        self.rejected = 0
+
+    def request(self, client: int, index: int) -> dict:
+        return {
+            # Distinct prompts so neither cache short-circuits the run
+            "prompt": f"benchmark client {client} job {index}: a lighthouse in a storm, cinematic",
+            "seed": client * 100000 + index,
+            "num_inference_steps": self.args.steps,
+            "num_frames": self.args.frames,
+            "quality": self.args.quality,
+        }
+
+    async def client(self, session: aiohttp.ClientSession, client: int):
+        headers = {"X-API-Key": f"bench-{client}"}
+        for index in range(self.args.jobs):
+            started = time.perf_counter()
+            async with session.post(
+                f"{self.base_url}/api/generate", json=self.request(client, index), headers=headers
+            ) as resp:
+                body = await resp.json()
+            self.submit.append(time.perf_counter() - started)
+            if resp.status != 200:
+                self.rejected += 1
+                continue
+
+            status = await self.follow(session, body["job_id"])
+            self.end_to_end.append(time.perf_counter() - started)
+            self.outcomes[status] = self.outcomes.get(status, 0) + 1
+            await self.record_job(session, body["job_id"])
+
+    async def follow(self, session: aiohttp.ClientSession, job_id: str) -> str:
+        """Read the job's event stream until it reaches a terminal state"""
+        async with session.get(f"{self.base_url}/api/jobs/{job_id}/events") as resp:
+            async for line in resp.content:
+                if not line.startswith(b"data: "):
+                    continue
+                status = json.loads(line[6:]).get("status")
+                if status in TERMINAL_STATES:
+                    return status
+        raise RuntimeError(f"Event stream for {job_id} ended early")
+
+    async def record_job(self, session: aiohttp.ClientSession, job_id: str):
+        async with session.get(f"{self.base_url}/api/jobs/{job_id}") as resp:
+            job = await resp.json()
+        if job["started_at"] is not None and job["finished_at"] is not None:
+            self.run_seconds.append(job["finished_at"] - job["started_at"])
+        for stage, seconds in (job.get("timings") or {}).items():
+            self.stage_seconds.setdefault(stage, []).append(seconds)
+
+
+def probe_window(stats_path: Path, started: float, finished: float) -> dict:
+    """Event-loop lag and memory of the backend during the load window"""
+    try:
+        stats = json.loads(stats_path.read_text())
+    except (OSError, ValueError):
+        return {}
+    lag = [value for at, value in stats["lag"] if started <= at <= finished]
+    rss = [value for at, value in stats["rss"] if started <= at <= finished]
+    return {
+        "event_loop_lag_ms": summarize(lag),
+        "rss_mb": {
+            "start": round(rss[0] / 1024**2, 1) if rss else None,
+            "end": round(rss[-1] / 1024**2, 1) if rss else None,
+            "max": round(max(rss) / 1024**2, 1) if rss else None,
+        },
+        "peak_rss_mb": round(stats["peak_rss"] / 1024**2, 1),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="bench-load-"))
+    try:
+        return await run_in(workdir, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def run_in(workdir: Path, args: argparse.Namespace) -> dict:
+    stub_ports = [free_port() for _ in range(args.backends)]
+    port = free_port()
+    stats_path = workdir / "probe.json"
+
+    stub_args = [
+        "--step-seconds", str(args.step_seconds), "--load-seconds", str(args.load_seconds),
+        "--decode-seconds", str(args.decode_seconds), "--node-seconds", str(args.node_seconds),
+        "--output-bytes", str(args.output_bytes),
+    ]
+    if args.video:
+        stub_args += ["--video", str(args.video)]
+
+    env = {
+        **os.environ,
+        "COMFYUI_BACKENDS": json.dumps([f"127.0.0.1:{stub_port}" for stub_port in stub_ports]),
+        "MAX_JOBS_PER_BACKEND": str(args.slots),
+        "DATA_DIR": str(workdir / "data"),
+        "OUTPUT_DIR": str(workdir / "outputs"),
+        "MAX_QUEUE_SIZE": "100000",
+        "MAX_QUEUED_GPU_SECONDS": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+        "RESULT_CACHE_ENABLED": "false",
+        "WARMUP_ON_START": "false",
+        "VIDEO_CODEC": "h264" if args.video else "copy",
+    }
+    for override in args.env:
+        key, _, value = override.partition("=")
+        env[key] = value
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.stub_comfyui", "--port", str(stub_port), *stub_args],
+            cwd=BACKEND_DIR,
+        )
+        for stub_port in stub_ports
+    ]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve", "--port", str(port), "--stats", str(stats_path)],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for stub_port, process in zip(stub_ports, processes):
+                await wait_ready(session, f"http://127.0.0.1:{stub_port}/system_stats", process)
+            await wait_ready(session, f"{base_url}/api/health", server)
+
+            load = LoadRun(args, base_url)
+            started = time.time()
+            await asyncio.gather(*(load.client(session, client) for client in range(args.clients)))
+            finished = time.time()
+
+            executed, execution_seconds = 0, 0.0
+            for stub_port in stub_ports:
+                async with session.get(f"http://127.0.0.1:{stub_port}/stub/stats") as resp:
+                    stub_stats = await resp.json()
+                executed += stub_stats["executed"]
+                execution_seconds += stub_stats["execution_seconds"]
+    finally:
+        stop(server)
+        for process in processes:
+            stop(process)
+
+    elapsed = finished - started
+    completed = load.outcomes.get("completed", 0)
+    mean_run = sum(load.run_seconds) / len(load.run_seconds) if load.run_seconds else None
+    mean_execution = execution_seconds / executed if executed else None
+    return {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("json", "video") and not key.startswith("max_")
+        },
+        "jobs": len(load.submit),
+        "outcomes": load.outcomes,
+        "rejected": load.rejected,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_jobs_per_minute": round(completed / elapsed * 60, 2) if elapsed > 0 else None,
+        "submit_ms": summarize(load.submit),
+        "end_to_end_ms": summarize(load.end_to_end),
+        "stages_p50_ms": {stage: summarize(values)["p50"] for stage, values in sorted(load.stage_seconds.items())},
+        # Time a job held a backend beyond what ComfyUI spent executing it
+        "overhead_ms_per_job": (
+            round((mean_run - mean_execution) * 1000, 2)
+            if mean_run is not None and mean_execution is not None and args.slots == 1 else None
+        ),
+        **probe_window(stats_path, started, finished),
+    }
+
+
+def print_report(result: dict):
+    def row(label: str, stats: dict):
+        print(f"  {label:<18}" + "  ".join(f"{key} {value:>9.2f}" for key, value in stats.items() if value is not None))
+
+    print(f"jobs: {result['jobs']}  outcomes: {result['outcomes']}  rejected: {result['rejected']}")
+    print(f"elapsed: {result['elapsed_seconds']:.2f}s  throughput: {result['throughput_jobs_per_minute']} jobs/min")
+    print("latency (ms):")
+    row("submit", result["submit_ms"])
+    row("end to end", result["end_to_end_ms"])
+    if result.get("event_loop_lag_ms"):
+        row("event loop lag", result["event_loop_lag_ms"])
+    if result["overhead_ms_per_job"] is not None:
+        print(f"backend overhead per job: {result['overhead_ms_per_job']:.2f} ms")
+    print("stage p50 (ms): " + ", ".join(f"{stage} {value:.1f}" for stage, value in result["stages_p50_ms"].items()))
+    if result.get("rss_mb"):
+        rss = result["rss_mb"]
+        print(f"backend RSS (MB): start {rss['start']}  end {rss['end']}  max {rss['max']}  peak {result['peak_rss_mb']}")
+
+
+def check(result: dict, args: argparse.Namespace) -> list[str]:
+    """Threshold violations (for CI)"""
+    failures = []
+    limits = [
+        ("submit p95", args.max_submit_p95, result["submit_ms"]["p95"]),
+        ("end-to-end p95", args.max_end_to_end_p95, result["end_to_end_ms"]["p95"]),
+        ("event-loop lag p99", args.max_lag_p99, (result.get("event_loop_lag_ms") or {}).get("p99")),
+    ]
+    for label, limit, value in limits:
+        if limit is not None and (value is None or value > limit):
+            failures.append(f"{label} {value} ms exceeds {limit} ms")
+    failed = result["jobs"] - result["rejected"] - result["outcomes"].get("completed", 0)
+    if failed:
+        failures.append(f"{failed} job(s) did not complete")
+    if result["rejected"]:
+        failures.append(f"{result['rejected']} submission(s) rejected")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    load = parser.add_argument_group("load")
+    load.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    load.add_argument("--jobs", type=int, default=5, help="jobs submitted by each client, one after another")
+    load.add_argument("--steps", type=int, default=10, help="num_inference_steps of each request")
+    load.add_argument("--frames", type=int, default=33, help="num_frames of each request")
+    load.add_argument("--quality", choices=["full", "draft"], default="full")
+    stub = parser.add_argument_group("stub ComfyUI")
+    stub.add_argument("--backends", type=int, default=1, help="stub ComfyUI servers")
+    stub.add_argument("--slots", type=int, default=1, help="MAX_JOBS_PER_BACKEND")
+    stub.add_argument("--step-seconds", type=float, default=0.02)
+    stub.add_argument("--load-seconds", type=float, default=0.5)
+    stub.add_argument("--decode-seconds", type=float, default=0.05)
+    stub.add_argument("--node-seconds", type=float, default=0.005)
+    stub.add_argument("--output-bytes", type=int, default=2 * 1024**2)
+    stub.add_argument("--video", type=Path, help="real video served as output (enables H.264 encoding)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra backend setting")
+    parser.add_argument("--json", type=Path, help="write results as JSON")
+    limits = parser.add_argument_group("limits (exit 1 when exceeded)")
+    limits.add_argument("--max-submit-p95", type=float, metavar="MS")
+    limits.add_argument("--max-end-to-end-p95", type=float, metavar="MS")
+    limits.add_argument("--max-lag-p99", type=float, metavar="MS")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+
+    failures = check(result, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
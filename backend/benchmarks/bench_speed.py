@@ -0,0 +1,195 @@
+"""Speed presets: sampling time against similarity to the quality preset
+
+Renders the same prompts and seeds once per speed preset on a running
+backend (ComfyUI or diffusers engine) and reports each preset's sampling
+time, its speed-up over "quality", and how close its frames stay to the
+quality render (PSNR and SSIM over all frames, computed with ffmpeg).
+Jobs run one at a time so their timings do not overlap.
+
+Seeds are random per run unless --seed is given; a repeated seed is
+served from the result cache and measures nothing.
+
+Run from the backend directory while the backend is up:
+
+    python -m benchmarks.bench_speed [--url http://localhost:8000] [--prompts 2] [--json results.json]
+"""
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+
+PRESETS = ["quality", "balanced", "fast"]
+PROMPTS = [
+    "a lighthouse on a cliff in a storm, waves crashing, cinematic lighting",
+    "a golden retriever running through a meadow of wildflowers, slow motion",
+    "neon-lit city street at night in the rain, people with umbrellas walking by",
+    "a hummingbird hovering at a red flower, macro shot, shallow depth of field",
+]
+# Stages that make up sampling in each engine's timings
+SAMPLING_STAGES = ("high_noise_sampling", "low_noise_sampling", "sampling")
+TERMINAL_STATES = ("completed", "error", "cancelled")
+
+
+async def follow(session: aiohttp.ClientSession, url: str, job_id: str) -> str:
+    """Read the job's event stream until it reaches a terminal state"""
+    async with session.get(f"{url}/api/jobs/{job_id}/events") as resp:
+        async for line in resp.content:
+            if not line.startswith(b"data: "):
+                continue
+            status = json.loads(line[6:]).get("status")
+            if status in TERMINAL_STATES:
+                return status
+    raise RuntimeError(f"Event stream for {job_id} ended early")
+
+
+async def render(session: aiohttp.ClientSession, args: argparse.Namespace, request: dict, dest: Path) -> dict:
+    """Submit one generation, wait for it and download the result to dest"""
+    async with session.post(f"{args.url}/api/generate", json=request) as resp:
+        body = await resp.json()
+        if resp.status != 200:
+            raise RuntimeError(f"Submission rejected ({resp.status}): {body.get('detail')}")
+    if body["message"] == "Served from cache":
+        print(f"  warning: {request['speed']} seed {request['seed']} came from the result cache", file=sys.stderr)
+
+    status = await follow(session, args.url, body["job_id"])
+    async with session.get(f"{args.url}/api/jobs/{body['job_id']}") as resp:
+        job = await resp.json()
+    if status != "completed":
+        raise RuntimeError(f"Job {body['job_id']} {status}: {job.get('error')}")
+
+    async with session.get(f"{args.url}{job['video_url']}") as resp:
+        resp.raise_for_status()
+        dest.write_bytes(await resp.read())
+    timings = job["timings"] or {}
+    return {
+        "sampling": sum(timings.get(stage, 0.0) for stage in SAMPLING_STAGES),
+        "total": job["finished_at"] - job["started_at"],
+    }
+
+
+async def similarity(ffmpeg: str, reference: Path, video: Path) -> tuple[float, float]:
+    """(PSNR in dB, SSIM) of video against reference, averaged over all frames"""
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, "-hide_banner", "-i", str(video), "-i", str(reference),
+        "-filter_complex", "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]psnr;[a1][b1]ssim",
+        "-f", "null", "-",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    output = stderr.decode(errors="replace")
+    psnr = re.search(r"PSNR .*average:(\S+)", output)
+    ssim = re.search(r"SSIM .*All:(\S+)", output)
+    if process.returncode != 0 or psnr is None or ssim is None:
+        raise RuntimeError(f"ffmpeg could not compare {video.name}: {output.strip()[-500:]}")
+    return float(psnr.group(1)), float(ssim.group(1))
+
+
+def mean(values: list[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+async def run(args: argparse.Namespace, workdir: Path) -> dict:
+    base_seed = args.seed if args.seed is not None else random.randint(0, 2**31)
+    results: dict[str, dict[str, list[float]]] = {
+        preset: {"sampling": [], "total": [], "psnr": [], "ssim": []} for preset in args.presets
+    }
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for index, prompt in enumerate(PROMPTS[:args.prompts]):
+            seed = base_seed + index
+            reference: Optional[Path] = None
+            for preset in args.presets:
+                request = {
+                    "prompt": prompt,
+                    "seed": seed,
+                    "num_frames": args.frames,
+                    "num_inference_steps": args.steps,
+                    "aspect_ratio": args.aspect_ratio,
+                    "speed": preset,
+                }
+                video = workdir / f"{index}_{preset}.mp4"
+                started = time.perf_counter()
+                measured = await render(session, args, request, video)
+                print(f"prompt {index} {preset:<9} sampling {measured['sampling']:7.1f}s  "
+                      f"(wall {time.perf_counter() - started:.1f}s)", file=sys.stderr)
+                results[preset]["sampling"].append(measured["sampling"])
+                results[preset]["total"].append(measured["total"])
+                if reference is None:
+                    reference = video
+                else:
+                    psnr, ssim = await similarity(args.ffmpeg, reference, video)
+                    results[preset]["psnr"].append(psnr)
+                    results[preset]["ssim"].append(ssim)
+
+    baseline = mean(results[args.presets[0]]["sampling"])
+    presets = {}
+    for preset, values in results.items():
+        sampling = mean(values["sampling"])
+        presets[preset] = {
+            "sampling_seconds": round(sampling, 2),
+            "job_seconds": round(mean(values["total"]), 2),
+            "speedup": round(baseline / sampling, 2) if sampling else None,
+            "psnr_db": round(mean(values["psnr"]), 2) if values["psnr"] else None,
+            "ssim": round(mean(values["ssim"]), 4) if values["ssim"] else None,
+        }
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "ffmpeg")},
+        "seed": base_seed,
+        "reference": args.presets[0],
+        "presets": presets,
+    }
+
+
+def print_report(result: dict):
+    print(f"reference: {result['reference']}  seed: {result['seed']}")
+    print(f"  {'preset':<10}{'sampling s':>11}{'job s':>9}{'speed-up':>10}{'PSNR dB':>9}{'SSIM':>8}")
+    for preset, row in result["presets"].items():
+        psnr = f"{row['psnr_db']:.2f}" if row["psnr_db"] is not None else "-"
+        ssim = f"{row['ssim']:.4f}" if row["ssim"] is not None else "-"
+        print(f"  {preset:<10}{row['sampling_seconds']:>11.2f}{row['job_seconds']:>9.2f}"
+              f"{row['speedup']:>9.2f}x{psnr:>9}{ssim:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="backend base URL")
+    parser.add_argument("--presets", nargs="+", choices=PRESETS, default=PRESETS,
+                        help="presets to compare; the first is the reference")
+    parser.add_argument("--prompts", type=int, default=2, choices=range(1, len(PROMPTS) + 1),
+                        metavar=f"1-{len(PROMPTS)}", help="prompts rendered with every preset")
+    parser.add_argument("--seed", type=int, help="first seed (random by default)")
+    parser.add_argument("--steps", type=int, default=30, help="num_inference_steps of each request")
+    parser.add_argument("--frames", type=int, default=81, help="num_frames of each request")
+    parser.add_argument("--aspect-ratio", choices=["portrait", "landscape"], default="portrait")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--json", type=Path, help="write results as JSON")
+    args = parser.parse_args()
+
+    args.ffmpeg = shutil.which(args.ffmpeg)
+    if args.ffmpeg is None:
+        parser.error("ffmpeg is required to compare the renders")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-speed-"))
+    try:
+        result = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Run the backend under uvicorn with an event-loop lag and memory probe
+
+Used by bench_load, which starts it as a subprocess; settings come from
+the environment as usual. Samples are written to --stats as JSON
+({"lag": [[time, seconds], ...], "rss": [[time, bytes], ...]}) every
+second and on shutdown.
+
+    python -m benchmarks.serve --port 8000 --stats stats.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+
+
+# Seconds between lag probes; lag is how late the loop wakes a sleeper
+PROBE_INTERVAL = 0.05
+# Samples kept (about ten minutes of probes)
+MAX_SAMPLES = 12000
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size in bytes (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopProbe:
+    def __init__(self, stats_path: Path):
+        self.stats_path = stats_path
+        self.lag: list[tuple[float, float]] = []
+        self.rss: list[tuple[float, int]] = []
+
+    async def sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(PROBE_INTERVAL)
+            now = time.time()
+            self.lag.append((now, max(0.0, loop.time() - started - PROBE_INTERVAL)))
+            rss = current_rss()
+            if rss is not None and len(self.lag) % 10 == 0:
+                self.rss.append((now, rss))
+            del self.lag[:-MAX_SAMPLES]
+            del self.rss[:-MAX_SAMPLES]
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(1.0)
+            await asyncio.to_thread(self.write)
+
+    def write(self):
+        data = {"lag": self.lag[:], "rss": self.rss[:], "peak_rss": peak_rss()}
+        partial = self.stats_path.with_name(self.stats_path.name + ".part")
+        partial.write_text(json.dumps(data))
+        os.replace(partial, self.stats_path)
+
+
+async def serve(host: str, port: int, stats_path: Path):
+    from app.main import app
+
+    probe = LoopProbe(stats_path)
+    tasks = [asyncio.create_task(probe.sample()), asyncio.create_task(probe.flush_periodically())]
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    try:
+        await server.serve()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        probe.write()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stats", type=Path, required=True, help="where to write probe samples")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.stats))
+
+
+if __name__ == "__main__":
+    main()
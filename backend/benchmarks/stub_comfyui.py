@@ -0,0 +1,415 @@
+"""Stand-in ComfyUI server that simulates execution without a GPU
+
+Implements the parts of the ComfyUI API the backend uses: /prompt,
+/history, /view, /upload/image, /system_stats, /queue, /interrupt, /free
+and the /ws event protocol (status, execution_start, execution_cached,
+executing, progress, executed, execution_success /
+execution_interrupted). Prompts run one at a time in submission order,
+as in ComfyUI.
+
+Node timing is simulated: each sampler step takes --step-seconds, model
+loaders take --load-seconds until the model is resident (/free unloads
+it), VAE decodes take --decode-seconds and other nodes --node-seconds.
+Nodes whose inputs match an earlier execution are served from the output
+cache. Output files are --output-bytes of filler, or a real --video.
+
+Run from the backend directory:
+
+    python -m benchmarks.stub_comfyui [--port 8188] [--step-seconds 0.05]
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiohttp import web, WSMsgType
+
+
+# Node results kept for reuse (ComfyUI's --cache-lru)
+CACHE_SIZE = 32
+
+OUTPUT_SUFFIXES = {
+    "SaveWEBM": ".webm",
+    "SaveAnimatedWEBP": ".webp",
+    "SaveAnimatedPNG": ".png",
+    "SaveVideo": ".mp4",
+    "VHS_VideoCombine": ".mp4",
+}
+
+
+@dataclass
+class Timing:
+    step_seconds: float = 0.05
+    load_seconds: float = 1.0
+    decode_seconds: float = 0.2
+    node_seconds: float = 0.01
+
+
+@dataclass
+class QueuedPrompt:
+    number: int
+    prompt_id: str
+    prompt: dict
+    client_id: Optional[str]
+    outputs: list[str]
+    messages: list = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+
+    def queue_entry(self) -> list:
+        return [self.number, self.prompt_id, self.prompt, {"client_id": self.client_id}, self.outputs]
+
+
+def execution_order(prompt: dict) -> list[str]:
+    """Topological order of the graph (inputs before the nodes that use them)"""
+    order: list[str] = []
+    visited: set[str] = set()
+
+    def visit(node_id: str):
+        if node_id in visited:
+            return
+        visited.add(node_id)
+        for value in prompt[node_id].get("inputs", {}).values():
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) in prompt:
+                visit(str(value[0]))
+        order.append(node_id)
+
+    for node_id in sorted(prompt, key=lambda key: (len(key), key)):
+        visit(node_id)
+    return order
+
+
+def is_output(node: dict) -> bool:
+    class_type = node.get("class_type", "")
+    return class_type.startswith(("Save", "Preview")) or class_type == "VHS_VideoCombine"
+
+
+class StubComfyUI:
+    def __init__(self, timing: Timing, output_bytes: int = 1024**2, video: Optional[Path] = None):
+        self.timing = timing
+        self.video = video
+        self.payload = (os.urandom(64 * 1024) * (output_bytes // (64 * 1024) + 1))[:output_bytes]
+        self.sockets: dict[str, set[web.WebSocketResponse]] = {}
+        self.pending: list[QueuedPrompt] = []
+        self.running: Optional[QueuedPrompt] = None
+        self.history: OrderedDict[str, dict] = OrderedDict()
+        self.resident: set[str] = set()
+        self.cache: OrderedDict[str, None] = OrderedDict()
+        self.files: dict[str, int] = {}
+        self.uploads: set[str] = set()
+        self.number = 0
+        self.counter = 0
+        self.executed = 0
+        self.execution_seconds = 0.0
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/ws", self.ws),
+            web.post("/prompt", self.post_prompt),
+            web.get("/history", self.get_history),
+            web.get("/history/{prompt_id}", self.get_history),
+            web.get("/view", self.view),
+            web.post("/upload/image", self.upload_image),
+            web.get("/system_stats", self.system_stats),
+            web.get("/queue", self.get_queue),
+            web.post("/queue", self.post_queue),
+            web.post("/interrupt", self.interrupt),
+            web.post("/free", self.free),
+            web.get("/stub/stats", self.stats),
+        ])
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+    async def _start(self, app: web.Application):
+        self._runner = asyncio.create_task(self._run_queue())
+
+    async def _stop(self, app: web.Application):
+        self._runner.cancel()
+        await asyncio.gather(self._runner, return_exceptions=True)
+        for sockets in list(self.sockets.values()):
+            for ws in list(sockets):
+                await ws.close()
+
+    # -- WebSocket events --------------------------------------------------
+
+    async def ws(self, request: web.Request) -> web.WebSocketResponse:
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.setdefault(client_id, set()).add(ws)
+        await ws.send_json({"type": "status", "data": {"status": self._status(), "sid": client_id}})
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.sockets[client_id].discard(ws)
+        return ws
+
+    def _status(self) -> dict:
+        return {"exec_info": {"queue_remaining": len(self.pending) + (self.running is not None)}}
+
+    async def _send(self, msg_type: str, data: dict, client_id: Optional[str] = None):
+        """Send to one client's sockets, or broadcast when client_id is None"""
+        if client_id is None:
+            targets = [ws for sockets in self.sockets.values() for ws in sockets]
+        else:
+            targets = list(self.sockets.get(client_id, ()))
+        message = json.dumps({"type": msg_type, "data": data})
+        for ws in targets:
+            try:
+                await ws.send_str(message)
+            except ConnectionError:
+                pass
+
+    async def _event(self, item: QueuedPrompt, msg_type: str, data: dict, record: bool = False):
+        data = {**data, "prompt_id": item.prompt_id}
+        if record:
+            item.messages.append([msg_type, {**data, "timestamp": int(time.time() * 1000)}])
+        await self._send(msg_type, data, item.client_id)
+
+    # -- Execution ---------------------------------------------------------
+
+    async def _run_queue(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            item = self.pending.pop(0)
+            self.running = item
+            item.task = asyncio.create_task(self._execute(item))
+            await asyncio.gather(item.task, return_exceptions=True)
+            self.running = None
+            await self._send("status", {"status": self._status()})
+
+    def _signatures(self, prompt: dict, order: list[str]) -> dict[str, str]:
+        """Hash of each node's class, inputs and upstream signatures (its cache key)"""
+        signatures: dict[str, str] = {}
+        for node_id in order:
+            inputs = {}
+            for name, value in prompt[node_id].get("inputs", {}).items():
+                if isinstance(value, list) and len(value) == 2 and str(value[0]) in signatures:
+                    value = [signatures[str(value[0])], value[1]]
+                inputs[name] = value
+            canonical = json.dumps([prompt[node_id]["class_type"], inputs], sort_keys=True)
+            signatures[node_id] = hashlib.sha256(canonical.encode()).hexdigest()
+        return signatures
+
+    def _node_seconds(self, node: dict, signature: str) -> float:
+        class_type = node["class_type"]
+        if "Loader" in class_type:
+            if signature in self.resident:
+                return self.timing.node_seconds
+            self.resident.add(signature)
+            return self.timing.load_seconds
+        if class_type.startswith("VAEDecode"):
+            return self.timing.decode_seconds
+        return self.timing.node_seconds
+
+    def _steps(self, node: dict) -> int:
+        inputs = node.get("inputs", {})
+        steps = inputs.get("steps")
+        if not node["class_type"].startswith(("KSampler", "SamplerCustom")) or not isinstance(steps, int):
+            return 0
+        start = inputs.get("start_at_step", 0)
+        end = min(inputs.get("end_at_step", steps), steps)
+        return max(0, end - start)
+
+    def _write_output(self, node: dict) -> dict:
+        suffix = self.video.suffix if self.video else OUTPUT_SUFFIXES.get(node["class_type"], ".png")
+        prefix = node.get("inputs", {}).get("filename_prefix", "ComfyUI")
+        if not isinstance(prefix, str):
+            prefix = "ComfyUI"
+        self.counter += 1
+        filename = f"{prefix}_{self.counter:05}_{suffix}"
+        file_type = "temp" if node["class_type"].startswith("Preview") else "output"
+        self.files[filename] = self.counter
+        entry = {"filename": filename, "subfolder": "", "type": file_type}
+        if node["class_type"] == "VHS_VideoCombine":
+            return {"gifs": [entry]}
+        return {"images": [entry], "animated": [node["class_type"] in OUTPUT_SUFFIXES]}
+
+    async def _execute(self, item: QueuedPrompt):
+        prompt = item.prompt
+        order = execution_order(prompt)
+        signatures = self._signatures(prompt, order)
+        started = time.monotonic()
+        outputs: dict[str, dict] = {}
+        current: Optional[str] = None
+        try:
+            await self._event(item, "execution_start", {}, record=True)
+            cached = [node_id for node_id in order if signatures[node_id] in self.cache and not is_output(prompt[node_id])]
+            await self._event(item, "execution_cached", {"nodes": cached}, record=True)
+
+            for node_id in order:
+                if node_id in cached:
+                    self.cache.move_to_end(signatures[node_id])
+                    continue
+                current = node_id
+                node = prompt[node_id]
+                await self._event(item, "executing", {"node": node_id, "display_node": node_id})
+                steps = self._steps(node)
+                if steps:
+                    for step in range(steps):
+                        await asyncio.sleep(self.timing.step_seconds)
+                        await self._event(item, "progress", {"value": step + 1, "max": steps, "node": node_id})
+                else:
+                    await asyncio.sleep(self._node_seconds(node, signatures[node_id]))
+
+                if is_output(node):
+                    outputs[node_id] = self._write_output(node)
+                    await self._event(item, "executed", {"node": node_id, "display_node": node_id, "output": outputs[node_id]})
+                self.cache[signatures[node_id]] = None
+                while len(self.cache) > CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        except asyncio.CancelledError:
+            await self._event(item, "execution_interrupted", {
+                "node_id": current, "node_type": prompt.get(current or "", {}).get("class_type"), "executed": [],
+            }, record=True)
+            self._record(item, outputs, "error")
+            raise
+
+        self.executed += 1
+        self.execution_seconds += time.monotonic() - started
+        await self._event(item, "execution_success", {}, record=True)
+        self._record(item, outputs, "success")
+        await self._event(item, "executing", {"node": None})
+
+    def _record(self, item: QueuedPrompt, outputs: dict, status: str):
+        self.history[item.prompt_id] = {
+            "prompt": item.queue_entry(),
+            "outputs": outputs,
+            "status": {"status_str": status, "completed": status == "success", "messages": item.messages},
+            "meta": {},
+        }
+        while len(self.history) > 10000:
+            self.history.popitem(last=False)
+
+    # -- HTTP API ----------------------------------------------------------
+
+    async def post_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body.get("prompt")
+        node_errors = {}
+        if isinstance(prompt, dict):
+            for node_id, node in prompt.items():
+                if not isinstance(node, dict) or "class_type" not in node:
+                    node_errors[node_id] = {"errors": [{"type": "missing_node_type"}], "class_type": None}
+                elif node["class_type"] == "LoadImage" and node.get("inputs", {}).get("image") not in self.uploads:
+                    node_errors[node_id] = {"errors": [{"type": "custom_validation_failed"}], "class_type": "LoadImage"}
+        if not isinstance(prompt, dict) or not prompt or node_errors:
+            return web.json_response({
+                "error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"},
+                "node_errors": node_errors,
+            }, status=400)
+
+        self.number += 1
+        item = QueuedPrompt(
+            number=self.number,
+            prompt_id=body.get("prompt_id") or str(uuid.uuid4()),
+            prompt=prompt,
+            client_id=body.get("client_id"),
+            outputs=[node_id for node_id, node in prompt.items() if is_output(node)],
+        )
+        self.pending.append(item)
+        self._wakeup.set()
+        await self._send("status", {"status": self._status()})
+        return web.json_response({"prompt_id": item.prompt_id, "number": item.number, "node_errors": {}})
+
+    async def get_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id is None:
+            return web.json_response(dict(self.history))
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry else {})
+
+    async def view(self, request: web.Request) -> web.StreamResponse:
+        if request.query.get("filename") not in self.files:
+            raise web.HTTPNotFound()
+        if self.video is not None:
+            return web.FileResponse(self.video)
+        return web.Response(body=self.payload, content_type="application/octet-stream")
+
+    async def upload_image(self, request: web.Request) -> web.Response:
+        """Accept an input image (contents are discarded) so LoadImage can refer to it"""
+        form = await request.post()
+        image = form.get("image")
+        if not isinstance(image, web.FileField):
+            raise web.HTTPBadRequest()
+        subfolder = str(form.get("subfolder", ""))
+        self.uploads.add(f"{subfolder}/{image.filename}" if subfolder else image.filename)
+        return web.json_response({"name": image.filename, "subfolder": subfolder, "type": "input"})
+
+    async def system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "system": {"os": os.name, "comfyui_version": "stub", "python_version": "", "embedded_python": False},
+            "devices": [{
+                "name": "stub", "type": "cpu", "index": 0,
+                "vram_total": 24 * 1024**3, "vram_free": 24 * 1024**3,
+                "torch_vram_total": 0, "torch_vram_free": 0,
+            }],
+        })
+
+    async def get_queue(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "queue_running": [self.running.queue_entry()] if self.running else [],
+            "queue_pending": [item.queue_entry() for item in self.pending],
+        })
+
+    async def post_queue(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("clear"):
+            self.pending.clear()
+        delete = set(body.get("delete", []))
+        self.pending = [item for item in self.pending if item.prompt_id not in delete]
+        return web.Response()
+
+    async def interrupt(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.can_read_body else {}
+        running = self.running
+        if running is not None and body.get("prompt_id") in (None, running.prompt_id):
+            running.task.cancel()
+        return web.Response()
+
+    async def free(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("unload_models"):
+            self.resident.clear()
+        if body.get("free_memory"):
+            self.cache.clear()
+        return web.Response()
+
+    async def stats(self, request: web.Request) -> web.Response:
+        """Not part of ComfyUI: totals for the benchmark report"""
+        return web.json_response({"executed": self.executed, "execution_seconds": round(self.execution_seconds, 3)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--step-seconds", type=float, default=Timing.step_seconds, help="time per sampler step")
+    parser.add_argument("--load-seconds", type=float, default=Timing.load_seconds, help="time per model load")
+    parser.add_argument("--decode-seconds", type=float, default=Timing.decode_seconds, help="time per VAE decode")
+    parser.add_argument("--node-seconds", type=float, default=Timing.node_seconds, help="time per other node")
+    parser.add_argument("--output-bytes", type=int, default=1024**2, help="size of each output file")
+    parser.add_argument("--video", type=Path, help="serve this file as every output instead of filler")
+    args = parser.parse_args()
+
+    timing = Timing(args.step_seconds, args.load_seconds, args.decode_seconds, args.node_seconds)
+    stub = StubComfyUI(timing, args.output_bytes, args.video)
+    web.run_app(stub.app(), host=args.host, port=args.port, print=None, shutdown_timeout=1.0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react'
+import { useState, useEffect } from 'react'
 import './App.css'
 
 const API_BASE = ''
@@ -6,7 +6,9 @@ const API_BASE = ''
 function App() {
   // Model status
   const [modelLoaded, setModelLoaded] = useState(false)
+  const [modelState, setModelState] = useState('cold')
   const [status, setStatus] = useState({ status: 'idle', progress: 0, message: '' })
+  const [jobId, setJobId] = useState(null)
 
   // Form state
   const [prompt, setPrompt] = useState('')
@@ -17,27 +19,14 @@ function App() {
   const [guidanceScale, setGuidanceScale] = useState(5.0)
   const [seed, setSeed] = useState('')
   const [fps, setFps] = useState(16)
+  const [quality, setQuality] = useState('full')
+  const [speed, setSpeed] = useState('quality')
+  const [draftJobId, setDraftJobId] = useState(null)
 
   // Video state
   const [videos, setVideos] = useState([])
   const [selectedVideo, setSelectedVideo] = useState(null)
 
-  // Fetch status periodically
-  const fetchStatus = useCallback(async () => {
-    try {
-      const res = await fetch(`${API_BASE}/api/status`)
-      const data = await res.json()
-      setStatus(data)
-
-      // Check if generation completed
-      if (data.status === 'completed') {
-        fetchVideos()
-      }
-    } catch (err) {
-      console.error('Failed to fetch status:', err)
-    }
-  }, [])
-
   // Fetch videos list
   const fetchVideos = async () => {
     try {
@@ -52,49 +41,98 @@ function App() {
     }
   }
 
-  // Check health on mount
+  // Check health and reattach to an active job on mount
   useEffect(() => {
     const checkHealth = async () => {
       try {
         const res = await fetch(`${API_BASE}/api/health`)
         const data = await res.json()
         setModelLoaded(data.model_loaded)
+        setModelState(data.model_state)
       } catch (err) {
         console.error('Failed to check health:', err)
       }
     }
+    const findActiveJob = async () => {
+      try {
+        for (const state of ['running', 'queued']) {
+          const res = await fetch(`${API_BASE}/api/jobs?status=${state}&limit=1`)
+          const data = await res.json()
+          if (data.jobs.length > 0) {
+            setJobId(data.jobs[0].job_id)
+            return
+          }
+        }
+      } catch (err) {
+        console.error('Failed to fetch jobs:', err)
+      }
+    }
     checkHealth()
     fetchVideos()
+    findActiveJob()
   }, [])
 
-  // Poll status when generating or loading
+  // Follow the current job over Server-Sent Events
   useEffect(() => {
-    if (status.status === 'generating' || status.status === 'loading') {
-      const interval = setInterval(fetchStatus, 1000)
-      return () => clearInterval(interval)
+    if (!jobId) return
+
+    const source = new EventSource(`${API_BASE}/api/jobs/${jobId}/events`)
+    source.onmessage = (e) => {
+      const job = JSON.parse(e.data)
+      let message = job.message
+      if (job.status === 'queued' && job.queue_position != null) {
+        message = `Queued (position ${job.queue_position + 1})`
+      }
+      if (job.eta_seconds != null && (job.status === 'queued' || job.status === 'running')) {
+        message += ` · ETA ${Math.ceil(job.eta_seconds)}s`
+      }
+
+      if (job.status === 'completed' || job.status === 'error' || job.status === 'cancelled') {
+        source.close()
+        setJobId(null)
+        setStatus({ status: job.status === 'cancelled' ? 'idle' : job.status, progress: job.progress, message })
+        if (job.status === 'completed') {
+          fetchVideos()
+          if (job.video_url) setSelectedVideo(job.video_url)
+        }
+      } else {
+        setStatus({ status: 'generating', progress: job.progress, message })
+      }
     }
-  }, [status.status, fetchStatus])
+    source.onerror = () => {
+      // EventSource reconnects on its own; the server replays a snapshot first
+      console.error('Progress stream interrupted, reconnecting...')
+    }
+    return () => source.close()
+  }, [jobId])
 
   // Load model
   const handleLoadModel = async () => {
+    setStatus({ status: 'loading', progress: 0, message: 'Connecting to ComfyUI...' })
     try {
-      await fetch(`${API_BASE}/api/load-model`, { method: 'POST' })
-      setStatus({ status: 'loading', progress: 0, message: 'Loading model...' })
-
-      // Poll until loaded
-      const checkLoaded = setInterval(async () => {
-        const res = await fetch(`${API_BASE}/api/health`)
-        const data = await res.json()
-        if (data.model_loaded) {
-          setModelLoaded(true)
-          clearInterval(checkLoaded)
-        }
-      }, 2000)
+      const res = await fetch(`${API_BASE}/api/load-model`, { method: 'POST' })
+      setModelLoaded(res.ok)
+      if (res.ok) {
+        setStatus({ status: 'idle', progress: 1, message: 'ComfyUI is ready' })
+      } else {
+        const error = await res.json()
+        setStatus({ status: 'error', progress: 0, message: error.detail || 'ComfyUI is not running' })
+      }
     } catch (err) {
       console.error('Failed to load model:', err)
+      setStatus({ status: 'error', progress: 0, message: 'Failed to reach the server' })
     }
   }
 
+  // Start loading models as soon as the user looks like they will generate
+  const handlePromptFocus = () => {
+    if (!modelLoaded || modelState !== 'cold') return
+    setModelState('warming')
+    fetch(`${API_BASE}/api/load-model`, { method: 'POST' }).catch((err) => {
+      console.error('Failed to warm up models:', err)
+    })
+  }
+
   // Unload model
   const handleUnloadModel = async () => {
     try {
@@ -124,23 +162,77 @@ function App() {
           num_inference_steps: numInferenceSteps,
           guidance_scale: guidanceScale,
           seed: seed ? parseInt(seed) : null,
-          fps
+          fps,
+          quality,
+          speed
         })
       })
 
+      const data = await res.json()
       if (!res.ok) {
-        const error = await res.json()
-        alert(error.detail || 'Generation failed')
+        alert(data.detail || 'Generation failed')
+        return
+      }
+
+      setDraftJobId(quality === 'draft' ? data.job_id : null)
+      if (data.video_url) {
+        setStatus({ status: 'completed', progress: 1, message: data.message })
+        fetchVideos()
+        setSelectedVideo(data.video_url)
         return
       }
 
       setStatus({ status: 'generating', progress: 0, message: 'Starting generation...' })
+      setJobId(data.job_id)
     } catch (err) {
       console.error('Failed to generate:', err)
       alert('Failed to start generation')
     }
   }
 
+  // Re-render the last draft at full quality with the same seed
+  const handlePromote = async () => {
+    try {
+      const res = await fetch(`${API_BASE}/api/jobs/${draftJobId}/promote`, { method: 'POST' })
+      const data = await res.json()
+      if (!res.ok) {
+        alert(data.detail || 'Promotion failed')
+        return
+      }
+
+      setDraftJobId(null)
+      if (data.video_url) {
+        setStatus({ status: 'completed', progress: 1, message: data.message })
+        fetchVideos()
+        setSelectedVideo(data.video_url)
+        return
+      }
+
+      setStatus({ status: 'generating', progress: 0, message: 'Starting full-quality render...' })
+      setJobId(data.job_id)
+    } catch (err) {
+      console.error('Failed to promote:', err)
+      alert('Failed to start full-quality render')
+    }
+  }
+
+  // Cancel the job being followed (frees its GPU if it already started)
+  const handleCancel = async () => {
+    try {
+      const res = await fetch(`${API_BASE}/api/jobs/${jobId}`, { method: 'DELETE' })
+      const data = await res.json()
+      if (!res.ok) {
+        console.error('Failed to cancel:', data.detail)
+      } else if (data.status === 'queued' || data.status === 'running') {
+        // Shared with identical requests from others: it keeps running for them
+        setJobId(null)
+        setStatus({ status: 'idle', progress: 0, message: 'Cancelled' })
+      }
+    } catch (err) {
+      console.error('Failed to cancel:', err)
+    }
+  }
+
   // Random seed
   const handleRandomSeed = () => {
     setSeed(Math.floor(Math.random() * 4294967295).toString())
@@ -159,7 +251,8 @@ function App() {
     if (status.status === 'loading') return 'Connecting...'
     if (status.status === 'generating') return 'Generating...'
     if (status.status === 'error') return 'Error'
-    if (modelLoaded) return 'ComfyUI Ready'
+    if (modelLoaded && modelState === 'warming') return 'Loading Models...'
+    if (modelLoaded) return modelState === 'warm' ? 'ComfyUI Ready' : 'ComfyUI Ready (models not loaded)'
     return 'ComfyUI Not Running'
   }
 
@@ -205,6 +298,7 @@ function App() {
               <textarea
                 value={prompt}
                 onChange={(e) => setPrompt(e.target.value)}
+                onFocus={handlePromptFocus}
                 placeholder="Describe the video you want to generate..."
                 disabled={isGenerating}
               />
@@ -222,21 +316,65 @@ function App() {
 
           {/* Aspect Ratio Section */}
           <div className="panel">
-            <h3 className="panel-title">Aspect Ratio (480P)</h3>
+            <h3 className="panel-title">Aspect Ratio</h3>
             <div className="ratio-selector">
               <div
                 className={`ratio-option ${aspectRatio === 'portrait' ? 'selected' : ''}`}
                 onClick={() => !isGenerating && setAspectRatio('portrait')}
               >
                 <div className="ratio-preview portrait"></div>
-                <span className="ratio-label">Portrait (480x832)</span>
+                <span className="ratio-label">Portrait (9:16)</span>
               </div>
               <div
                 className={`ratio-option ${aspectRatio === 'landscape' ? 'selected' : ''}`}
                 onClick={() => !isGenerating && setAspectRatio('landscape')}
               >
                 <div className="ratio-preview landscape"></div>
-                <span className="ratio-label">Landscape (832x480)</span>
+                <span className="ratio-label">Landscape (16:9)</span>
+              </div>
+            </div>
+          </div>
+
+          {/* Quality Section */}
+          <div className="panel">
+            <h3 className="panel-title">Quality</h3>
+            <div className="ratio-selector">
+              <div
+                className={`ratio-option ${quality === 'full' ? 'selected' : ''}`}
+                onClick={() => !isGenerating && setQuality('full')}
+              >
+                <span className="ratio-label">Full</span>
+              </div>
+              <div
+                className={`ratio-option ${quality === 'draft' ? 'selected' : ''}`}
+                onClick={() => !isGenerating && setQuality('draft')}
+              >
+                <span className="ratio-label">Draft (fast preview)</span>
+              </div>
+            </div>
+          </div>
+
+          {/* Speed Section */}
+          <div className="panel">
+            <h3 className="panel-title">Speed</h3>
+            <div className="ratio-selector">
+              <div
+                className={`ratio-option ${speed === 'quality' ? 'selected' : ''}`}
+                onClick={() => !isGenerating && setSpeed('quality')}
+              >
+                <span className="ratio-label">Quality</span>
+              </div>
+              <div
+                className={`ratio-option ${speed === 'balanced' ? 'selected' : ''}`}
+                onClick={() => !isGenerating && setSpeed('balanced')}
+              >
+                <span className="ratio-label">Balanced</span>
+              </div>
+              <div
+                className={`ratio-option ${speed === 'fast' ? 'selected' : ''}`}
+                onClick={() => !isGenerating && setSpeed('fast')}
+              >
+                <span className="ratio-label">Fast</span>
               </div>
             </div>
           </div>
@@ -348,6 +486,16 @@ function App() {
               {isGenerating ? 'Generating...' : 'Generate Video'}
             </button>
 
+            {draftJobId && status.status === 'completed' && (
+              <button
+                className="btn btn-secondary btn-full"
+                onClick={handlePromote}
+                disabled={!modelLoaded}
+              >
+                Render Full Quality (same seed)
+              </button>
+            )}
+
             {(isGenerating || isLoading) && (
               <>
                 <div className="progress-bar">
@@ -357,6 +505,11 @@ function App() {
                   ></div>
                 </div>
                 <p className="status-message">{status.message}</p>
+                {isGenerating && jobId && (
+                  <button className="btn btn-secondary btn-full" onClick={handleCancel}>
+                    Cancel
+                  </button>
+                )}
               </>
             )}
           </div>
@@ -395,7 +548,12 @@ function App() {
                     className={`video-thumbnail ${selectedVideo === video.url ? 'selected' : ''}`}
                     onClick={() => setSelectedVideo(video.url)}
                   >
-                    <video src={video.url} muted />
+                    <video
+                      src={video.preview_url || video.url}
+                      poster={video.poster_url || undefined}
+                      preload={video.poster_url ? 'none' : 'metadata'}
+                      muted
+                    />
                   </div>
                 ))}
               </div>
@@ -2,19 +2,38 @@
 """
 Run script for WAN 2.2 Short Video Generator
 This script starts the FastAPI server which serves both the API and the React frontend.
+
+    python run.py               # one process with auto-reload (development)
+    python run.py --workers 4   # four API processes sharing one job queue
 """
-import uvicorn
+import os
 import sys
+import argparse
+import uvicorn
 from pathlib import Path
 
 # Add backend to path
 sys.path.insert(0, str(Path(__file__).parent / "backend"))
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        reload_dirs=["backend/app"]
+    parser = argparse.ArgumentParser(description="Start the Short Video Generator server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="API processes; more than one disables auto-reload and shares job state through data_dir",
     )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Every worker reads this to switch to shared (multi-process) mode
+        os.environ["WORKERS"] = str(args.workers)
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            reload=True,
+            reload_dirs=["backend/app"]
+        )
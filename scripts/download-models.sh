@@ -23,6 +23,14 @@ huggingface-cli download QuantStack/Wan2.2-T2V-A14B-GGUF \
     --include "LowNoise/*Q4_K_S*" \
     --local-dir ./models/diffusion_models
 
+# Image-to-video models, used by long videos to continue each segment (WITH_I2V=1, ~17.5GB)
+if [ "${WITH_I2V:-0}" = "1" ]; then
+    echo "Downloading I2V HighNoise/LowNoise models (Q4_K_S)..."
+    huggingface-cli download QuantStack/Wan2.2-I2V-A14B-GGUF \
+        --include "HighNoise/*Q4_K_S*" "LowNoise/*Q4_K_S*" \
+        --local-dir ./models/diffusion_models
+fi
+
 # Download VAE
 echo "Downloading VAE..."
 huggingface-cli download QuantStack/Wan2.2-T2V-A14B-GGUF \
@@ -1,5 +1,6 @@
 #!/bin/bash
 # Start FastAPI backend server
+# WORKERS=4 ./scripts/start-backend.sh runs four API processes without reload
 
 set -e
 
@@ -10,4 +11,8 @@ echo "Backend will be available at http://localhost:8000"
 echo ""
 
 source ../venv/bin/activate
-uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
+if [ "${WORKERS:-1}" -gt 1 ]; then
+    uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers "$WORKERS"
+else
+    uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
+fi
@@ -10,4 +10,5 @@ echo "ComfyUI will be available at http://localhost:8188"
 echo ""
 
 source venv/bin/activate
-python main.py --listen --port 8188
+# --cache-lru keeps text encodings (and loaded models) of recent prompts for reuse
+python main.py --listen --port 8188 --cache-lru "${COMFYUI_CACHE_LRU:-32}"
@@ -56,7 +56,8 @@ sleep 1
 echo -e "${YELLOW}[1/2] ComfyUI 시작 중...${NC}"
 cd comfyui
 source venv/bin/activate
-python main.py --listen --port 8188 > /tmp/comfyui.log 2>&1 &
+# --cache-lru: 최근 프롬프트의 텍스트 인코딩 결과를 캐시해 재사용
+python main.py --listen --port 8188 --cache-lru "${COMFYUI_CACHE_LRU:-32}" > /tmp/comfyui.log 2>&1 &
 COMFYUI_PID=$!
 echo $COMFYUI_PID >> "../$PID_FILE"
 cd ..